@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""lint_scaling: benchmarks parsing of the Sample Template sheet in lint.py
+About:
+      Builds synthetic Sample Template sheets with an increasing number of samples
+    and times the vectorized parser in src/lint.py against the previous row-wise
+    DataFrame.iterrows() parser, taking the best of three runs. The output of both
+    parsers is compared to ensure the parsed sample metadata is identical.
+USAGE:
+	$ python dev/benchmarks/lint_scaling.py [N_COLUMNS]
+Example:
+    $ python dev/benchmarks/lint_scaling.py 100
+"""
+
+# Python standard library
+from __future__ import print_function
+import sys, os, time
+
+# 3rd party imports from pypi
+import pandas as pd
+
+# Local imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'src'))
+import lint
+
+
+def synthetic_sheet(nsamples, ncolumns):
+    """Creates a synthetic Sample Template sheet, as read by pd.read_excel(header=None).
+    @param nsamples <int>:
+        Number of samples or rows to create
+    @param ncolumns <int>:
+        Number of metadata fields or columns to create
+    @return df <pandas.DataFrame>:
+        Sample Template sheet with a 'Sample ID' header line
+    """
+    header = ['Sample ID'] + ['Field {}'.format(j) for j in range(ncolumns)] + [float('nan')]
+    rows = [header]
+    for i in range(nsamples):
+        row = [' S{} '.format(i)]
+        for j in range(ncolumns):
+            # Mix of strings, integers, floats and empty cells
+            row.append([' value{} '.format(i), i, i / 3.0, float('nan')][j % 4])
+        rows.append(row + [float('nan')])
+
+    return pd.DataFrame(rows)
+
+
+def iterrows_sample(excel_df):
+    """Previous row-wise implementation of lint.sample() used as a reference.
+    @param excel_df <pandas.DataFrame>:
+        Sample Template sheet to parse
+    @return metadata <dict>:
+        Nested dictionary where [key1] = SampleID, [key2] = field
+    """
+    metadata = {}
+    for i, row in excel_df.iterrows():
+        attr, *value_list = [str(field).lstrip().rstrip() for field in row]
+        if not attr or attr == 'nan' or attr.lower().startswith('optional field'):
+            continue
+        if attr.lower() == 'sample id':
+            header = lint._remove_trailing_nan(value_list)
+            sid_field = attr
+            continue
+        metadata[attr] = {}
+        for j in range(0, len(header), 1):
+            metadata[attr][header[j]] = value_list[j]
+        metadata[attr][sid_field] = attr
+
+    return metadata
+
+
+def vectorized_sample(excel_df):
+    """Builds the same nested dictionary as lint.sample() without writing logs.
+    @param excel_df <pandas.DataFrame>:
+        Sample Template sheet to parse
+    @return metadata <dict>:
+        Nested dictionary where [key1] = SampleID, [key2] = field
+    """
+    metadata = {}
+    for fields, lines in lint._parsed_sample(lint._cleaned(excel_df)):
+        for sid, sample_metadata in lint._transposed(fields, lines).items():
+            if sid not in metadata:
+                metadata[sid] = sample_metadata
+            else:
+                metadata[sid].update(sample_metadata)
+
+    return metadata
+
+
+def timed(func, *args, repeats=3):
+    """Returns the result of running a function and its best elapsed time in seconds
+    over a number of repeats, so the timings of small sheets are not just noise.
+    """
+    best = None
+    for i in range(repeats):
+        ts = time.time()
+        result = func(*args)
+        elapsed = time.time() - ts
+        best = elapsed if best is None else min(best, elapsed)
+
+    return result, best
+
+
+def main():
+
+    ncolumns = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    print('samples\tcolumns\titerrows_s\tvectorized_s\tspeedup')
+    for nsamples in [100, 1000, 5000, 10000, 20000]:
+        df = synthetic_sheet(nsamples, ncolumns)
+        expected, legacy = timed(iterrows_sample, df)
+        observed, vectorized = timed(vectorized_sample, df)
+        assert expected == observed, 'Parsed sample metadata differs for {} samples'.format(nsamples)
+        print('{}\t{}\t{:.3f}\t{:.3f}\t{:.1f}x'.format(nsamples, ncolumns, legacy, vectorized, legacy / vectorized))
+
+
+if __name__ == '__main__':
+    main()
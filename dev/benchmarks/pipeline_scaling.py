@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""pipeline_scaling: benchmarks each stage of a pyrkit run with an increasing number of samples
+About:
+      Generates a synthetic pipeline output directory for each number of samples (see
+    synthetic.py), runs every stage of 'pyrkit extract' on it followed by building the
+    combined TIN matrix, and records the wall time and peak RSS of each stage from the
+    run report of the pipeline's tracer (see dev/src/benchmark.py). Each run is done in
+    a new process, so the peak RSS of a stage is not inherited from a previous run.
+    The results are compared against the stored baselines in baselines.json, a stage
+    fails if it is slower or uses more memory than its baseline beyond the tolerance
+    below. Use --update to record new baselines after an intended change.
+    Exits with a non-zero exit-code if any stage is over its baseline.
+USAGE:
+	$ python dev/benchmarks/pipeline_scaling.py [--update] [-t TMPDIR] [N_SAMPLES ...]
+Example:
+    $ python dev/benchmarks/pipeline_scaling.py
+    $ python dev/benchmarks/pipeline_scaling.py 10 100
+    $ python dev/benchmarks/pipeline_scaling.py --update -t /scratch/$USER 10 100 1000 10000
+"""
+
+# Python standard library
+from __future__ import print_function
+import sys, os, json, shutil, tempfile, subprocess
+
+# Repository root, pipeline and baselines are relative to it
+home = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+baselines = os.path.join(home, 'dev', 'benchmarks', 'baselines.json')
+
+# Stored baselines are recorded for each number of samples
+sizes = [10, 100, 1000, 10000]
+
+# Tolerance of each measurement as a (factor, slack), a stage fails if its measurement
+# is over baseline * factor + slack, the slack absorbs noise in short or small stages
+tolerance = {
+    'wall_s': (2.0, 0.25),
+    'peak_rss_mb': (1.25, 32)
+}
+
+
+def run(directory, report):
+    """Runs every stage of a pyrkit run on a synthetic pipeline output directory and
+    saves the run report of the pipeline's tracer.
+    @param directory <str>:
+        Synthetic pipeline output directory, see synthetic.generate()
+    @param report <str>:
+        Output JSON run report
+    """
+    sys.path.insert(0, os.path.join(home, 'dev', 'src'))
+    from pipeline import extract, tracer
+    import create_tin_matrix
+
+    extract(directory, '/CCBR_EXT_Archive', os.path.join(directory, 'experiment_metadata.xlsx'),
+        os.path.join(directory, 'multiqc'), 'ccbr-123')
+    tin = os.path.join(directory, 'RSeQC')
+    with tracer.span('tin') as span:
+        files = sorted(os.path.join(tin, f) for f in os.listdir(tin))
+        create_tin_matrix.create(files, os.path.join(directory, 'DME', 'combined_TIN.tsv'), threads = 2)
+        span.count(files = len(files))
+    tracer.save(report)
+
+
+def stages(report):
+    """Flattens the stages of a run report, nested stages are named after their parent.
+    @param report <dict>:
+        Run report of the pipeline's tracer
+    @return stages <dict>:
+        Nested dictionary where [key1] = stage (i.e. extract/lint), [key2] = measurement
+    """
+    flattened = {}
+    def walk(spans, parent):
+        for span in spans:
+            name = '{}/{}'.format(parent, span['name']) if parent else span['name']
+            if name in flattened:
+                # Repeated sub-steps, i.e. extract/links/stage of each module
+                flattened[name]['wall_s'] += span['wall_s']
+                flattened[name]['peak_rss_mb'] = max(flattened[name]['peak_rss_mb'], span['peak_rss_mb'])
+            else:
+                flattened[name] = {key: span[key] for key in tolerance}
+            walk(span.get('spans', []), name)
+    walk(report['spans'], '')
+
+    return {name: {key: round(value, 3) for key, value in measurements.items()} for name, measurements in flattened.items()}
+
+
+def benchmark(nsamples, tmpdir = None):
+    """Generates a synthetic pipeline output directory with N samples and benchmarks it.
+    @param nsamples <int>:
+        Number of samples
+    @param tmpdir <str>:
+        Parent directory of the synthetic pipeline output directory
+    @return stages <dict>:
+        Measurements of each stage, see stages()
+    """
+    import synthetic
+
+    directory = tempfile.mkdtemp(prefix = 'pyrkit_{}_'.format(nsamples), dir = tmpdir)
+    try:
+        synthetic.generate(directory, nsamples)
+        report = os.path.join(directory, 'run_report.json')
+        process = subprocess.run([sys.executable, '-W', 'ignore', os.path.abspath(__file__), '--run', directory, report],
+            cwd = directory, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, universal_newlines = True)
+        if process.returncode != 0:
+            print(process.stderr, file=sys.stderr)
+            raise subprocess.CalledProcessError(process.returncode, process.args)
+        with open(report) as fh:
+            return stages(json.load(fh))
+    finally:
+        shutil.rmtree(directory, ignore_errors = True)
+
+
+def compare(measured, baseline):
+    """Compares the measurements of a stage against its baseline.
+    @return status <str>:
+        'ok', 'no baseline' or the measurements that are over the baseline
+    """
+    if not baseline:
+        return 'no baseline'
+    over = []
+    for key, (factor, slack) in sorted(tolerance.items()):
+        if key in baseline and measured[key] > baseline[key] * factor + slack:
+            over.append('{} over baseline'.format(key))
+
+    return ', '.join(over) or 'ok'
+
+
+def main():
+
+    # Parse args
+    args = sys.argv[1:]
+    if '-h' in args or '--help' in args:
+        print(__doc__)
+        sys.exit()
+    if args[:1] == ['--run']:
+        run(*args[1:3])
+        sys.exit()
+
+    update = '--update' in args
+    args = [arg for arg in args if arg != '--update']
+    tmpdir = None
+    if '-t' in args:
+        i = args.index('-t')
+        try:
+            tmpdir = args[i+1]
+        except IndexError:
+            print(__doc__)
+            sys.exit(1)
+        args = args[:i] + args[i+2:]
+    try:
+        nsamples = [int(arg) for arg in args] or sizes
+    except ValueError:
+        print(__doc__)
+        sys.exit(1)
+
+    stored = {}
+    if os.path.exists(baselines):
+        with open(baselines) as fh:
+            stored = json.load(fh)
+
+    failed = []
+    print('samples\tstage\twall_s\tpeak_rss_mb\tbaseline_wall_s\tbaseline_peak_rss_mb\tstatus')
+    for n in nsamples:
+        measured = benchmark(n, tmpdir)
+        expected = stored.get(str(n), {})
+        for stage, measurements in measured.items():
+            baseline = expected.get(stage, {})
+            status = 'updated' if update else compare(measurements, baseline)
+            if status not in ['ok', 'updated', 'no baseline']:
+                failed.append('{}:{}'.format(n, stage))
+            print('{}\t{}\t{}\t{}\t{}\t{}\t{}'.format(n, stage, measurements['wall_s'], measurements['peak_rss_mb'],
+                baseline.get('wall_s', '-'), baseline.get('peak_rss_mb', '-'), status))
+        if update:
+            stored[str(n)] = measured
+
+    if update:
+        with open(baselines, 'w') as fh:
+            json.dump({n: stored[n] for n in sorted(stored, key = int)}, fh, indent = 4)
+            fh.write('\n')
+
+    if failed:
+        print('Error: {} stage(s) are over their baseline: {}'.format(len(failed), ', '.join(failed)), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
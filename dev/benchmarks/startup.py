@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""startup: benchmarks the startup time of each pyrkit entry point
+About:
+      Runs each entry point on a no-op code path (i.e. -h) with 'python -X importtime'
+    and sums the time spent importing modules, minus the imports of an empty python
+    interpreter. The median of several runs is compared against the committed budget
+    below. Heavy dependencies (i.e. pandas) should only be imported on the code paths
+    that need them, so importing a forbidden module on a no-op path is also a failure,
+    as is a no-op path that exits with a non-zero exit-code (i.e. an error path).
+    Exits with a non-zero exit-code if any entry point is over its budget.
+USAGE:
+	$ python dev/benchmarks/startup.py [-r REPEATS] [ENTRY_POINT ...]
+Example:
+    $ python dev/benchmarks/startup.py -r 7
+    $ python dev/benchmarks/startup.py src/meta
+"""
+
+# Python standard library
+from __future__ import print_function
+import sys, os, subprocess
+
+# Repository root, entry points are relative to it
+home = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+
+# Budget of import time in milliseconds for each entry point and its no-op arguments,
+# the budget is ~3x the import time on a developer workstation to absorb noisy runners
+budget = {
+    'src/lint.py': (['-h'], 60),
+    'src/pyparser.py': (['-h'], 30),
+    'src/create_tin_matrix.py': (['-h'], 30),
+    'src/excel2tsv.py': (['-h'], 15),
+    'src/initialize.py': (['-h'], 40),
+    'src/meta': (['-h'], 60),
+    'src/reformat.py': (['-h'], 15),
+    'src/compress.py': (['-h'], 30),
+    'src/stage.py': (['-h'], 15),
+    'src/sidecar.py': (['-h'], 15),
+    'src/profiler.py': (['-h'], 15),
+    'src/hashqueue.py': (['-h'], 15),
+    'src/fscache.py': (['-h'], 15),
+    'dev/pyrkit': (['-h'], 90)
+}
+
+# Modules that are too expensive to import on a no-op code path
+forbidden = ['pandas', 'numpy', 'openpyxl', 'xlrd', 'yaml']
+
+
+def importtime(cmd):
+    """Runs a command with 'python -X importtime' and parses its import times.
+    @param cmd list[<str>]:
+        Arguments passed to the python interpreter
+    @return total, modules, exitcode <tuple(<float>, set(<str>), <int>)>:
+        Total import time in milliseconds, the set of imported modules and the exit
+        code of the command
+    """
+    process = subprocess.run([sys.executable, '-X', 'importtime'] + cmd, cwd = home,
+        stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, universal_newlines = True)
+    total, modules = 0, set()
+    for line in process.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or line.endswith('imported package'):
+            continue
+        self_us, cumulative, package = line[len('import time:'):].split('|')
+        modules.add(package.strip())
+        if not package[1:].startswith(' '):
+            # Top-level imports, nested imports are included in their cumulative time
+            total += int(cumulative)
+
+    return total / 1000.0, modules, process.returncode
+
+
+def median(values):
+    """Returns the median of a list of numbers."""
+    values = sorted(values)
+    middle = len(values) // 2
+
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+
+def main():
+
+    # Parse args
+    args = sys.argv[1:]
+    if '-h' in args or '--help' in args:
+        print(__doc__)
+        sys.exit()
+
+    repeats = 5
+    for option in ['-r', '--repeats']:
+        if option in args:
+            i = args.index(option)
+            try:
+                repeats = int(args[i+1])
+            except (IndexError, ValueError):
+                print(__doc__)
+                sys.exit(1)
+            args = args[:i] + args[i+2:]
+    entries = args or sorted(budget)
+
+    # Imports of an empty interpreter (i.e. site, encodings)
+    baseline = median([importtime(['-c', 'pass'])[0] for i in range(repeats)])
+
+    failed = []
+    print('entry_point\timport_ms\tbudget_ms\tstatus')
+    for entry in entries:
+        noop, limit = budget.get(entry, (['-h'], None))
+        times, imported, exitcodes = [], set(), set()
+        for i in range(repeats):
+            elapsed, modules, exitcode = importtime([os.path.join(home, entry)] + noop)
+            times.append(elapsed - baseline)
+            imported |= modules
+            exitcodes.add(exitcode)
+        elapsed = median(times)
+        heavy = sorted(m for m in imported if m.split('.')[0] in forbidden)
+        status = 'ok'
+        if exitcodes != {0}:
+            status = 'exit-code {}'.format(max(exitcodes, key = abs))
+        elif heavy:
+            status = 'imports {}'.format(', '.join(m for m in heavy if '.' not in m) or heavy[0])
+        elif limit is not None and elapsed > limit:
+            status = 'over budget'
+        if status != 'ok':
+            failed.append(entry)
+        print('{}\t{:.1f}\t{}\t{}'.format(entry, elapsed, limit if limit is not None else '-', status))
+
+    if failed:
+        print('Error: {} entry point(s) failed the startup budget: {}'.format(len(failed), ', '.join(failed)), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""synthetic: generates a synthetic RNA-seq pipeline output directory with N samples
+About:
+      Fabricates a pipeline working directory that pyrkit can archive, which is used
+    to benchmark each stage of a run at scale (see pipeline_scaling.py). For each
+    sample, FASTQ and BAM files of a chosen size are created as sparse files (a small
+    valid header truncated to the requested size), along with Arriba fusions and
+    RSeQC TIN files. The RSEM counts matrices in DEG_ALL, the MultiQC text files and
+    the project request template (experiment_metadata.xlsx) are generated to match the
+    samples. MultiQC rows and template rows are cloned from the included examples in
+    data/example and data/experiment_metadata.xlsx and renamed after each sample.
+    The directory layout matches dev/config/rnaseq.yaml:
+        experiment_metadata.xlsx, config.json, {sample}.R{1,2}.fastq.gz
+        bams/, fusions/, DEG_ALL/, Reports/, RSeQC/, multiqc/, ref/
+USAGE:
+	$ python dev/benchmarks/synthetic.py [-f FASTQ_BYTES] [-b BAM_BYTES] OUTPUT_DIRECTORY N_SAMPLES
+Example:
+    $ python dev/benchmarks/synthetic.py -f 1048576 /scratch/$USER/synthetic_100 100
+    $ dev/pyrkit extract -i /scratch/$USER/synthetic_100 -o /CCBR_EXT_Archive \
+        -r /scratch/$USER/synthetic_100/experiment_metadata.xlsx \
+        -m /scratch/$USER/synthetic_100/multiqc
+"""
+
+# Python standard library
+from __future__ import print_function
+import sys, os, re, json, gzip, random, warnings
+
+# Repository root, example data is relative to it
+home = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+
+# Local imports
+sys.path.insert(0, os.path.join(home, 'src'))
+import pyparser
+
+# RSEM counts matrices in DEG_ALL, see rsem_* modules in dev/config/rnaseq.yaml
+matrices = ['genes.expected_count', 'isoforms.expected_count', 'genes.FPKM', 'isoforms.FPKM', 'genes.TPM', 'isoforms.TPM']
+
+
+def sample_names(nsamples):
+    """Returns the names of N synthetic samples, i.e. Sample_00001"""
+    return ['Sample_{:05d}'.format(i + 1) for i in range(nsamples)]
+
+
+def sparse(filename, header, size):
+    """Creates a sparse file of a given size that starts with a small header.
+    @param filename <str>:
+        Output file to create
+    @param header <bytes>:
+        Content of the start of the file (i.e. a gzip compressed FASTQ record)
+    @param size <int>:
+        Size of the file in bytes, the file is never smaller than its header
+    """
+    with open(filename, 'wb') as fh:
+        fh.write(header)
+        fh.truncate(max(size, len(header)))
+
+
+def fastq(sample, read, rng):
+    """Returns a gzip compressed FASTQ record for a sample and mate (i.e. R1)."""
+    sequence = ''.join(rng.choice('ACGT') for i in range(100))
+    record = '@{}:1:FC:1:1:1:1 {}\n{}\n+\n{}\n'.format(sample, read[-1], sequence, 'F' * len(sequence))
+
+    return gzip.compress(record.encode(), mtime = 0)
+
+
+def bam(sample):
+    """Returns the magic string and header of a BAM file for a sample."""
+    text = '@HD\tVN:1.6\tSO:coordinate\n@RG\tID:{0}\tSM:{0}\n'.format(sample).encode()
+
+    return gzip.compress(b'BAM\x01' + len(text).to_bytes(4, 'little') + text, mtime = 0)
+
+
+def references(directory):
+    """Creates the reference files and the pipeline's config.json used to fingerprint a run.
+    @param directory <str>:
+        Pipeline output directory
+    """
+    ref = os.path.join(directory, 'ref')
+    os.makedirs(ref, exist_ok = True)
+    with open(os.path.join(ref, 'genome.fa'), 'w') as fh:
+        fh.write('>chr1\nACGT\n')
+    with open(os.path.join(ref, 'genes.gtf'), 'w') as fh:
+        fh.write('chr1\tHAVANA\tgene\t1\t4\t.\t+\t.\tgene_id "ENSG00000000001.1";\n')
+    with open(os.path.join(ref, 'hg38.json'), 'w') as fh:
+        json.dump({'references': {'rnaseq': {
+            'GENOME': os.path.join(ref, 'genome.fa'),
+            'GTFFILE': os.path.join(ref, 'genes.gtf'),
+            'ORGANISM': 'hg38_30'
+        }}}, fh, indent = 4)
+
+
+def config(directory, samples):
+    """Creates the pipeline's config.json with the annotation and samples of the run."""
+    with open(os.path.join(directory, 'config.json'), 'w') as fh:
+        json.dump({'project': {
+            'version': 'v2.0',
+            'annotation': os.path.join(directory, 'ref', 'hg38.json'),
+            'nends': 2,
+            'groups': {'rsamps': samples}
+        }}, fh, indent = 4)
+
+
+def per_sample(directory, samples, fastq_size, bam_size, rng):
+    """Creates the per sample FASTQ, BAM and Arriba output files of each sample.
+    @param directory <str>:
+        Pipeline output directory
+    @param samples list[<str>]:
+        Sample names
+    @param fastq_size <int>:
+        Size of each FASTQ file in bytes
+    @param bam_size <int>:
+        Size of each BAM file in bytes
+    @param rng <random.Random>:
+        Random number generator
+    """
+    for folder in ['bams', 'fusions']:
+        os.makedirs(os.path.join(directory, folder), exist_ok = True)
+    for sample in samples:
+        for read in ['R1', 'R2']:
+            sparse(os.path.join(directory, '{}.{}.fastq.gz'.format(sample, read)), fastq(sample, read, rng), fastq_size)
+        sparse(os.path.join(directory, 'bams', '{}.star_rg_added.sorted.dmark.bam'.format(sample)), bam(sample), bam_size)
+        sparse(os.path.join(directory, 'bams', '{}.p2.Aligned.toTranscriptome.out.bam'.format(sample)), bam(sample), bam_size)
+        sparse(os.path.join(directory, 'fusions', '{}.p2.arriba.Aligned.sortedByCoord.out.bam'.format(sample)), bam(sample), bam_size // 10)
+        with open(os.path.join(directory, 'fusions', '{}_fusions.tsv'.format(sample)), 'w') as fh:
+            fh.write('#gene1\tgene2\tstrand1(gene/fusion)\tstrand2(gene/fusion)\tbreakpoint1\tbreakpoint2\tconfidence\n')
+            fh.write('BCR\tABL1\t+/+\t+/+\tchr22:23290413\tchr9:130854064\thigh\n')
+        with open(os.path.join(directory, 'fusions', '{}_fusions.arriba.pdf'.format(sample)), 'wb') as fh:
+            fh.write(b'%PDF-1.4\n%%EOF\n')
+
+
+def counts(directory, samples, ngenes, rng):
+    """Creates the RSEM counts matrices in DEG_ALL, i.e. RSEM.genes.TPM.all_samples.txt
+    @param directory <str>:
+        Pipeline output directory
+    @param samples list[<str>]:
+        Sample names, i.e. columns of each matrix
+    @param ngenes <int>:
+        Number of genes or isoforms, i.e. rows of each matrix
+    @param rng <random.Random>:
+        Random number generator
+    """
+    os.makedirs(os.path.join(directory, 'DEG_ALL'), exist_ok = True)
+    for matrix in matrices:
+        feature = 'ENST' if matrix.startswith('isoforms') else 'ENSG'
+        with open(os.path.join(directory, 'DEG_ALL', 'RSEM.{}.all_samples.txt'.format(matrix)), 'w') as fh:
+            fh.write('\t'.join(['gene_id', 'GeneName'] + ['{}_expected_count'.format(s) for s in samples]) + '\n')
+            for i in range(ngenes):
+                values = ['{:.2f}'.format(rng.expovariate(0.01)) for s in samples]
+                fh.write('\t'.join(['{}{:011d}.1'.format(feature, i), 'GENE{}'.format(i)] + values) + '\n')
+
+
+def tin(directory, samples, ntranscripts, rng):
+    """Creates the RSeQC tin.py output file of each sample, see src/create_tin_matrix.py
+    @return files list[<str>]:
+        Paths of the *.tin.xls files
+    """
+    os.makedirs(os.path.join(directory, 'RSeQC'), exist_ok = True)
+    files = []
+    for sample in samples:
+        file = os.path.join(directory, 'RSeQC', '{}.p2.Aligned.sortedByCoord.out.tin.xls'.format(sample))
+        with open(file, 'w') as fh:
+            fh.write('geneID\tchrom\ttx_start\ttx_end\tTIN\n')
+            for i in range(ntranscripts):
+                fh.write('ENST{:011d}.1\tchr1\t1\t1000\t{:.2f}\n'.format(i, rng.random() * 100))
+        files.append(file)
+
+    return files
+
+
+def reports(directory):
+    """Creates the MultiQC and RNA HTML reports."""
+    os.makedirs(os.path.join(directory, 'Reports'), exist_ok = True)
+    for report in ['multiqc_report.html', 'RNA_Report.html']:
+        with open(os.path.join(directory, 'Reports', report), 'w') as fh:
+            fh.write('<html><body>{}</body></html>\n'.format(report))
+
+
+def multiqc(directory, samples, example = os.path.join(home, 'data', 'example')):
+    """Creates the MultiQC text files parsed by src/pyparser.py. Each example sample is
+    cloned and renamed after a synthetic sample, rows without a sample name are kept.
+    @param directory <str>:
+        Output MultiQC directory
+    @param samples list[<str>]:
+        Sample names
+    @param example <str>:
+        Directory of example MultiQC text files
+    """
+    os.makedirs(directory, exist_ok = True)
+    with open(os.path.join(example, 'multiqc_general_stats.txt')) as fh:
+        # Example sample names, i.e. F6_MOCK_1_MP180
+        names = [line.split('\t')[0] for i, line in enumerate(fh) if i and '.' not in line.split('\t')[0]]
+    pattern = re.compile(r'(?<![\w])({})(?![\w])'.format('|'.join(map(re.escape, sorted(names, key = len, reverse = True)))))
+
+    for filename in sorted(os.listdir(example)):
+        if filename not in pyparser.config:
+            continue
+        with open(os.path.join(example, filename)) as fh:
+            header, *lines = fh.readlines()
+        rows, other = {}, []
+        for line in lines:
+            found = pattern.search(line)
+            if found:
+                rows.setdefault(found.group(1), []).append(line)
+            else:
+                other.append(line)
+        with open(os.path.join(directory, filename), 'w') as fh:
+            fh.write(header)
+            for i, sample in enumerate(samples):
+                name = names[i % len(names)]
+                fh.writelines(pattern.sub(sample, line) for line in rows.get(name, []))
+            fh.writelines(other)
+
+
+def template(filename, samples, groups = ['Case', 'Control'], example = os.path.join(home, 'data', 'experiment_metadata.xlsx')):
+    """Creates a project request template with a row for each sample. The example project
+    is copied into the Project Template sheet and the example samples are cloned and
+    renamed after each sample in the Sample Template sheet.
+    @param filename <str>:
+        Output project request template
+    @param samples list[<str>]:
+        Sample names
+    @param groups list[<str>]:
+        Groups (i.e. Case, Control) assigned to samples in a round-robin fashion
+    @param example <str>:
+        Project request template with the example sheets
+    """
+    import openpyxl
+
+    with warnings.catch_warnings():
+        # Data validation extension is not supported and will be removed
+        warnings.simplefilter('ignore')
+        # Cached values of formulas, i.e. Start Date =TODAY()
+        workbook = openpyxl.load_workbook(example, data_only = True)
+
+    project = workbook['Project Template']
+    for row in workbook['Example Project'].iter_rows():
+        for cell in row:
+            value = cell.value
+            if project.cell(row = cell.row, column = 1).value == 'Number of Samples' and cell.column == 2:
+                value = len(samples)
+            project.cell(row = cell.row, column = cell.column, value = value)
+
+    rows = [list(row) for row in workbook['Example Sample'].iter_rows(values_only = True)]
+    starts = [i for i, row in enumerate(rows) if row[0] == 'Sample ID']
+    required, optional = rows[starts[0] + 1:starts[1] - 1], rows[starts[1] + 1:]
+    required = [row for row in required if row[0] is not None]
+    optional = [row for row in optional if row[0] is not None]
+    header = rows[starts[0]]
+
+    index = workbook.sheetnames.index('Sample Template')
+    workbook.remove(workbook['Sample Template'])
+    sheet = workbook.create_sheet('Sample Template', index)
+    for row in rows[:starts[0] + 1]:
+        sheet.append(row)
+    for i, sample in enumerate(samples):
+        row = list(required[i % len(required)])
+        row[0], row[1] = 'AC{}'.format(i + 1), sample
+        row[header.index('Raw File 1')] = '{}.R1.fastq.gz'.format(sample)
+        row[header.index('Raw File 2 [optional]')] = '{}.R2.fastq.gz'.format(sample)
+        sheet.append(row)
+    sheet.append([])
+    sheet.append(rows[starts[1] - 1])
+    sheet.append(rows[starts[1]])
+    for i, sample in enumerate(samples):
+        row = list(optional[i % len(optional)])
+        row[0], row[rows[starts[1]].index('Group')] = 'AC{}'.format(i + 1), groups[i % len(groups)]
+        sheet.append(row)
+
+    workbook.save(filename)
+
+
+def generate(directory, nsamples, fastq_size = 65536, bam_size = 131072, ngenes = 2000, ntranscripts = 2000, seed = 42):
+    """Generates a synthetic pipeline output directory with N samples.
+    @param directory <str>:
+        Output directory, i.e. the pipeline's working directory
+    @param nsamples <int>:
+        Number of samples to create
+    @param fastq_size <int>:
+        Size of each FASTQ file in bytes
+    @param bam_size <int>:
+        Size of each BAM file in bytes
+    @param ngenes <int>:
+        Number of rows in each RSEM counts matrix
+    @param ntranscripts <int>:
+        Number of transcripts in each TIN file
+    @param seed <int>:
+        Seed of the random number generator
+    @return samples list[<str>]:
+        Sample names
+    """
+    rng = random.Random(seed)
+    samples = sample_names(nsamples)
+    os.makedirs(directory, exist_ok = True)
+    references(directory)
+    config(directory, samples)
+    per_sample(directory, samples, fastq_size, bam_size, rng)
+    counts(directory, samples, ngenes, rng)
+    tin(directory, samples, ntranscripts, rng)
+    reports(directory)
+    multiqc(os.path.join(directory, 'multiqc'), samples)
+    template(os.path.join(directory, 'experiment_metadata.xlsx'), samples)
+
+    return samples
+
+
+def main():
+
+    # Parse args
+    args = sys.argv[1:]
+    if '-h' in args or '--help' in args:
+        print(__doc__)
+        sys.exit()
+
+    sizes = {'-f': 65536, '-b': 131072}
+    for option in sizes:
+        if option in args:
+            i = args.index(option)
+            try:
+                sizes[option] = int(args[i+1])
+            except (IndexError, ValueError):
+                print(__doc__)
+                sys.exit(1)
+            args = args[:i] + args[i+2:]
+    if len(args) != 2 or not args[1].isdigit():
+        print(__doc__)
+        sys.exit(1)
+
+    generate(args[0], int(args[1]), fastq_size = sizes['-f'], bam_size = sizes['-b'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""tin_scaling: benchmarks parallel ingestion of RSeQC TIN files in create_tin_matrix.py
+About:
+      Writes synthetic RSeQC tin.py output files for an increasing number of samples,
+    where each file lists the transcripts in a different order, and times building
+    combined_TIN.tsv with 1 to N worker processes. The TIN matrix created with each
+    number of workers is compared to the output of the original pandas implementation
+    to ensure the output is identical, see reference(). Files with TIN values that are
+    not in their shortest form, non-numeric values and missing transcripts are also
+    created through the streaming merge, the array build and the process pool, which
+    must write the same file as the original implementation.
+USAGE:
+	$ python dev/benchmarks/tin_scaling.py [N_TRANSCRIPTS] [MAX_CORES]
+Example:
+    $ python dev/benchmarks/tin_scaling.py 200000 8
+"""
+
+# Python standard library
+from __future__ import print_function
+import sys, os, time, random, shutil, tempfile, filecmp
+
+# Local imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'src'))
+import create_tin_matrix
+
+
+def synthetic_files(directory, nsamples, ntranscripts, seed=42):
+    """Creates synthetic RSeQC tin.py output files with shuffled transcripts. About
+    one in ten TIN values is written with a fixed number of decimals (i.e. 12.5000),
+    which the TIN matrix must copy verbatim.
+    @param directory <str>:
+        Output directory of the synthetic files
+    @param nsamples <int>:
+        Number of samples or files to create
+    @param ntranscripts <int>:
+        Number of transcripts or rows in each file
+    @return files list[<str>]:
+        Paths of the synthetic *.tin.xls files
+    """
+    rng = random.Random(seed)
+    transcripts = ['ENST{:011d}.{}'.format(i, i % 9 + 1) for i in range(ntranscripts)]
+    files = []
+    for i in range(nsamples):
+        rng.shuffle(transcripts)
+        file = os.path.join(directory, 'S{}.p2.Aligned.sortedByCoord.out.tin.xls'.format(i))
+        with open(file, 'w') as fh:
+            fh.write('geneID\tchrom\ttx_start\ttx_end\tTIN\n')
+            for tid in transcripts:
+                tin = rng.random() * 100
+                fh.write('{}\tchr1\t1\t1000\t{}\n'.format(tid, '{:.4f}'.format(tin) if rng.random() < 0.1 else repr(tin)))
+        files.append(file)
+
+    return files
+
+
+def reference(files, outfile):
+    """Creates the TIN matrix with the original pandas implementation of
+    create_tin_matrix.py, which copies each TIN value verbatim.
+    @param files list[<str>]:
+        Paths of RSeQC tin.py output files
+    @param outfile <str>:
+        Path of the output TSV file
+    """
+    import pandas
+
+    tins = {}
+    for file in files:
+        with open(file, 'r') as fh:
+            colid = next(fh).strip().split('\t')[0]
+            sample = os.path.basename(file).split('.p2.Aligned.')[0]
+            for line in fh:
+                linelist = line.strip().split('\t')
+                tins.setdefault(sample, {})[linelist[0]] = linelist[4]
+    pandas.DataFrame(tins).to_csv(outfile, sep='\t', header=True, index=True, index_label=colid)
+
+
+def equivalence(directory):
+    """Checks that the streaming merge, the array build and the process pool of
+    create_tin_matrix.create() write the same TIN matrix as reference(), including
+    values that are not in their shortest form, non-numeric and missing values.
+    @param directory <str>:
+        Output directory of the test files
+    """
+    values = ['0.50', '0', '12.5000', '1e-3', 'NA', '3', '85.0', 'nan', '33.333333333333336']
+    shuffled = random.Random(7)
+    for ordered in [True, False]:
+        files = []
+        for i in range(4):
+            file = os.path.join(directory, 'E{}.p2.Aligned.sortedByCoord.out.tin.xls'.format(i))
+            rows = [(j, values[(i + j) % len(values)]) for j in range(len(values))]
+            if not ordered:
+                # Shuffled transcripts, each file is missing one transcript
+                # and the last file adds a transcript of its own
+                shuffled.shuffle(rows)
+                rows = rows[1:] + ([(len(values), '7.10')] if i == 3 else [])
+            with open(file, 'w') as fh:
+                fh.write('geneID\tchrom\ttx_start\ttx_end\tTIN\n')
+                for j, value in rows:
+                    fh.write('ENST{:011d}.1\tchr1\t1\t1000\t{}\n'.format(j, value))
+            files.append(file)
+        expected, outfile = os.path.join(directory, 'expected.tsv'), os.path.join(directory, 'outfile.tsv')
+        reference(files, expected)
+        if ordered:
+            assert create_tin_matrix.merge(files, outfile), 'Files with the same transcript order were not merged'
+            assert filecmp.cmp(expected, outfile, shallow=False), 'Streaming merge differs from the original output'
+        for threads in [1, 2]:
+            create_tin_matrix.create(files, outfile, threads=threads, stream=False)
+            assert filecmp.cmp(expected, outfile, shallow=False), 'Array build with {} cores differs from the original output'.format(threads)
+        for file in files + [expected, outfile]:
+            os.remove(file)
+
+
+def timed(func, *args, **kwargs):
+    """Returns the elapsed time of running a function in seconds."""
+    ts = time.time()
+    func(*args, **kwargs)
+
+    return time.time() - ts
+
+
+def main():
+
+    ntranscripts = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    maxcores = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1)
+    cores = sorted(set([2**i for i in range(maxcores.bit_length()) if 2**i <= maxcores] + [maxcores]))
+    tmpdir = tempfile.mkdtemp(prefix='tin_scaling_')
+    try:
+        equivalence(tmpdir)
+        print('samples\ttranscripts\tcores\telapsed_s\tspeedup')
+        for nsamples in [25, 100, 300]:
+            files = synthetic_files(tmpdir, nsamples, ntranscripts)
+            expected = os.path.join(tmpdir, 'combined_TIN.tsv')
+            reference(files, expected)
+            for ncores in cores:
+                outfile = os.path.join(tmpdir, 'combined_TIN.{}.tsv'.format(ncores))
+                elapsed = timed(create_tin_matrix.create, files, outfile, threads=ncores)
+                if ncores == 1:
+                    baseline = elapsed
+                assert filecmp.cmp(expected, outfile, shallow=False), 'TIN matrix with {} cores differs from the original output'.format(ncores)
+                print('{}\t{}\t{}\t{:.3f}\t{:.1f}x'.format(nsamples, ntranscripts, ncores, elapsed, baseline / elapsed))
+            for file in files:
+                os.remove(file)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,7 @@
 
 # Python standard library
 from __future__ import print_function
-import time
+import os, time, json, threading
 
 # Local imports
 from utils import err
@@ -27,6 +27,205 @@ def timer(func):
     return timed
 
 
+def _rusage():
+    """Private function to get the resource usage of this process and its children.
+    @return usage <tuple(<float>, <float>, <int>, <int>)>:
+        CPU time of this process and its (reaped) children in seconds, and the
+        peak RSS of this process and its children in kilobytes
+    """
+    try:
+        import resource
+    except ImportError:
+        # resource is only available on unix-like systems
+        return time.process_time(), 0.0, 0, 0
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    return own.ru_utime + own.ru_stime, children.ru_utime + children.ru_stime, own.ru_maxrss, children.ru_maxrss
+
+
+def _bytes_read():
+    """Private function to get the number of bytes this process has read, including
+    reads served from the page cache, see 'rchar' in proc(5). Returns 0 if the
+    counter is not available (i.e. not linux).
+    """
+    try:
+        with open('/proc/self/io') as fh:
+            for line in fh:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except (IOError, OSError, ValueError):
+        pass
+
+    return 0
+
+
+class Span(object):
+    """A timed stage or sub-step of a run. Spans are nested, each span records its wall
+    time, CPU time (including child processes that finished within the span), the peak
+    RSS at the end of the span, the bytes read by the process, and any counters added
+    with count() (i.e. bytes_hashed, files).
+    @param name <str>:
+        Name of the stage or sub-step
+    @param tracer <Tracer>:
+        Tracer recording the span
+    @param attributes <dict>:
+        Additional information about the span (i.e. module name)
+    """
+    def __init__(self, name, tracer, **attributes):
+        self.name = name
+        self.tracer = tracer
+        self.attributes = attributes
+        self.counters = {}
+        self.spans = []
+        self.thread = threading.current_thread().ident
+
+    def count(self, **counters):
+        """Adds to the counters of the span, i.e. span.count(files = 1, bytes_hashed = 1024)"""
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def __enter__(self):
+        stack = self.tracer._stack()
+        (stack[-1].spans if stack else self.tracer.spans).append(self)
+        stack.append(self)
+        self._read = _bytes_read()
+        self._usage = _rusage()
+        self.start = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.wall = time.perf_counter() - self._start
+        cpu, children_cpu, rss, children_rss = _rusage()
+        self.cpu = cpu - self._usage[0]
+        self.children_cpu = children_cpu - self._usage[1]
+        self.peak_rss = rss
+        self.children_peak_rss = children_rss
+        self.bytes_read = max(0, _bytes_read() - self._read)
+        self.tracer._stack().pop()
+
+    def report(self):
+        """Returns the span and its nested spans as a dictionary."""
+        # ru_maxrss is in kilobytes on linux
+        report = {
+            'name': self.name,
+            'wall_s': round(self.wall, 6),
+            'cpu_s': round(self.cpu, 6),
+            'children_cpu_s': round(self.children_cpu, 6),
+            'peak_rss_mb': round(self.peak_rss / 1024.0, 1),
+            'children_peak_rss_mb': round(self.children_peak_rss / 1024.0, 1),
+            'bytes_read': self.bytes_read
+        }
+        report.update(self.counters)
+        if self.attributes:
+            report['attributes'] = self.attributes
+        if self.spans:
+            report['spans'] = [span.report() for span in self.spans]
+
+        return report
+
+    def events(self, pid, origin):
+        """Returns the span and its nested spans as Chrome trace events."""
+        args = {k: v for k, v in self.report().items() if k not in ['name', 'spans']}
+        events = [{
+            'name': self.name, 'cat': 'pyrkit', 'ph': 'X', 'pid': pid, 'tid': self.thread,
+            'ts': round((self.start - origin) * 1e6), 'dur': round(self.wall * 1e6), 'args': args
+        }]
+        for span in self.spans:
+            events += span.events(pid, origin)
+
+        return events
+
+
+class Tracer(object):
+    """Records nested spans of a run and saves them as a JSON run report and as a
+    Chrome trace file, which can be opened in chrome://tracing or ui.perfetto.dev.
+    Example:
+        with tracer.span('links'):
+            with tracer.span('stage', module = 'fastq') as s:
+                s.count(files = 1)
+        tracer.save('DME/logs/run_report.json', 'DME/logs/run_trace.json')
+    """
+    def __init__(self):
+        self.spans = []
+        self.created = time.time()
+        self._local = threading.local()
+
+    def _stack(self):
+        """Private method to get the stack of open spans of the current thread."""
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def span(self, name, **attributes):
+        """Creates a span nested in the current span, use it as a context manager."""
+        return Span(name, self, **attributes)
+
+    def current(self):
+        """Returns the innermost open span of the current thread or None."""
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def count(self, **counters):
+        """Adds to the counters of the current span, if any."""
+        span = self.current()
+        if span:
+            span.count(**counters)
+
+    def traced(self, name = None):
+        """Decorator that records each call of a function as a span."""
+        def decorator(func):
+            def wrapped(*args, **kwargs):
+                with self.span(name or func.__name__):
+                    return func(*args, **kwargs)
+            wrapped.__name__, wrapped.__doc__ = func.__name__, func.__doc__
+            return wrapped
+        return decorator
+
+    def report(self):
+        """Returns the run report of all finished spans as a dictionary."""
+        spans = [span.report() for span in self.spans if hasattr(span, 'wall')]
+
+        return {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.created)),
+            'pid': os.getpid(),
+            'wall_s': round(sum(span['wall_s'] for span in spans), 6),
+            'spans': spans
+        }
+
+    def save(self, report = None, trace = None):
+        """Saves the JSON run report and the Chrome trace file.
+        @param report <str>:
+            Output JSON run report
+        @param trace <str>:
+            Output Chrome trace file (trace event format)
+        """
+        if report:
+            with open(report, 'w') as fh:
+                json.dump(self.report(), fh, indent = 4)
+        if trace:
+            events = []
+            for span in self.spans:
+                if hasattr(span, 'wall'):
+                    events += span.events(os.getpid(), self.created)
+            with open(trace, 'w') as fh:
+                json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fh)
+
+
+# Tracer shared by all stages of a run
+tracer = Tracer()
+
+
 if __name__ == '__main__':
-    # Add test later
-    pass
\ No newline at end of file
+    # Tests
+    with tracer.span('run'):
+        with tracer.span('sleep') as s:
+            time.sleep(0.01)
+            s.count(files = 1)
+        with tracer.span('hash') as s:
+            import hashlib
+            data = os.urandom(1 << 20)
+            hashlib.md5(data).hexdigest()
+            s.count(bytes_hashed = len(data))
+    print(json.dumps(tracer.report(), indent = 4))
\ No newline at end of file
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""Shared cache of MD5 checksums. Files are hashed once per process, or once across
+runs when the cache is saved, no matter how many projects or collections refer to
+them (i.e. a reference genome shared by every project of a batch). Checksums are
+keyed by the resolved path of a file and are only reused while its size and
+modification time are unchanged.
+"""
+
+# Python standard library
+from __future__ import print_function
+import os, threading
+
+# Local imports
+from utils import md5sum
+
+
+class Cache(object):
+    """Cache of MD5 checksums keyed by the resolved path of each file.
+    @attribute hits <int>:
+        Number of checksums found in the cache
+    @attribute misses <int>:
+        Number of files that were hashed
+    @attribute bytes_hashed <int>:
+        Number of bytes that were hashed
+    Example:
+        cache = Cache()
+        cache.load('batch/checksums.tsv')
+        md5 = cache.md5('ref/genome.fa')
+        cache.save('batch/checksums.tsv')
+    """
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.bytes_hashed = 0
+        self._lock = threading.Lock()
+
+    def _key(self, filename):
+        """Private method to get the resolved path, size and mtime of a file."""
+        from fscache import realpath
+
+        path = realpath(filename)
+        stat = os.stat(path)
+        return path, stat.st_size, stat.st_mtime_ns
+
+    def get(self, filename):
+        """Gets the cached checksum of a file without hashing it.
+        @return md5 <str>:
+            MD5 checksum of the file or None if it is not cached or has changed
+        """
+        path, size, mtime = self._key(filename)
+        entry = self.entries.get(path)
+        if entry and entry[1:] == (size, mtime):
+            return entry[0]
+
+        return None
+
+    def md5(self, filename):
+        """Gets the MD5 checksum of a file, the file is only hashed on a cache miss.
+        @param filename <str>:
+            File on the local filesystem
+        @return md5 <str>:
+            MD5 checksum of the file's contents
+        """
+        path, size, mtime = self._key(filename)
+        with self._lock:
+            entry = self.entries.get(path)
+            if entry and entry[1:] == (size, mtime):
+                self.hits += 1
+                return entry[0]
+
+        md5 = md5sum(path)
+        with self._lock:
+            self.entries[path] = (md5, size, mtime)
+            self.misses += 1
+            self.bytes_hashed += size
+
+        return md5
+
+    def add(self, filename, md5):
+        """Adds a checksum calculated elsewhere (i.e. while compressing a file)."""
+        path, size, mtime = self._key(filename)
+        with self._lock:
+            self.entries[path] = (md5, size, mtime)
+
+    def update(self, checksums):
+        """Adds checksums calculated by other processes, see src/hashqueue.py
+        @param checksums <dict>:
+            [path] = (md5, size, mtime) of each file, keyed by its resolved path
+        """
+        with self._lock:
+            self.entries.update(checksums)
+            self.misses += len(checksums)
+            self.bytes_hashed += sum(size for md5, size, mtime in checksums.values())
+
+    def manifest(self, filenames, output, mode = 'a'):
+        """Writes the checksums of files to a manifest in md5sum format, which is read
+        by 'meta --checksums' (see src/meta). Files are hashed on a cache miss.
+        @param filenames list[<str>]:
+            Files on the local filesystem
+        @param output <str>:
+            Output manifest, each line is keyed by the resolved path of a file
+        @param mode <str>:
+            Append to ('a') or overwrite ('w') the manifest
+        @return bytes_hashed <int>:
+            Number of bytes hashed for files that were not cached
+        """
+        hashed = self.bytes_hashed
+        from fscache import realpath
+
+        lines = ['{}  {}\n'.format(self.md5(f), realpath(f)) for f in filenames]
+        with open(output, mode) as fh:
+            fh.writelines(lines)
+
+        return self.bytes_hashed - hashed
+
+    def load(self, filename):
+        """Loads the checksums saved by a previous run, entries of changed files are
+        ignored on lookup. A missing or corrupted cache file is treated as empty.
+        """
+        try:
+            with open(filename) as fh:
+                for line in fh:
+                    md5, size, mtime, path = line.rstrip('\n').split('\t', 3)
+                    self.entries[path] = (md5, int(size), int(mtime))
+        except (IOError, OSError, ValueError):
+            pass
+
+    def save(self, filename):
+        """Saves the cache as a TSV file (md5, size, mtime, path). The file is written
+        to a temporary file first and renamed into place.
+        """
+        tmp = '{}.{}.tmp'.format(filename, os.getpid())
+        with self._lock:
+            with open(tmp, 'w') as fh:
+                for path, (md5, size, mtime) in sorted(self.entries.items()):
+                    fh.write('{}\t{}\t{}\t{}\n'.format(md5, size, mtime, path))
+        os.rename(tmp, filename)
+
+
+# Checksums of the current run, shared by every stage and project
+cache = Cache()
+
+
+if __name__ == '__main__':
+    # Tests
+    import sys, tempfile
+
+    # Programs in pyrkit/src are imported as modules, see pipeline.py
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'src'))
+
+    tmp = tempfile.mkdtemp()
+    data = os.path.join(tmp, 'data.txt')
+    with open(data, 'w') as fh:
+        fh.write('hello\n')
+    os.symlink(data, os.path.join(tmp, 'link.txt'))
+
+    c = Cache()
+    assert c.md5(data) == 'b1946ac92492d2347c6235b4d2611184'
+    assert c.md5(os.path.join(tmp, 'link.txt')) == 'b1946ac92492d2347c6235b4d2611184'
+    assert (c.hits, c.misses, c.bytes_hashed) == (1, 1, 6)
+
+    c.save(os.path.join(tmp, 'cache.tsv'))
+    d = Cache()
+    d.load(os.path.join(tmp, 'cache.tsv'))
+    assert d.get(data) == 'b1946ac92492d2347c6235b4d2611184'
+
+    # Changed files are hashed again
+    with open(data, 'w') as fh:
+        fh.write('hello world\n')
+    os.utime(data, ns = (0, 0))
+    assert d.get(data) is None
+    assert d.md5(data) == '6f5902ac237024bdd0c176cb93063dc4'
+    assert d.manifest([data], os.path.join(tmp, 'checksums.md5')) == 0
+    print(open(os.path.join(tmp, 'checksums.md5')).read(), end = '')
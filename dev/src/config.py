@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""Loads a pipeline config (i.e. config/rnaseq.yaml) into its compiled form. Each config
+is validated against a schema, and its module search patterns are compiled into a single
+combined matcher along with a table of rename rules, both on first use. The validated
+config is cached in '~/.cache/pyrkit/config/' keyed on the digest of the YAML file, so
+warm starts do not import the YAML parser or parse and validate the YAML file again.
+"""
+
+# Python standard library
+from __future__ import print_function
+import os, sys, re, hashlib, marshal
+
+# Local imports
+from utils import err, fatal
+
+# Pipeline configs shipped with pyrkit, a path to any YAML file can also be given
+home = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'config')
+pipelines = {
+    'rnaseq': os.path.join(home, 'rnaseq.yaml'),
+    'chipseq': os.path.join(home, 'chipseq.yaml'),
+    'wgs': os.path.join(home, 'wgs.yaml')
+}
+
+# Bump when the schema or cached format changes to invalidate old cache entries
+schema_version = '3'
+schema = {
+    'references': str,
+    'module': {
+        'type': ('sample', 'combined'),
+        'search_pattern': str,
+        'reformat': bool
+    },
+    'rename': {
+        'find_replace': dict,
+        'add_uuid': bool
+    }
+}
+
+_loaded = {}
+
+
+def cache_directory():
+    """Returns the directory of cached configs, see $XDG_CACHE_HOME.
+    @return path <str>:
+        Cache directory of compiled pipeline configs
+    """
+    root = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+
+    return os.path.join(root, 'pyrkit', 'config')
+
+
+def validate(data, filename):
+    """Validates a parsed pipeline config against the schema. All errors are reported
+    before exiting, similar to linting a project request template.
+    @param data <dict>:
+        Parsed YAML pipeline config
+    @param filename <str>:
+        Name of the YAML file for error messages
+    @return config <dict>:
+        Validated config with defaults set for optional keys
+    """
+    errors = []
+    if not isinstance(data, dict):
+        fatal('Fatal: Pipeline config {} is not a mapping of modules!'.format(filename))
+    for key in data:
+        if key not in schema:
+            errors.append('Unknown top-level key ({})'.format(key))
+    if not isinstance(data.get('references', ''), str):
+        errors.append('references must be a string')
+
+    modules = data.get('module') or {}
+    if not modules or not isinstance(modules, dict):
+        errors.append('Failed to define any modules')
+        modules = {}
+    for name, module in modules.items():
+        if not isinstance(module, dict):
+            errors.append('Module {} is not a mapping'.format(name))
+            continue
+        for key in module:
+            if key not in schema['module']:
+                errors.append('Module {} has an unknown key ({})'.format(name, key))
+        if module.get('type') not in schema['module']['type']:
+            errors.append("Module {} type must be 'sample' or 'combined'".format(name))
+        if not isinstance(module.get('search_pattern'), str):
+            errors.append('Module {} is missing a search_pattern'.format(name))
+            continue
+        try:
+            pattern = re.compile(module['search_pattern'])
+        except re.error as e:
+            errors.append('Module {} has an invalid search_pattern ({})'.format(name, e))
+            continue
+        if pattern.groupindex:
+            errors.append('Module {} search_pattern cannot contain named groups'.format(name))
+        if module.get('type') == 'sample' and pattern.groups < 1:
+            errors.append('Module {} search_pattern must capture the sample name in a group'.format(name))
+        if not isinstance(module.get('reformat', False), bool):
+            errors.append('Module {} reformat must be true or false'.format(name))
+
+    renames = data.get('rename') or {}
+    if not isinstance(renames, dict):
+        errors.append('rename is not a mapping of modules')
+        renames = {}
+    for name, rule in renames.items():
+        if name not in modules:
+            errors.append('Rename rule for an undefined module ({})'.format(name))
+            continue
+        if not isinstance(rule, dict):
+            errors.append('Rename rule {} is not a mapping'.format(name))
+            continue
+        for key in rule:
+            if key not in schema['rename']:
+                errors.append('Rename rule {} has an unknown key ({})'.format(name, key))
+        if not isinstance(rule.get('find_replace'), dict) or not rule['find_replace']:
+            errors.append('Rename rule {} is missing find_replace'.format(name))
+            continue
+        for find, replace in rule['find_replace'].items():
+            try:
+                re.compile(find)
+            except re.error as e:
+                errors.append('Rename rule {} has an invalid find pattern ({})'.format(name, e))
+            if not isinstance(replace, str):
+                errors.append('Rename rule {} must replace with a string'.format(name))
+        if not isinstance(rule.get('add_uuid', False), bool):
+            errors.append('Rename rule {} add_uuid must be true or false'.format(name))
+        elif rule.get('add_uuid') and modules[name].get('type') != 'sample':
+            errors.append('Rename rule {} can only add a uuid to sample modules'.format(name))
+
+    if errors:
+        for e in errors:
+            err('Error: {}'.format(e))
+        fatal('Fatal: Found {} error(s) in pipeline config {}...exiting'.format(len(errors), filename))
+
+    # Validated config with defaults, modules keep their order in the YAML file
+    name = os.path.splitext(os.path.basename(filename))[0]
+    return {
+        'name': name,
+        'references': data.get('references', name),
+        'module': [(m, modules[m]['type'], modules[m]['search_pattern'], modules[m].get('reformat', False)) for m in modules],
+        'rename': [(m, list(renames[m]['find_replace'].items()), renames[m].get('add_uuid', False)) for m in renames],
+        # Deepest directory level of any search pattern, ignoring '/' in character sets
+        'depth': max(re.sub(r'\[[^\]]*\]', '', modules[m]['search_pattern']).count('/') for m in modules)
+    }
+
+
+class Config(object):
+    """Compiled pipeline config. The search patterns of all modules are compiled into one
+    combined matcher, so each file is matched once against all modules. The matcher and
+    the rename table are compiled on first use, so loading a config stays cheap.
+    @param config <dict>:
+        Validated config, see validate()
+    Example:
+        config = load('rnaseq')
+        module, sample = config.match('bams/WT1.star_rg_added.sorted.dmark.bam')
+        config.rename(module, 'WT1.star_rg_added.sorted.dmark.bam', ('hg38_v30', 'f63-93-b750'))
+    """
+    def __init__(self, config):
+        self.name = config['name']
+        self.references = config['references']
+        self.modules = [m for m, mtype, pattern, reformat in config['module']]
+        self.types = {m: mtype for m, mtype, pattern, reformat in config['module']}
+        self.reformat = {m: reformat for m, mtype, pattern, reformat in config['module']}
+        self._patterns = [(m, mtype, pattern) for m, mtype, pattern, reformat in config['module']]
+        self._matcher = None
+        self._groups = {}
+        self.depth = config['depth']
+        # Rename table: [module] = (uuid, [(find, literal replace), ...]), the find patterns
+        # of a module are compiled the first time one of its files is renamed, see rename()
+        self.renames = {m: (add_uuid, rules) for m, rules, add_uuid in config['rename']}
+        self._compiled = {}
+
+    @property
+    def matcher(self):
+        """Combined matcher of all modules, compiled on first use. Each module's pattern
+        is wrapped in a named group, its first inner group is the sample name of a file
+        (sample modules only).
+        """
+        if self._matcher is None:
+            alternatives = '|'.join('(?P<_{}>{})'.format(i, pattern) for i, (m, mtype, pattern) in enumerate(self._patterns))
+            matcher = re.compile(alternatives)
+            for i, (m, mtype, pattern) in enumerate(self._patterns):
+                group = '_{}'.format(i)
+                self._groups[group] = (m, matcher.groupindex[group] + 1 if mtype == 'sample' else None)
+            self._matcher = matcher
+
+        return self._matcher
+
+    def match(self, path):
+        """Finds the module of a file.
+        @param path <str>:
+            Path of a file relative to the input directory
+        @return module, sample <tuple(<str>, <str>)>:
+            Name of the matching module and the sample name of the file,
+            or (None, None) if the file does not match any module
+        """
+        found = self.matcher.search(path)
+        if not found:
+            return None, None
+        module, group = self._groups[found.lastgroup]
+
+        return module, found.group(group) if group else None
+
+    def rename(self, module, filename, uuid = None):
+        """Renames a file using the find and replace rules of its module. The
+        replace statements are string literals. If the module adds a uuid, the
+        assembly and GTF version are added after the sample name and the analysis
+        id is added before the file extension (i.e. WT1.hg38_v30.Aligned.toGenome.f63-93-b750.bam).
+        @param module <str>:
+            Name of the file's module, see match()
+        @param filename <str>:
+            Name of the file
+        @param uuid <tuple(<str>, <str>)>:
+            Assembly and GTF version (i.e. hg38_v30) and the short analysis id
+        @return filename <str>:
+            New name of the file
+        """
+        if module not in self.renames:
+            return filename
+        add_uuid, rules = self.renames[module]
+        if module not in self._compiled:
+            self._compiled[module] = [(re.compile(find), replace) for find, replace in rules]
+        for find, replace in self._compiled[module]:
+            if add_uuid and uuid:
+                stem, ext = os.path.splitext(replace)
+                if ext == '.gz':
+                    # Keep compressed extensions together, i.e. .vcf.gz
+                    stem, ext = os.path.splitext(stem)[0], os.path.splitext(stem)[1] + ext
+                replace = '.{}{}.{}{}'.format(uuid[0], stem, uuid[1], ext)
+            filename = find.sub(lambda m: replace, filename, count = 1)
+
+        return filename
+
+
+def digest(data):
+    """Returns the cache key of a pipeline config. The marshal format of the cached
+    config is specific to a python version, so the version is part of the key.
+    @param data <bytes>:
+        Contents of the YAML file
+    @return key <str>:
+        MD5 checksum of the contents, the schema version and the python version
+    """
+    version = '{}\t{}\n'.format(schema_version, sys.version)
+
+    return hashlib.md5(version.encode('utf-8') + data).hexdigest()
+
+
+def load(pipeline = 'rnaseq', cache = True):
+    """Loads a pipeline config into its compiled form. The validated config is restored
+    from the cache if the YAML file has not changed, otherwise the YAML file is parsed,
+    validated and saved to the cache. Compiled configs are also kept for the lifetime of
+    the process.
+    @param pipeline <str>:
+        Name of a pipeline config (i.e. rnaseq, chipseq, wgs) or path to a YAML file
+    @param cache <bool>:
+        Read and write the config cache
+    @return config <Config>:
+        Compiled pipeline config
+    """
+    filename = pipelines.get(pipeline, pipeline)
+    try:
+        with open(filename, 'rb') as fh:
+            data = fh.read()
+    except (IOError, OSError):
+        fatal('Fatal: Failed to read pipeline config {}! Please choose from one of the following: {}'.format(pipeline, sorted(pipelines)))
+    key = digest(data)
+    if key in _loaded:
+        return _loaded[key]
+
+    route = os.path.join(cache_directory(), '{}.{}.marshal'.format(os.path.basename(filename), key))
+    config = None
+    if cache:
+        try:
+            with open(route, 'rb') as fh:
+                config = marshal.loads(fh.read())
+        except Exception:
+            config = None  # Cache miss or corrupted entry
+
+    if config is None:
+        import yaml
+        try:
+            config = validate(yaml.safe_load(data), filename)
+        except yaml.YAMLError as e:
+            fatal('Fatal: Failed to parse pipeline config {}!\n{}'.format(filename, e))
+        if cache:
+            tmp = '{}.{}.tmp'.format(route, os.getpid())
+            try:
+                os.makedirs(os.path.dirname(route), exist_ok = True)
+                with open(tmp, 'wb') as fh:
+                    fh.write(marshal.dumps(config))
+                os.rename(tmp, route)
+            except (IOError, OSError, ValueError):
+                # Cache directory is not writeable
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+    _loaded[key] = Config(config)
+
+    return _loaded[key]
+
+
+if __name__ == '__main__':
+    # Tests
+    import sys, time
+    for pipeline in sys.argv[1:] or sorted(pipelines):
+        start = time.time()
+        config = load(pipeline)
+        loaded = time.time()
+        config.match('')
+        print('{}\t{} module(s)\t{:.3f} ms\tfirst match {:.3f} ms'.format(pipeline, len(config.modules), (loaded - start) * 1000, (time.time() - loaded) * 1000))
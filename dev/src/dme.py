@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""Client of the HPC DME API to verify uploaded data objects. The checksum and size
+the server recorded for each data object are fetched with a bounded number of
+concurrent requests, each worker thread reusing one persistent connection, and are
+compared against the local MD5 checksum (md5_checksum metadata) and size of the file.
+Objects that are missing or do not match are staged again for upload, see requeue().
+MockService is a local stand-in for the data object endpoint of the API.
+"""
+
+# Python standard library
+from __future__ import print_function
+import os, json, time, threading
+
+# Local imports
+from utils import err
+
+
+# Endpoint of data objects, relative to the URL of the API
+endpoint = '/dataObject'
+
+# System metadata of a data object, set by the server once its data is archived
+attributes = {'checksum': 'checksum', 'size': 'source_file_size'}
+
+# Statuses of objects that are uploaded again, see requeue()
+mismatches = ['missing', 'size', 'checksum']
+
+
+class _Retry(OSError):
+    """Private exception of a request that failed with a transient error."""
+    pass
+
+
+class _Unreachable(_Retry):
+    """Private exception of a request that failed to reach the server."""
+    pass
+
+
+def settings(dme_repo):
+    """Reads the URL of the HPC DME API and the token of the user from a local git
+    installation of the DME CLU toolkit, see dm_generate_token.
+    @param dme_repo <str>:
+        Path to local git installation of DME CLU toolkit
+    @return url, token <tuple(<str>, <str>)>:
+        URL of the API (hpc.server.url) and token, or None if they are not set
+    """
+    utils = os.path.join(dme_repo.rstrip('/'), 'utils')
+    url, token = None, None
+    try:
+        with open(os.path.join(utils, 'hpcdme.properties')) as fh:
+            for line in fh:
+                key, _, value = line.partition('=')
+                if key.strip() == 'hpc.server.url':
+                    url = value.strip()
+    except (IOError, OSError):
+        pass
+    try:
+        with open(os.path.join(utils, 'tokens', 'hpcdme-auth.txt')) as fh:
+            token = fh.read().strip() or None
+    except (IOError, OSError):
+        pass
+
+    return url, token
+
+
+def objects(opath, directory = 'upload'):
+    """Lists the data objects staged for upload in a DME base directory. Files without
+    a metadata file are not registered as data objects and are skipped.
+    @param opath <str>:
+        DME base directory for all intermediate output files
+    @param directory <str>:
+        Folder of the DME base directory that is uploaded
+    @return entries list[<tuple>]:
+        (path, object_name, md5, size) of each data object
+    """
+    entries = []
+    for root, dirs, files in os.walk(os.path.join(opath, directory)):
+        dirs.sort()
+        names = set(files)
+        for f in sorted(files):
+            if f.lower().endswith('.metadata.json') or f + '.metadata.json' not in names:
+                continue
+            path = os.path.join(root, f)
+            with open(path + '.metadata.json') as fh:
+                metadata = {e['attribute']: e['value'] for e in json.load(fh)['metadataEntries']}
+            entries.append((path, metadata['object_name'], metadata['md5_checksum'], os.stat(path).st_size))
+
+    return entries
+
+
+def _metadata(document):
+    """Private function to get the metadata entries of a data object from the response
+    of the API, the metadata of its parent collections is ignored.
+    @return metadata <dict>:
+        [attribute] = value of each metadata entry
+    """
+    metadata = {}
+    nodes = [document.get('metadataEntries', document)]
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, dict):
+            if 'attribute' in node and 'value' in node:
+                metadata.setdefault(node['attribute'], node['value'])
+            else:
+                nodes += [v for k, v in node.items() if k != 'parentMetadataEntries']
+        elif isinstance(node, list):
+            nodes += node
+
+    return metadata
+
+
+class Client(object):
+    """Client of the data object endpoint of the HPC DME API. Each thread keeps its own
+    persistent connection, so concurrent requests do not open a connection each.
+    @param url <str>:
+        URL of the API, i.e. hpc.server.url of the DME CLU toolkit
+    @param token <str>:
+        Token of the user, sent as a bearer token
+    @param timeout <float>:
+        Timeout of each request in seconds
+    Example:
+        client = Client(*settings('~/DME/HPC_DME_APIs'))
+        checksum, size = client.get('/CCBR_Archive/PI_Lab_X/Project_Y/Sample_Z/Z.R1.fastq.gz')
+    """
+    def __init__(self, url, token = None, timeout = 60):
+        from urllib.parse import urlsplit
+
+        parts = urlsplit(url.rstrip('/'))
+        self.https = parts.scheme == 'https'
+        self.host = parts.netloc
+        self.prefix = parts.path
+        self.token = token
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        """Private method to get the persistent connection of the current thread."""
+        import http.client
+
+        if getattr(self._local, 'connection', None) is None:
+            connection = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            self._local.connection = connection(self.host, timeout = self.timeout)
+
+        return self._local.connection
+
+    def _close(self):
+        """Private method to drop the connection of the current thread after an error."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+        self._local.connection = None
+
+    def get(self, object_name):
+        """Fetches the checksum and size the server recorded for a data object.
+        @param object_name <str>:
+            Path of the data object in HPC DME
+        @return checksum, size <tuple(<str>, <int>)>:
+            Checksum and size of the data object, each None if it is not archived yet,
+            or None if the data object does not exist
+        """
+        import http.client
+        from urllib.parse import quote
+
+        headers = {'Accept': 'application/json'}
+        if self.token:
+            headers['Authorization'] = 'Bearer {}'.format(self.token)
+        try:
+            connection = self._connection()
+            connection.request('GET', self.prefix + endpoint + quote(object_name), headers = headers)
+            response = connection.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            self._close()
+            raise _Unreachable('Failed to reach {}: {}'.format(self.host, e))
+
+        if response.status == 404:
+            return None
+        elif response.status == 429 or response.status >= 500:
+            raise _Retry('HTTP {} {} for {}'.format(response.status, response.reason, object_name))
+        elif response.status != 200:
+            raise OSError('HTTP {} {} for {}'.format(response.status, response.reason, object_name))
+
+        metadata = _metadata(json.loads(body.decode('utf-8')))
+        size = metadata.get(attributes['size'])
+
+        return metadata.get(attributes['checksum']), None if size in [None, ''] else int(size)
+
+
+def verify(entries, client, workers = 16, retries = 3, backoff = 1.0):
+    """Compares the checksum and size of uploaded data objects against their local
+    values. Requests are run by a fixed number of threads, transient errors (timeouts,
+    throttling, 5xx responses) are retried with an exponential backoff.
+    @param entries list[<tuple>]:
+        Data objects to verify, see objects()
+    @param client <Client>:
+        Client of the HPC DME API
+    @param workers <int>:
+        Maximum number of concurrent requests
+    @param retries <int>:
+        Number of times a request is retried after a transient error
+    @param backoff <float>:
+        Time to wait before the first retry in seconds, doubled after each retry
+    @return rows list[<tuple>]:
+        (status, path, object_name, md5, checksum, size, remote_size) of each data object,
+        in the same order as the entries. The status is one of ok, missing, size,
+        checksum, pending (not archived yet) or error.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    # Set once the server cannot be reached after all retries, the remaining data
+    # objects are not requested so an outage does not wait out every backoff
+    unreachable = threading.Event()
+
+    def one(entry):
+        path, object_name, md5, size = entry
+        remote, error = None, None
+        for attempt in range(retries + 1):
+            if unreachable.is_set():
+                return ('error', path, object_name, md5, '', size, '')
+            if attempt:
+                time.sleep(backoff * 2 ** (attempt - 1))
+            try:
+                remote, error = client.get(object_name), None
+                break
+            except _Retry as e:
+                error = e
+            except OSError as e:
+                error = e
+                break
+        else:
+            if isinstance(error, _Unreachable):
+                unreachable.set()
+        if error is not None:
+            err('WARNING: Failed to verify {}: {}'.format(object_name, error))
+            return ('error', path, object_name, md5, '', size, '')
+        if remote is None:
+            return ('missing', path, object_name, md5, '', size, '')
+
+        checksum, remote_size = remote
+        if checksum is None or remote_size is None:
+            status = 'pending'
+        elif remote_size != size:
+            status = 'size'
+        elif checksum.lower() != md5.lower():
+            status = 'checksum'
+        else:
+            status = 'ok'
+        return (status, path, object_name, md5, checksum or '', size, '' if remote_size is None else remote_size)
+
+    with ThreadPoolExecutor(max_workers = max(1, workers)) as pool:
+        return list(pool.map(one, entries))
+
+
+def requeue(opath, rows, source = 'upload', directory = 'requeue'):
+    """Stages the data objects that are missing or do not match for upload again. The
+    requeue folder mirrors the upload folder with only these files, their metadata and
+    the metadata of their parent collections. Files are symlinked, not copied.
+    @param opath <str>:
+        DME base directory for all intermediate output files
+    @param rows list[<tuple>]:
+        Verified data objects, see verify()
+    @param source <str>:
+        Folder of the DME base directory that was uploaded
+    @param directory <str>:
+        Folder of the DME base directory to stage the data objects to upload again
+    @return requeued <int>:
+        Number of data objects staged for upload again
+    """
+    import shutil
+
+    upload, target = os.path.join(opath, source), os.path.join(opath, directory)
+    if os.path.lexists(target):
+        shutil.rmtree(target)
+    os.makedirs(target)
+
+    requeued = 0
+    for row in rows:
+        if row[0] not in mismatches:
+            continue
+        parts = os.path.relpath(row[1], upload).split(os.sep)
+        links = [os.path.join(*parts[:i]) + '.metadata.json' for i in range(1, len(parts))]
+        links += [os.path.join(*parts), os.path.join(*parts) + '.metadata.json']
+        for link in links:
+            source_path, target_path = os.path.join(upload, link), os.path.join(target, link)
+            if os.path.lexists(target_path) or not os.path.exists(source_path):
+                continue
+            if not os.path.isdir(os.path.dirname(target_path)):
+                os.makedirs(os.path.dirname(target_path))
+            os.symlink(os.path.realpath(source_path), target_path)
+        requeued += 1
+
+    return requeued
+
+
+class MockService(object):
+    """Local mock of the data object endpoint of the HPC DME API, used to test and
+    benchmark verify() without a server. Runs in a background thread.
+    @param objects <dict>:
+        [object_name] = (checksum, size) of each archived data object
+    @param latency <float>:
+        Time to answer each request in seconds
+    @param flaky set(<str>):
+        Data objects whose first request is answered with a 503 error
+    @attribute url <str>:
+        URL of the mock API, see Client
+    @attribute requests <int>:
+        Number of requests served
+    Example:
+        with MockService({'/CCBR_Archive/a.txt': ('b1946ac92492d2347c6235b4d2611184', 6)}) as service:
+            Client(service.url).get('/CCBR_Archive/a.txt')
+    """
+    def __init__(self, objects, latency = 0.0, flaky = ()):
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        from urllib.parse import quote, unquote
+
+        self.objects = objects
+        self.requests = 0
+        # Flaky data objects are matched against the path of each request
+        prefix = '/hpc-server' + endpoint
+        service, flaky, lock = self, set(prefix + quote(o) for o in flaky), threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are sent separately, Nagle's algorithm would delay the body
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with lock:
+                    service.requests += 1
+                    failed = self.path in flaky
+                    flaky.discard(self.path)
+                time.sleep(latency)
+                object_name = unquote(self.path[len(prefix):])
+                if failed:
+                    status, body = 503, b''
+                elif object_name not in service.objects:
+                    status, body = 404, b''
+                else:
+                    # System metadata of a data object that is not archived yet is not set
+                    entries = [{'attribute': attributes[key], 'value': str(value)} for key, value in
+                        zip(['checksum', 'size'], service.objects[object_name]) if value is not None]
+                    status, body = 200, json.dumps({'metadataEntries': {'selfMetadataEntries': {
+                        'systemMetadataEntries': entries}}}).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            # Every worker of verify() connects at once, a full backlog drops connections
+            request_queue_size = 1024
+            daemon_threads = True
+
+        self._server = Server(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/hpc-server'.format(self._server.server_address[1])
+        self._thread = threading.Thread(target = self._server.serve_forever, daemon = True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == '__main__':
+    # Tests
+    import sys, tempfile
+
+    tmp = tempfile.mkdtemp()
+    upload = os.path.join(tmp, 'upload')
+    archived = {}
+    for i in range(3):
+        sample = os.path.join(upload, 'PI_Lab_X', 'Sample_{}'.format(i))
+        os.makedirs(sample)
+        with open(sample + '.metadata.json', 'w') as fh:
+            json.dump({'metadataEntries': []}, fh)
+        for name in ['R1.fastq.gz', 'R2.fastq.gz', 'notes.txt']:
+            with open(os.path.join(sample, name), 'w') as fh:
+                fh.write('hello\n')
+            if name == 'notes.txt':
+                continue
+            object_name = '/CCBR_Archive/PI_Lab_X/Sample_{}/{}'.format(i, name)
+            with open(os.path.join(sample, name + '.metadata.json'), 'w') as fh:
+                json.dump({'metadataEntries': [{'attribute': 'object_name', 'value': object_name},
+                    {'attribute': 'md5_checksum', 'value': 'b1946ac92492d2347c6235b4d2611184'}]}, fh)
+            archived[object_name] = ('b1946ac92492d2347c6235b4d2611184', 6)
+
+    entries = objects(tmp)
+    assert len(entries) == 6
+    archived['/CCBR_Archive/PI_Lab_X/Sample_0/R1.fastq.gz'] = ('b1946ac92492d2347c6235b4d2611184', 5)
+    archived['/CCBR_Archive/PI_Lab_X/Sample_1/R2.fastq.gz'] = ('d41d8cd98f00b204e9800998ecf8427e', 6)
+    archived['/CCBR_Archive/PI_Lab_X/Sample_2/R2.fastq.gz'] = (None, None)
+    del archived['/CCBR_Archive/PI_Lab_X/Sample_2/R1.fastq.gz']
+
+    with MockService(archived, flaky = ['/CCBR_Archive/PI_Lab_X/Sample_0/R2.fastq.gz']) as service:
+        rows = verify(entries, Client(service.url), workers = 4, backoff = 0.01)
+        assert service.requests == 7
+    assert [r[0] for r in rows] == ['size', 'ok', 'ok', 'checksum', 'missing', 'pending'], rows
+    assert requeue(tmp, rows) == 3
+    requeued = sorted(os.path.relpath(os.path.join(r, f), tmp) for r, d, fs in os.walk(os.path.join(tmp, 'requeue')) for f in fs)
+    assert len(requeued) == 3 * 2 + 3, requeued
+
+    # Data objects are not requested once the server is unreachable
+    rows = verify(entries * 100, Client(service.url), workers = 4, retries = 1, backoff = 0.01)
+    assert all(r[0] == 'error' for r in rows)
+
+    # Tens of thousands of data objects
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    archived = {'/CCBR_Archive/f{}'.format(i): ('b1946ac92492d2347c6235b4d2611184', 6) for i in range(n)}
+    with MockService(archived, latency = 0.002) as service:
+        start = time.time()
+        rows = verify([(str(i), o, c, s) for i, (o, (c, s)) in enumerate(sorted(archived.items()))], Client(service.url), workers = 32)
+        assert all(r[0] == 'ok' for r in rows)
+    print('Verified {} data objects in {:.1f}s'.format(n, time.time() - start))
@@ -0,0 +1,830 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""In-process pyrkit pipeline. The programs in pyrkit/src (lint.py, pyparser.py,
+initialize.py, meta, ...) are imported as modules, and the parsed project request
+template, QC table and collection hierarchy are passed between each stage in memory
+instead of round-tripping through JSON/TSV files and new python interpreters. Each
+stage mirrors the function of the same name in the pyrkit bash script.
+"""
+
+# Python standard library
+from __future__ import print_function
+import os, sys, re, glob, json
+
+# Local imports
+from utils import err, fatal, exists, md5sum, initialize
+from benchmark import tracer
+from checksums import cache
+
+# Programs in pyrkit/src are imported as modules
+home = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, os.pardir, 'src'))
+if home not in sys.path:
+    sys.path.insert(0, home)
+
+_modules = {}
+
+
+def meta():
+    """Imports pyrkit/src/meta as a module. The meta program does not have a .py
+    extension, so it is loaded from its source file and cached for later calls.
+    @return meta <module>:
+        meta program as a python module
+    """
+    if 'meta' not in _modules:
+        import importlib.util
+        from importlib.machinery import SourceFileLoader
+        loader = SourceFileLoader('meta', os.path.join(home, 'meta'))
+        spec = importlib.util.spec_from_loader('meta', loader)
+        module = importlib.util.module_from_spec(spec)
+        loader.exec_module(module)
+        _modules['meta'] = module
+
+    return _modules['meta']
+
+
+def _sorted(data):
+    """Private function to sort the keys of nested dictionaries. Downstream stages
+    see the same key order as when the data was saved and loaded as sorted JSON.
+    @param data <any>:
+        Parsed data to sort
+    @return data <any>:
+        Copy of the data with sorted dictionary keys
+    """
+    if isinstance(data, dict):
+        return {k: _sorted(data[k]) for k in sorted(data)}
+    elif isinstance(data, (list, tuple)):
+        return [_sorted(v) for v in data]
+
+    return data
+
+
+def _unquoted(value):
+    """Private function to format a JSON value like 'jq ... | sed "s/\\"//g" | sed "s/'//g"'.
+    @param value <any>:
+        Value from a parsed JSON file
+    @return value <str>:
+        Value as printed by jq without any quotes
+    """
+    if isinstance(value, list):
+        return '\n'.join(_unquoted(v) for v in value)
+    elif not isinstance(value, str):
+        value = json.dumps(value)
+
+    return value.replace('"', '').replace("'", '')
+
+
+def search(config, ipath, mpath, exclude = ['DME']):
+    """Finds the files of each module in a pipeline config. Files in the input directory are
+    matched by their relative path, up to the deepest search pattern, and files in the MultiQC
+    directory are matched by their name. Each file is matched once against all modules.
+    @param config <config.Config>:
+        Compiled pipeline config, see config.load()
+    @param ipath <str>:
+        Input Directory or pipeline working directory (i.e. $INPUT_DIRECTORY)
+    @param mpath <str>:
+        MultiQC Directory (i.e. $MULTIQC_DIRECTORY)
+    @param exclude list[<str>]:
+        Directories in the input directory to skip (i.e. pyrkit's output directory)
+    @return found <dict>:
+        [module] = [(path, sample), ...] sorted by path, modules keep their config order
+    """
+    candidates = []
+    for root, dirs, files in os.walk(ipath):
+        relative = os.path.relpath(root, ipath)
+        level = 0 if relative == '.' else relative.count(os.sep) + 1
+        dirs[:] = [d for d in dirs if not d.startswith('.') and not (level == 0 and d in exclude)]
+        if level >= config.depth:
+            dirs[:] = []
+        prefix = '' if level == 0 else relative.replace(os.sep, '/') + '/'
+        candidates += [(prefix + f, os.path.join(root, f)) for f in files]
+    candidates += [(f, os.path.join(mpath, f)) for f in os.listdir(mpath) if os.path.isfile(os.path.join(mpath, f))]
+
+    import fscache
+
+    found, seen = {m: [] for m in config.modules}, set()
+    for relative, path in candidates:
+        module, sample = config.match(relative)
+        if module and fscache.realpath(path) not in seen:
+            seen.add(fscache.realpath(path))
+            found[module].append((path, sample))
+
+    return {m: sorted(files) for m, files in found.items()}
+
+
+def lint(template, opath, test_sheets = False, cache_directory = None):
+    """Lints and parses the project request template, see src/lint.py
+    @param template <str>:
+        Project request template (i.e. $REQUEST_TEMPLATE)
+    @param opath <str>:
+        DME base directory for all intermediate output files
+    @param test_sheets <bool>:
+        Parse the example sheets included in the template
+    @param cache_directory <str>:
+        Parsed template cache shared across projects, defaults to the one in opath
+    @return data_dict, project_dict, sample_dict <tuple(<dict>, <dict>, <dict>)>:
+        Parsed data dictionary, project and sample metadata
+    """
+    import lint as linter
+
+    parsed = linter.run(*linter.validate([template, opath, test_sheets]), cache_directory = cache_directory)
+
+    return tuple(_sorted(data) for data in parsed)
+
+
+def parse(sample_dict, mpath):
+    """Parses sample group information from the parsed sample metadata into
+    sample_group.txt, which is parsed along with MultiQC output files.
+    @param sample_dict <dict>:
+        Parsed sample metadata, see lint()
+    @param mpath <str>:
+        MultiQC Directory (i.e. $MULTIQC_DIRECTORY)
+    """
+    def tsv(value):
+        # Escapes a value like jq's @tsv filter
+        if value is None:
+            return ''
+        return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+    with open(os.path.join(mpath, 'sample_group.txt'), 'w') as fh:
+        fh.write('Sample\tTissueType\n')
+        for sid, metadata in sample_dict.items():
+            line = '\t'.join([tsv(metadata.get('Sample Name')), tsv(metadata.get('Group'))])
+            fh.write(re.sub('\tnan$', '\tUnknown', line) + '\n')
+
+
+def QC(mpath):
+    """Aggregates MultiQC information across all samples into a QC table, see src/pyparser.py
+    The table is saved as multiqc_matrix.tsv in the MultiQC directory for upload.
+    @param mpath <str>:
+        MultiQC Directory (i.e. $MULTIQC_DIRECTORY)
+    @return lines list[<str>]:
+        Lines of the QC table
+    """
+    import pyparser
+
+    table = pyparser.qc(sorted(glob.glob(os.path.join(mpath, '*.txt'))))
+    table = table.to_csv(index = False, sep = '\t')
+    with open(os.path.join(mpath, 'multiqc_matrix.tsv'), 'w') as fh:
+        fh.write(table)
+
+    return table.splitlines(True)
+
+
+def fingerprint(ipath, opath, project_dict, pipeline = 'rnaseq'):
+    """Generates a unique and deterministic identifier for an analysis based on the user
+    inputs to the pipeline. Run metadata is saved to run_metadata.txt and run_inputs.md5.
+    @param ipath <str>:
+        Input Directory or pipeline working directory (i.e. $INPUT_DIRECTORY)
+    @param opath <str>:
+        DME base directory for all intermediate output files
+    @param project_dict <dict>:
+        Parsed project metadata, see lint()
+    @param pipeline <str>:
+        Pipeline's entry in the reference JSON file, see config.Config.references
+    @return analysis_dict, inputs_md5, analysis_id, assembly_name, gtf_ver <tuple>:
+        Run metadata, MD5 checksum of all inputs, short analysis id, assembly name and GTF version
+    """
+    import initialize
+
+    with open(os.path.join(ipath, 'config.json')) as fh:
+        config = json.load(fh)
+    with open(_unquoted(config['project']['annotation'])) as fh:
+        references = json.load(fh)['references'][pipeline]
+
+    organism = _unquoted(references['ORGANISM'])
+    species = _unquoted(project_dict['Project']['Organism(s)'])
+    gtf_ver = organism.split('_')[-1]
+    run_metadata = [
+        ('pipeline_ver', _unquoted(config['project']['version'])),
+        ('number_of_cases', str(len(config['project']['groups']['rsamps']))),
+        ('runtype', json.dumps(config['project']['nends']).replace('1', 'single-end').replace('2', 'paired-end')),
+        ('method', _unquoted(project_dict['Project']['Type of Project'])),
+        ('gtf', _unquoted(references['GTFFILE'])),
+        ('gtf_ver', 'v' + gtf_ver.replace('v', '', 1)),
+        ('assembly_name', organism.split('_')[0]),
+        ('genomefa', _unquoted(references['GENOME'])),
+        ('species', species[:1].upper() + species[1:])
+    ]
+    run_metadata += [('file', f) for f in sorted(glob.glob(os.path.join(ipath, '*.R?.fastq.gz')))]
+
+    # Convert input files to MD5 checksums, sorted by value
+    inputs = [(field, value) for field, value in run_metadata if field not in ['gtf_ver', 'assembly_name']]
+    with open(os.path.join(opath, 'run_inputs.md5'), 'w') as fh:
+        for field, value in sorted(inputs, key = lambda fv: (fv[1], fv[0])):
+            if os.path.isfile(value):
+                hashed = cache.bytes_hashed
+                value = cache.md5(value)
+                tracer.count(files = 1, bytes_hashed = cache.bytes_hashed - hashed)
+            fh.write('{}\t{}\n'.format(field, value))
+
+    # Add MD5 checksum of all inputs and create an analysis id
+    inputs_md5 = md5sum(os.path.join(opath, 'run_inputs.md5'))
+    analysis_id = '{}-{}-{}'.format(inputs_md5[:3], inputs_md5[len(inputs_md5)//2:len(inputs_md5)//2+2], inputs_md5[-4:])
+    run_metadata += [('md5_all_inputs', inputs_md5), ('md5_all_inputs_serial', analysis_id)]
+    with open(os.path.join(opath, 'run_metadata.txt'), 'w') as fh:
+        fh.writelines('{}\t{}\n'.format(field, value) for field, value in run_metadata)
+
+    analysis_dict = initialize.tsv2dict(os.path.join(opath, 'run_metadata.txt'))
+
+    return analysis_dict, inputs_md5, analysis_id, analysis_dict['assembly_name'], analysis_dict['gtf_ver']
+
+
+def collections(opath, vault, data_dict, project_dict, sample_dict, qc_lines, analysis_dict, project_id = ''):
+    """Generates the collection hierarchy and its metadata in DME base directory's upload
+    folder, see src/initialize.py
+    @param opath <str>:
+        DME base directory for all intermediate output files
+    @param vault <str>:
+        DME Vault to push data (i.e. /CCBR_Archive or /CCBR_EXT_Archive)
+    @param data_dict, project_dict, sample_dict <dict>:
+        Parsed data dictionary, project and sample metadata, see lint()
+    @param qc_lines list[<str>]:
+        Lines of the QC table, see QC()
+    @param analysis_dict <dict>:
+        Run metadata, see fingerprint()
+    @param project_id <str>:
+        Optional Project ID
+    @return analysis_home <str>:
+        Primary Analysis collection relative to the DME base directory
+    """
+    import initialize
+
+    vault = vault.strip('/')
+    if vault not in initialize.config['.vaults']:
+        fatal('Fatal: {} is not a vaild DME vault! Please choose from one of the following: {}'.format(vault, initialize.config['.vaults']))
+
+    tree = initialize.run(data_dict, project_dict, sample_dict, os.path.join(opath, 'upload'), vault,
+        pid = (project_id or '').upper(), metarun = initialize.lines2matrix(qc_lines),
+        analysis_dict = analysis_dict, convert = True)
+
+    for collection in tree:
+        if os.path.basename(collection).lower().startswith('primary_analysis_'):
+            return os.path.join('upload', collection)
+
+    fatal('Fatal: Failed to initialize a Primary Analysis collection in {}!'.format(opath))
+
+
+def distribute(files, queue, workers = 4, slurm = False):
+    """Hashes the files that are not in the checksum cache with a pool of workers, which
+    claim items of a work queue on the shared filesystem, see src/hashqueue.py. The
+    checksums of the workers are merged into the cache. An interrupted run resumes the
+    queue, only unfinished items are hashed again. A file that fails is left to be
+    hashed by this process later on.
+    @param files list[<str>]:
+        Files on the local filesystem
+    @param queue <str>:
+        Queue directory on a filesystem shared by all workers
+    @param workers <int>:
+        Number of workers
+    @param slurm <bool>:
+        Submit the workers as a SLURM job array instead of local processes
+    @return bytes_hashed <int>:
+        Number of bytes hashed by the workers
+    """
+    from shutil import rmtree
+    import hashqueue
+
+    missing = [f for f in files if cache.get(f) is None]
+    if not missing:
+        return 0
+    hashqueue.create(queue, missing)
+    hashqueue.spawn(queue, workers, slurm)
+    checksums, failures = hashqueue.merge(queue)
+    for path, error in sorted(failures.items()):
+        err('WARNING: Failed to hash {} in the work queue: {}'.format(path, error))
+    cache.update(checksums)
+    rmtree(queue)
+
+    return sum(size for md5, size, mtime in checksums.values())
+
+
+def links(found, config, opath, vault, assembly_name, gtf_ver, analysis_id, inputs_md5, dme_analysis_home,
+    hash_workers = 0, slurm = False):
+    """Stages the files of each sample module into their Sample collection and generates
+    their data-object metadata, see src/stage.py and src/meta. The checksums of all files
+    are saved to checksums.md5 first, files already hashed by this run are not read again.
+    @param found <dict>:
+        Files of each module, see search()
+    @param config <config.Config>:
+        Compiled pipeline config, see config.load()
+    @param opath <str>:
+        DME base directory for all intermediate output files
+    @param vault <str>:
+        DME Vault to push data (i.e. /CCBR_Archive or /CCBR_EXT_Archive)
+    @param assembly_name, gtf_ver <str>:
+        Assembly Name (i.e. mm10) and GTF Version (i.e. M21)
+    @param analysis_id, inputs_md5 <str>:
+        Short and long Analysis ID, see fingerprint()
+    @param dme_analysis_home <str>:
+        DME Primary Analysis Collection Path associated with a sample
+    @param hash_workers <int>:
+        Number of workers hashing files through a work queue, see distribute(),
+        files are hashed by this process if 0
+    @param slurm <bool>:
+        Submit the hash workers as a SLURM job array
+    """
+    from argparse import Namespace
+    import fscache, stage
+
+    manifest = os.path.join(opath, 'staged.tsv')
+    open(manifest, 'w').close()
+    upload = os.path.join(opath, 'upload')
+    uuid = ('{}_{}'.format(assembly_name, gtf_ver), analysis_id)
+
+    # Sample collections are listed once, instead of globbing the upload folder for each file.
+    # A collection matches the glob 'Sample_*_{sample}' at each '_' after its prefix.
+    rawdirs = {}
+    for lab, labpath, ltype in fscache.scandir(upload):
+        if ltype != 'dir' or not lab.startswith('PI_Lab_'):
+            continue
+        for project, projectpath, ptype in fscache.scandir(labpath):
+            if ptype != 'dir' or not project.startswith('Project_'):
+                continue
+            for collection, path, ctype in fscache.scandir(projectpath):
+                if ctype == 'dir' and collection.startswith('Sample_'):
+                    for i in range(len('Sample_'), len(collection)):
+                        if collection[i] == '_':
+                            rawdirs.setdefault(collection[i+1:], []).append(path)
+
+    # Checksums are listed by the resolved source path of each file
+    checksums = os.path.join(opath, 'checksums.md5')
+    with tracer.span('checksums') as span:
+        files = [f for module in config.modules if config.types[module] == 'sample' for f, sample in found[module]]
+        if hash_workers:
+            span.count(workers = hash_workers, bytes_hashed = distribute(files, os.path.join(opath, 'hashqueue'), hash_workers, slurm))
+        span.count(files = len(files), bytes_hashed = cache.manifest(files, checksums, mode = 'w'))
+
+    for module in config.modules:
+        if config.types[module] != 'sample':
+            continue
+        # Renamed files are tagged with the analysis that created them
+        renamed = module in config.renames
+        with tracer.span('stage', module = module) as span:
+            for f, sample in found[module]:
+                rawdir = rawdirs.get(sample, [])
+                fname = config.rename(module, os.path.basename(f), uuid)
+                try:
+                    if len(rawdir) != 1:
+                        raise OSError('Failed to find the Sample collection of {}'.format(sample))
+                    destination = stage.stage(f, os.path.join(rawdir[0], fname), manifest)
+                except (IOError, OSError) as e:
+                    err('Failed to stage {} in {}: {}'.format(f, rawdir, e))
+                    continue
+                dmepath = vault.rstrip('/') + rawdir[0][len(upload):]
+                meta().sample(Namespace(input = [destination], output = dmepath, sample_name = sample,
+                    analysis_id = inputs_md5 if renamed else None,
+                    dme_analysis_collection = dme_analysis_home if renamed else None,
+                    checksums = checksums, staged = manifest))
+                span.count(files = 1)
+
+
+def multi(found, config, analysis_dir, template, dme_analysis_home, inputs_md5, opath, sidecar = False, compress = False):
+    """Prepares the files of each combined module for upload into the Primary Analysis
+    collection and generates their data-object metadata, see src/reformat.py, src/compress.py
+    and src/meta
+    @param found <dict>:
+        Files of each module, see search()
+    @param config <config.Config>:
+        Compiled pipeline config, see config.load()
+    @param analysis_dir <str>:
+        Path to Primary Analysis Collection directory on local filesystem
+    @param template <str>:
+        Project Request Template (i.e. $REQUEST_TEMPLATE)
+    @param dme_analysis_home <str>:
+        DME Primary Analysis Collection Path
+    @param inputs_md5 <str>:
+        Long Analysis ID, see fingerprint()
+    @param opath <str>:
+        DME base directory for all intermediate output files
+    @param sidecar <bool>:
+        Write binary sidecars of counts matrices
+    @param compress <bool>:
+        Compress large counts matrices
+    """
+    from argparse import Namespace
+    from concurrent.futures import ProcessPoolExecutor
+    import reformat, stage
+
+    combined = [m for m in config.modules if config.types[m] == 'combined']
+    counts = [(f, os.path.join(analysis_dir, config.rename(m, os.path.basename(f))))
+        for m in combined if config.reformat[m] for f, sample in found[m]]
+
+    # Reformat counts matrices for downstream analysis, each matrix is streamed once
+    matrices = []
+    with tracer.span('reformat') as span:
+        if counts:
+            with ProcessPoolExecutor(max_workers = len(counts)) as pool:
+                jobs = [pool.submit(reformat.reformat, source, destination, sidecar) for source, destination in counts]
+                matrices = [job.result() for job in jobs]
+        span.count(files = len(counts), bytes = sum(os.path.getsize(source) for source, destination in counts))
+
+    # Compress large counts matrices and save their checksums, see links()
+    checksums = os.path.join(opath, 'checksums.md5')
+    if compress:
+        import compress as gzip
+        with tracer.span('compress') as span:
+            for matrix in matrices:
+                if os.path.getsize(matrix) >= gzip.min_size:
+                    md5 = gzip.compress(matrix, matrix + '.gz')
+                    cache.add(matrix + '.gz', md5)
+                    span.count(files = 1, bytes = os.path.getsize(matrix), bytes_hashed = os.path.getsize(matrix + '.gz'))
+                    os.remove(matrix)
+                    with open(checksums, 'a') as fh:
+                        fh.write('{}  {}\n'.format(md5, os.path.abspath(matrix + '.gz')))
+
+    # Stage remaining files in Primary Analysis collection
+    manifest = os.path.join(opath, 'staged.tsv')
+    files = [(f, config.rename(m, os.path.basename(f))) for m in combined if not config.reformat[m] for f, sample in found[m]]
+    with tracer.span('stage') as span:
+        for f, fname in files + [(template, os.path.basename(template))]:
+            try:
+                stage.stage(f, os.path.join(analysis_dir, fname), manifest)
+                span.count(files = 1)
+            except (IOError, OSError) as e:
+                err('Failed to stage {} in {}: {}'.format(f, analysis_dir, e))
+
+    # Generate dataobject metadata files for aggregate or multi-sample data
+    with tracer.span('meta') as span:
+        files = []
+        for root, dirs, fnames in os.walk(analysis_dir):
+            files += [os.path.join(root, f) for f in sorted(fnames) if not f.lower().endswith('.metadata.json')]
+        # Add the checksum of each file without a pre-computed checksum
+        precomputed = meta().checksums(checksums)
+        hashed = cache.manifest([f for f in files if os.path.abspath(f) not in precomputed], checksums)
+        meta().combined(Namespace(input = files, output = dme_analysis_home, analysis_id = inputs_md5,
+            checksums = checksums, staged = manifest))
+        span.count(files = len(files), bytes_hashed = hashed)
+
+
+def extract(ipath, vault, template, mpath, project_id = '', sidecar = False, compress = False, pipeline = 'rnaseq',
+    cache_directory = None, hash_workers = 0, slurm = False):
+    """Runs each stage of the pipeline to create the local mock DME hierarchy with
+    collection and data-object metadata in $INPUT_DIRECTORY/DME.
+    @param ipath <str>:
+        Input Directory or pipeline working directory (i.e. $INPUT_DIRECTORY)
+    @param vault <str>:
+        DME Vault to push data (i.e. /CCBR_Archive or /CCBR_EXT_Archive)
+    @param template <str>:
+        Project Request Template (i.e. $REQUEST_TEMPLATE)
+    @param mpath <str>:
+        MultiQC Directory (i.e. $MULTIQC_DIRECTORY)
+    @param project_id <str>:
+        Optional Project ID
+    @param sidecar <bool>:
+        Write binary sidecars of counts matrices
+    @param compress <bool>:
+        Compress large counts matrices
+    @param pipeline <str>:
+        Name of a pipeline config (i.e. rnaseq, chipseq, wgs) or path to a YAML file
+    @param cache_directory <str>:
+        Parsed template cache shared across projects, see lint()
+    @param hash_workers <int>:
+        Number of workers hashing files through a work queue, see distribute()
+    @param slurm <bool>:
+        Submit the hash workers as a SLURM job array
+    @return opath <str>:
+        DME base directory for all intermediate output files
+    """
+    from config import load
+    import fscache
+
+    ipath, mpath, vault = ipath.rstrip('/'), mpath.rstrip('/'), vault.rstrip('/')
+    opath = os.path.join(ipath, 'DME')
+    config = load(pipeline)
+
+    calls = fscache.report()
+    with tracer.span('extract', pipeline = config.name) as extracted:
+        with tracer.span('lint'):
+            data_dict, project_dict, sample_dict = lint(template, opath, cache_directory = cache_directory)
+        with tracer.span('parse'):
+            parse(sample_dict, mpath)
+        with tracer.span('QC') as span:
+            qc_lines = QC(mpath)
+            span.count(samples = len(qc_lines) - 1)
+        with tracer.span('search') as span:
+            found = search(config, ipath, mpath, exclude = [os.path.basename(opath)])
+            span.count(files = sum(len(files) for files in found.values()))
+        with tracer.span('fingerprint'):
+            analysis_dict, inputs_md5, analysis_id, assembly_name, gtf_ver = fingerprint(ipath, opath, project_dict, config.references)
+        with tracer.span('collections'):
+            analysis_home = collections(opath, vault, data_dict, project_dict, sample_dict, qc_lines, analysis_dict, project_id)
+        dme_analysis_home = re.sub('^upload', vault, analysis_home)
+        with tracer.span('links'):
+            links(found, config, opath, vault, assembly_name, gtf_ver, analysis_id, inputs_md5, dme_analysis_home,
+                hash_workers, slurm)
+        with tracer.span('multi'):
+            multi(found, config, os.path.join(opath, analysis_home), template, dme_analysis_home, inputs_md5, opath, sidecar, compress)
+        # Filesystem metadata lookups and the syscalls saved by the cache, see src/fscache.py
+        extracted.count(**{'fs_' + key: value - calls[key] for key, value in fscache.report().items()})
+
+    return opath
+
+
+def dryrun(opath, dme_repo, vault, directory = 'upload'):
+    """Dry-runs dm_register_directory command for pushing local data to HPC DME
+    @param opath <str>:
+        DME base directory for all intermediate output files
+    @param dme_repo <str>:
+        Path to local git installation of DME CLU toolkit
+    @param vault <str>:
+        DME Vault to push data (i.e. /CCBR_Archive or /CCBR_EXT_Archive)
+    @param directory <str>:
+        Folder of the DME base directory to upload, see verify()
+    @return exitcode <int>:
+        Exit code of dm_register_directory
+    """
+    from shells import bash
+
+    utils = os.path.join(dme_repo.rstrip('/'), 'utils')
+    if not exists(os.path.join(utils, 'functions')):
+        fatal('Fatal: Failed to locate HPC DME toolkit functions in {}!'.format(utils))
+
+    exitcode = bash('export HPC_DM_UTILS="{0}"; source "{0}/functions"; '
+        'dm_register_directory -d -s -t 2 -e <(echo \'**.metadata.json\') "{2}" "/{1}"'.format(utils, vault.strip('/'), directory),
+        cwd = opath)
+    print('Exit status of dryrun: {}'.format(exitcode))
+
+    return exitcode
+
+
+def submit(opath, dme_repo, vault, directory = 'upload'):
+    """Submits a job to push local data into HPC DME, see src/submit.sh
+    @param opath <str>:
+        DME base directory for all intermediate output files
+    @param dme_repo <str>:
+        Path to local git installation of DME CLU toolkit
+    @param vault <str>:
+        DME Vault to push data (i.e. /CCBR_Archive or /CCBR_EXT_Archive)
+    @param directory <str>:
+        Folder of the DME base directory to upload, see verify()
+    @return exitcode <int>:
+        Exit code of sbatch
+    """
+    from shells import bash
+
+    return bash('sbatch -J "pyrkit" --mem=24g --cpus-per-task=4 --time=24:00:00 "{}" "{}" "{}" "/{}" "{}"'.format(
+        os.path.join(home, 'submit.sh'), opath, dme_repo.rstrip('/'), vault.strip('/'), directory))
+
+
+def verify(opath, dme_repo = None, url = None, workers = 16, dry_run = False):
+    """Verifies the data objects uploaded from a DME base directory. The checksum and size
+    recorded by HPC DME for each data object are compared against its local values, see
+    dev/src/dme.py. The result of each data object is saved in logs/verify.tsv. Data
+    objects that are missing or do not match are staged in the requeue folder and
+    uploaded again, only the upload of the requeue folder is dry-run with dry_run.
+    @param opath <str>:
+        DME base directory for all intermediate output files
+    @param dme_repo <str>:
+        Path to local git installation of DME CLU toolkit, the requeue folder is not
+        uploaded if not provided
+    @param url <str>:
+        URL of the HPC DME API, overrides hpc.server.url of the DME CLU toolkit
+    @param workers <int>:
+        Maximum number of concurrent requests to the API
+    @param dry_run <bool>:
+        Dry-run the upload of the requeue folder instead of submitting it
+    @return rows list[<tuple>]:
+        Data objects that were not verified, see dme.verify()
+    """
+    import dme
+
+    token = None
+    if dme_repo:
+        settings, token = dme.settings(dme_repo)
+        url = url or settings
+    if not url and not dme_repo:
+        fatal('Fatal: Failed to provide the URL of the HPC DME API! Please provide --server or -d DME_REPO.')
+    elif not url:
+        fatal('Fatal: Failed to find the URL of the HPC DME API (hpc.server.url) in {}! Please set it or provide --server.'.format(
+            os.path.join(dme_repo.rstrip('/'), 'utils', 'hpcdme.properties')))
+
+    with tracer.span('verify', workers = workers) as span:
+        entries = dme.objects(opath)
+        rows = dme.verify(entries, dme.Client(url, token), workers)
+        logs = os.path.join(opath, 'logs')
+        initialize(logs)
+        with open(os.path.join(logs, 'verify.tsv'), 'w') as fh:
+            fh.write('status\tobject_name\tmd5\tchecksum\tsize\tremote_size\n')
+            fh.writelines('{0}\t{2}\t{3}\t{4}\t{5}\t{6}\n'.format(*row) for row in rows)
+        counts = {status: 0 for status in ['ok', 'pending', 'error'] + dme.mismatches}
+        for row in rows:
+            counts[row[0]] += 1
+        requeued = dme.requeue(opath, rows)
+        span.count(objects = len(rows), requeued = requeued, **counts)
+    print('Verified {} data object(s): {}'.format(len(rows), ', '.join('{} {}'.format(n, s) for s, n in counts.items() if n)))
+
+    if requeued and dme_repo:
+        # Data objects of a DME base directory are uploaded into one vault
+        vault = [row[2] for row in rows if row[0] in dme.mismatches][0].split('/')[1]
+        with tracer.span('requeue', objects = requeued):
+            dryrun(opath, dme_repo, vault, 'requeue')
+            if not dry_run:
+                submit(opath, dme_repo, vault, 'requeue')
+
+    return [row for row in rows if row[0] != 'ok']
+
+
+def projects(filename):
+    """Reads the projects of a batch from a TSV file. Each line contains the input
+    directory, request template, MultiQC directory, vault and an optional project id
+    of a project. Empty lines and lines starting with '#' are skipped.
+    @param filename <str>:
+        Batch file listing one project per line
+    @return projects list[<tuple>]:
+        (ipath, template, mpath, vault, project_id) of each project
+    """
+    entries, seen = [], set()
+    with open(filename) as fh:
+        for i, line in enumerate(fh, 1):
+            if not line.strip() or line.startswith('#'):
+                continue
+            fields = [f.strip() for f in line.rstrip('\n').split('\t')]
+            if len(fields) not in [4, 5]:
+                fatal('Fatal: Line {} of {} does not contain 4 or 5 tab-separated fields!'.format(i, filename))
+            ipath, template, mpath, vault = fields[:4]
+            for path in [ipath, template, mpath]:
+                if not os.access(path, os.R_OK):
+                    fatal('Fatal: Line {} of {}: {} does not exist or is not readable!'.format(i, filename, path))
+            if os.path.realpath(ipath) in seen:
+                fatal('Fatal: Line {} of {}: {} is listed more than once!'.format(i, filename, ipath))
+            seen.add(os.path.realpath(ipath))
+            entries.append((ipath, template, mpath, vault, fields[4] if len(fields) == 5 else ''))
+
+    return entries
+
+
+def size(opath):
+    """Gets the number of bytes to upload from a DME base directory's upload folder.
+    Staged symlinks are followed and metadata files are not counted.
+    @param opath <str>:
+        DME base directory for all intermediate output files
+    @return nbytes <int>:
+        Number of bytes to upload
+    """
+    nbytes = 0
+    for root, dirs, files in os.walk(os.path.join(opath, 'upload')):
+        nbytes += sum(os.stat(os.path.join(root, f)).st_size for f in files if not f.lower().endswith('.metadata.json'))
+
+    return nbytes
+
+
+def schedule(uploads, lanes):
+    """Balances the uploads of a batch by bytes across a fixed number of lanes. Each
+    lane uploads its projects one after another and all lanes upload in parallel.
+    The largest upload is assigned first to the lane with the fewest bytes, so no
+    lane is left with more than one large project when the others have finished.
+    @param uploads list[<tuple>]:
+        (opath, vault) of each project to upload
+    @param lanes <int>:
+        Number of concurrent uploads
+    @return schedule list[<tuple>]:
+        (lane, nbytes, opath, vault) of each upload, largest upload first
+    """
+    jobs = sorted(((size(opath), opath, vault) for opath, vault in uploads), key = lambda job: (-job[0], job[1]))
+    loads = [0] * max(1, min(lanes, len(jobs)))
+    plan = []
+    for nbytes, opath, vault in jobs:
+        lane = loads.index(min(loads))
+        loads[lane] += nbytes
+        plan.append((lane, nbytes, opath, vault))
+
+    return plan
+
+
+def batch(entries, bpath, dme_repo = None, threads = 16, upload_threads = 4, dry_run = False,
+    sidecar = False, compress = False, pipeline = 'rnaseq', hash_workers = 0, slurm = False):
+    """Extracts each project of a batch and uploads all of them with one job. The pipeline
+    config, the parsed template cache and the checksum cache are shared by all projects,
+    and all uploads are balanced by bytes across lanes with a cap on total concurrency.
+    The shared caches, the upload schedule and the run report are saved in the batch
+    directory. A project that fails to extract or fails its dry-run is reported and
+    left out of the upload.
+    @param entries list[<tuple>]:
+        Projects of the batch, see projects()
+    @param bpath <str>:
+        Batch directory for shared caches, the upload schedule and logs
+    @param dme_repo <str>:
+        Path to local git installation of DME CLU toolkit, nothing is uploaded if not provided
+    @param threads <int>:
+        Total number of upload threads across all concurrent uploads
+    @param upload_threads <int>:
+        Number of threads of each upload (dm_register_directory -t)
+    @param dry_run <bool>:
+        Dry-run each upload instead of submitting the upload job
+    @param sidecar, compress <bool>:
+        See extract()
+    @param pipeline <str>:
+        Name of a pipeline config (i.e. rnaseq, chipseq, wgs) or path to a YAML file
+    @param hash_workers <int>:
+        Number of workers hashing the files of all projects through one work queue
+        before the projects are extracted, see distribute()
+    @param slurm <bool>:
+        Submit the hash workers as a SLURM job array
+    @return failed list[<str>]:
+        Input directories of the projects that failed
+    """
+    initialize(bpath)
+    cached = os.path.join(bpath, 'checksums.tsv')
+    cache.load(cached)
+    uploads, failed = [], []
+    with tracer.span('batch', projects = len(entries)) as span:
+        if hash_workers:
+            from config import load
+            config = load(pipeline)
+            with tracer.span('hash', workers = hash_workers) as hashed:
+                files = []
+                for ipath, template, mpath, vault, project_id in entries:
+                    found = search(config, ipath.rstrip('/'), mpath.rstrip('/'))
+                    files += [f for m in config.modules if config.types[m] == 'sample' or not config.reformat[m] for f, sample in found[m]]
+                hashed.count(files = len(files), bytes_hashed = distribute(files, os.path.join(bpath, 'hashqueue'), hash_workers, slurm))
+            cache.save(cached)
+        for ipath, template, mpath, vault, project_id in entries:
+            initialize(os.path.join(ipath.rstrip('/'), 'DME'))
+            try:
+                opath = extract(ipath, vault, template, mpath, project_id, sidecar, compress, pipeline,
+                    cache_directory = os.path.join(bpath, '.cache', 'lint'))
+                uploads.append((opath, vault))
+            except SystemExit as e:
+                err('WARNING: Failed to extract {} (exit-code {}), skipping its upload!'.format(ipath, e.code))
+                failed.append(ipath)
+            except Exception as e:
+                err('WARNING: Failed to extract {} ({}: {}), skipping its upload!'.format(ipath, type(e).__name__, e))
+                failed.append(ipath)
+            # Checksums of finished projects are kept if the batch is interrupted
+            cache.save(cached)
+        span.count(checksum_hits = cache.hits, files_hashed = cache.misses, bytes_hashed = cache.bytes_hashed)
+
+    if not uploads or not dme_repo:
+        return failed
+
+    lanes = max(1, threads // upload_threads)
+    plan = schedule(uploads, lanes)
+    with tracer.span('upload', lanes = lanes):
+        with tracer.span('dryrun'):
+            codes = dryruns(plan, dme_repo, lanes, upload_threads)
+            failed += [opath for code, (lane, nbytes, opath, vault) in zip(codes, plan) if code != 0]
+        # Projects that failed their dry-run are not uploaded, the lanes are balanced again
+        passed = [(opath, vault) for code, (lane, nbytes, opath, vault) in zip(codes, plan) if code == 0]
+        plan = schedule(passed, lanes)
+        with open(os.path.join(bpath, 'schedule.tsv'), 'w') as fh:
+            fh.writelines('{}\t{}\t{}\t{}\n'.format(*job) for job in plan)
+        if plan and not dry_run:
+            with tracer.span('submit'):
+                submit_batch(os.path.join(bpath, 'schedule.tsv'), dme_repo, lanes, upload_threads)
+
+    return failed
+
+
+def dryruns(plan, dme_repo, lanes, upload_threads = 4):
+    """Dry-runs dm_register_directory for each upload of a batch, see schedule(). The
+    output of each dry-run is saved in the logs directory of its DME base directory.
+    @param plan list[<tuple>]:
+        Upload schedule of the batch, see schedule()
+    @param dme_repo <str>:
+        Path to local git installation of DME CLU toolkit
+    @param lanes <int>:
+        Number of concurrent dry-runs
+    @param upload_threads <int>:
+        Number of threads of each upload
+    @return exitcodes list[<int>]:
+        Exit code of each dry-run
+    """
+    from shells import run
+
+    utils = os.path.join(dme_repo.rstrip('/'), 'utils')
+    if not exists(os.path.join(utils, 'functions')):
+        fatal('Fatal: Failed to locate HPC DME toolkit functions in {}!'.format(utils))
+
+    results = run(['cd "{2}"; export HPC_DM_UTILS="{0}"; source "{0}/functions"; '
+        'dm_register_directory -d -s -t {1} -e <(echo \'**.metadata.json\') upload "/{3}"'.format(
+            utils, upload_threads, opath, vault.strip('/')) for lane, nbytes, opath, vault in plan], limit = lanes)
+    for result, (lane, nbytes, opath, vault) in zip(results, plan):
+        logs = os.path.join(opath, 'logs')
+        if not os.path.isdir(logs):
+            os.makedirs(logs)
+        with open(os.path.join(logs, 'dryrun.log'), 'w') as fh:
+            fh.write(result.stdout + result.stderr)
+        print('Exit status of dryrun {}: {}'.format(opath, result.returncode))
+
+    return [result.returncode for result in results]
+
+
+def submit_batch(schedule, dme_repo, lanes, upload_threads = 4):
+    """Submits one job to push the local data of a batch into HPC DME, see src/submit_batch.sh
+    @param schedule <str>:
+        Upload schedule of the batch, see schedule()
+    @param dme_repo <str>:
+        Path to local git installation of DME CLU toolkit
+    @param lanes <int>:
+        Number of concurrent uploads
+    @param upload_threads <int>:
+        Number of threads of each upload
+    @return exitcode <int>:
+        Exit code of sbatch
+    """
+    from shells import bash
+
+    return bash('sbatch -J "pyrkit_batch" --mem={}g --cpus-per-task={} --time=72:00:00 "{}" "{}" "{}" "{}"'.format(
+        24 * lanes, lanes * upload_threads, os.path.join(home, 'submit_batch.sh'), os.path.abspath(schedule),
+        dme_repo.rstrip('/'), upload_threads))
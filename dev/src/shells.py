@@ -4,7 +4,7 @@
 # Python standard library
 from __future__ import print_function
 from subprocess import CalledProcessError
-import os, subprocess
+import os, time, signal, subprocess
 
 # Local imports
 from utils import fatal, err
@@ -64,7 +64,153 @@ def bash(cmd, interpreter='/bin/bash', strict=set_options(True), cwd=os.getcwd()
     return exitcode
 
 
+class Result(object):
+    """Result of a command run by run(), see run() and execute().
+    @attribute cmd <str|list[<str>]>:
+        Command that was run
+    @attribute returncode <int>:
+        Exit code of the last attempt, negative if it was killed by a signal
+        (i.e. -9 after a timeout) or None if the command could not be started
+    @attribute stdout, stderr <str>:
+        Captured standard output and error of the last attempt
+    @attribute attempts <int>:
+        Number of times the command was run
+    @attribute elapsed <float>:
+        Wall time of all attempts in seconds, including time waiting to retry
+    @attribute timed_out <bool>:
+        The last attempt was killed after its timeout
+    """
+    def __init__(self, cmd, returncode = None, stdout = '', stderr = '', attempts = 0, elapsed = 0.0, timed_out = False):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.attempts = attempts
+        self.elapsed = elapsed
+        self.timed_out = timed_out
+
+    @property
+    def ok(self):
+        """The command exited with an exit code of zero."""
+        return self.returncode == 0
+
+    def __repr__(self):
+        return 'Result(cmd={!r}, returncode={}, attempts={}, elapsed={:.3f}, timed_out={})'.format(
+            self.cmd, self.returncode, self.attempts, self.elapsed, self.timed_out)
+
+
+async def _attempt(cmd, interpreter, strict, cwd, env, timeout):
+    """Private coroutine to run a command once and capture its output. Shell commands
+    (str) are run with the interpreter, argument lists are run without a shell. Each
+    command runs in its own process group, so a timeout kills its child processes too.
+    @return returncode, stdout, stderr, timed_out <tuple(<int>, <str>, <str>, <bool>)>:
+        Exit code, captured output and whether the command was killed after its timeout
+    """
+    import asyncio
+
+    argv = [interpreter, '-c', strict + cmd] if isinstance(cmd, str) else list(cmd)
+    try:
+        process = await asyncio.create_subprocess_exec(*argv, cwd = cwd, env = env,
+            stdin = asyncio.subprocess.DEVNULL, stdout = asyncio.subprocess.PIPE,
+            stderr = asyncio.subprocess.PIPE, start_new_session = True)
+    except OSError as e:
+        # Executable or working directory does not exist
+        return None, '', str(e), False
+
+    timed_out = False
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        stdout, stderr = await process.communicate()
+
+    return process.returncode, stdout.decode(errors = 'replace'), stderr.decode(errors = 'replace'), timed_out
+
+
+async def execute(cmds, limit = 4, timeout = None, retries = 0, backoff = 1.0, interpreter = '/bin/bash',
+        strict = set_options(True), cwd = None, env = None):
+    """Runs a batch of commands concurrently in one event loop, see run(). Use it in
+    code that already runs an event loop, otherwise use run().
+    @return results list[<Result>]:
+        Result of each command, in the same order as the commands
+    """
+    import asyncio
+
+    semaphore = asyncio.Semaphore(limit)
+
+    async def one(cmd):
+        result = Result(cmd)
+        start = time.perf_counter()
+        for attempt in range(retries + 1):
+            if attempt:
+                # Exponential backoff between attempts, the slot is free while waiting
+                await asyncio.sleep(backoff * 2 ** (attempt - 1))
+            async with semaphore:
+                result.returncode, result.stdout, result.stderr, result.timed_out = await _attempt(
+                    cmd, interpreter, strict, cwd, env, timeout)
+            result.attempts += 1
+            if result.ok:
+                break
+        result.elapsed = time.perf_counter() - start
+        if not result.ok:
+            err("""WARNING: Failed to run '{}' command after {} attempt(s)!
+        └── Command returned a non-zero exitcode of '{}'{}.""".format(cmd, result.attempts, result.returncode,
+                ' after a timeout of {}s'.format(timeout) if result.timed_out else '')
+            )
+        return result
+
+    return await asyncio.gather(*[one(cmd) for cmd in cmds])
+
+
+def run(cmds, limit = 4, timeout = None, retries = 0, backoff = 1.0, interpreter = '/bin/bash',
+        strict = set_options(True), cwd = None, env = None):
+    """Runs a batch of commands concurrently with a limit on the number of running
+    commands. Unlike bash(), the output of each command is captured, each attempt can
+    time out, failed commands are retried with an exponential backoff, and a Result
+    is returned for each command instead of an exit code. All commands share a single
+    asyncio event loop instead of blocking on one process at a time.
+    @param cmds list[<str>|list[<str>]]:
+        Shell commands to run with the interpreter, or argument lists to run without
+        a shell (i.e. ['sbatch', 'submit.sh'])
+    @param limit <int>:
+        Maximum number of commands running at the same time
+    @param timeout <float>:
+        Time limit of each attempt in seconds, the command and its child processes
+        are killed after it [default: no limit]
+    @param retries <int>:
+        Number of times a failed or timed out command is run again
+    @param backoff <float>:
+        Time to wait before the first retry in seconds, doubled after each retry
+    @param interpreter <str>:
+        Interpreter of shell commands [default: bash]
+    @param strict <str>:
+        Prefix of shell commands, see set_options()
+    @param cwd <str>:
+        Working directory of each command [default: current working directory]
+    @param env <dict>:
+        Environment of each command [default: environment of this process]
+    @return results list[<Result>]:
+        Result of each command, in the same order as the commands
+    Example:
+        results = run(['sbatch submit.sh {}'.format(d) for d in dirs], limit = 8, retries = 2)
+        failed = [r.cmd for r in results if not r.ok]
+    """
+    import asyncio
+
+    return asyncio.run(execute(cmds, limit, timeout, retries, backoff, interpreter, strict, cwd, env))
+
+
 if __name__ == '__main__':
     # Tests
     bash('ls -la /home/')
     bash('ls -la /fake/dne/path')
+    start = time.time()
+    results = run(['sleep 0.5; echo $0', 'echo error >&2; exit 3', 'sleep 5', ['echo', 'argv']],
+        limit = 4, timeout = 1, retries = 1, backoff = 0.1)
+    for result in results:
+        print(result, repr(result.stdout), repr(result.stderr))
+    print('Elapsed: {:.2f}s'.format(time.time() - start))
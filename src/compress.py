@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""compress: block-parallel gzip compression of large combined files
+About:
+      This program compresses large combined files (i.e. counts matrices or
+    combined_TIN.tsv) prior to uploading them into object storage. Files larger
+    than a minimum size are split into blocks which are compressed in parallel,
+    and the compressed blocks are joined into a single standard gzip stream
+    (similar to pigz). Each block is primed with the last 32 KB of the previous
+    block, so the compression ratio is close to single-threaded gzip.
+      The MD5 checksum of the compressed output is calculated as it is written,
+    and it can be saved to a checksum manifest (md5sum format). Passing this
+    manifest to 'meta combined --checksums' avoids reading each file again.
+USAGE:
+	$ python compress.py [-t THREADS] [-s MIN_SIZE] [-m MANIFEST] [-k] FILE [FILE ...]
+Example:
+    $ python compress.py -t 4 -s 104857600 -m checksums.md5 RSEM_isoforms_*.tsv
+"""
+
+from __future__ import print_function
+import sys, os, zlib, struct, hashlib
+
+
+# Size of each block of uncompressed data and the size
+# of the dictionary shared between consecutive blocks
+blocksize = 1 << 20
+window = 1 << 15
+
+# Files smaller than 100 MB are not compressed by default
+min_size = 100 * (1 << 20)
+
+
+def _deflate(block, dictionary, level=6):
+    """Private function to compress a block of data into a raw deflate stream. The
+    stream is byte-aligned with a sync flush so that blocks can be concatenated.
+    @param block <bytes>:
+        Block of uncompressed data
+    @param dictionary <bytes>:
+        Last 32 KB of the previous block or an empty string
+    @param level <int>:
+        Compression level from 1 (fastest) to 9 (best)
+    @return compressed <bytes>:
+        Raw deflate data without a header or trailer
+    """
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+    return compressor.compress(block) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def compress(source, destination, threads=4, level=6):
+    """Compresses a file into a standard gzip file using a pool of threads. The
+    checksums of the uncompressed (CRC32) and compressed (MD5) data are computed
+    while the output is written, so each file is only read once.
+    @param source <str>:
+        File to compress
+    @param destination <str>:
+        Output gzip file
+    @param threads <int>:
+        Number of blocks to compress in parallel
+    @param level <int>:
+        Compression level from 1 (fastest) to 9 (best)
+    @return md5 <str>:
+        MD5 checksum of the compressed output
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from collections import deque
+
+    hasher = hashlib.md5()
+    crc, size = 0, 0
+    tmp = destination + '.tmp'
+
+    def output(ofh, data):
+        hasher.update(data)
+        ofh.write(data)
+
+    with open(source, 'rb') as ifh, open(tmp, 'wb') as ofh, \
+            ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+        # Header: deflate, no flags, no mtime for a reproducible output
+        output(ofh, b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff')
+        jobs, dictionary = deque(), b''
+        block = ifh.read(blocksize)
+        while block:
+            crc = zlib.crc32(block, crc)
+            size += len(block)
+            jobs.append(pool.submit(_deflate, block, dictionary, level))
+            dictionary = block[-window:]
+            # Bound the number of blocks held in memory
+            while len(jobs) > 2 * threads:
+                output(ofh, jobs.popleft().result())
+            block = ifh.read(blocksize)
+        while jobs:
+            output(ofh, jobs.popleft().result())
+        # Last empty block ends the deflate stream
+        output(ofh, zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS).flush(zlib.Z_FINISH))
+        output(ofh, struct.pack('<II', crc & 0xffffffff, size & 0xffffffff))
+    os.rename(tmp, destination)
+
+    return hasher.hexdigest()
+
+
+def main():
+
+    # Parse args
+    args = sys.argv[1:]
+    if not args or '-h' in args or '--help' in args:
+        print(__doc__)
+        sys.exit()
+
+    keep = '-k' in args or '--keep' in args
+    args = [arg for arg in args if arg not in ['-k', '--keep']]
+
+    options = {'threads': 4, 'min_size': min_size, 'manifest': None}
+    for option, name, cast in [('-t', 'threads', int), ('-s', 'min_size', int), ('-m', 'manifest', str)]:
+        for flag in [option, '--' + name.replace('_', '-')]:
+            if flag in args:
+                i = args.index(flag)
+                try:
+                    options[name] = cast(args[i+1])
+                except (IndexError, ValueError):
+                    print(__doc__)
+                    sys.exit(1)
+                args = args[:i] + args[i+2:]
+
+    for file in args:
+        if file.endswith('.gz') or os.path.getsize(file) < options['min_size']:
+            # Already compressed or too small to compress
+            continue
+        destination = file + '.gz'
+        md5 = compress(file, destination, options['threads'])
+        if not keep:
+            os.remove(file)
+        print('Creating {}'.format(destination))
+        if options['manifest']:
+            with open(options['manifest'], 'a') as fh:
+                fh.write('{}  {}\n'.format(md5, os.path.abspath(destination)))
+
+
+if __name__ == '__main__':
+    main()
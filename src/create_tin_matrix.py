@@ -2,43 +2,338 @@
 # -*- coding: UTF-8 -*-
 
 from __future__ import print_function
-import sys, pandas, os
+from array import array
+import sys, os
 
+try:
+	from itertools import zip_longest
+except ImportError:
+	# Python 2 fallback
+	from itertools import izip_longest as zip_longest
 
-def create(file, tin_dict, key_index=0, parse_index=4):
-	"""Populates the TIN nested dictionary
+
+# Type code of the arrays used to store TIN values,
+# 'd' (float64) round-trips RSeQC's values exactly
+typecode = 'd'
+
+
+def sample_name(file):
+	"""Returns the name of a sample from the path of its RSEQC output file
+	@param file <str>: Path to RSEQC output file with TIN values
+	@return sample <str>: Basename of the file without its alignment suffix
+	"""
+	return os.path.basename(file).split(".p2.Aligned.")[0]
+
+
+def number(tinvalue):
+	"""Converts a TIN value into a float, non-numeric values (i.e. NA) are NaN
+	@param tinvalue <str>: TIN value of a transcript
+	@return tinvalue <float>
+	"""
+	try:
+		return float(tinvalue)
+	except ValueError:
+		return float('nan')
+
+
+def formatted(tinvalue):
+	"""Returns the default text of a TIN value in the TIN matrix: the shortest repr of
+	the float, and NaN (i.e. a missing transcript) as an empty field. TIN values that
+	are written differently in the RSEQC output file are kept verbatim, see token().
+	@param tinvalue <float>: TIN value of a transcript
+	@return text <str>
+	"""
+	return repr(tinvalue) if tinvalue == tinvalue else ''
+
+
+def token(tinvalue):
+	"""Converts the text of a TIN value into its float and original token. The token is
+	None when formatted() writes the float back as the same text (i.e. 85.0), so only the
+	values written differently (i.e. 0.50, 0, 1e-3 or NA) have to be stored as text.
+	@param tinvalue <str>: TIN value of a transcript
+	@return value, text <tuple(<float>, <str>|None)>
+	"""
+	value = number(tinvalue)
+	return value, (None if formatted(value) == tinvalue else tinvalue)
+
+
+def parsed(file, key_index=0, parse_index=4):
+	"""Generator that lazily parses an RSEQC output file with TIN values. The header
+	is yielded first, followed by each transcript and its TIN value.
 	@param file <str>: Path to RSEQC output file with TIN values to extract
-	@param tin_dict <dict>: Dictionary to populate where [samplebasename][transcriptid] = tin_value
 	@param key_index <int>: Index of the field to join multiple files
 	@param parse_index <int>: Index of field of interest (i.e. TIN value)
+	@yield (tid, tinvalue) <tuple(<str>, <str>)>
 	"""
-
 	with open(file, 'r') as fh:
-		header = next(fh).strip().split('\t')
-		colid = header[key_index]
-		file = os.path.basename(file) # Remove PATH
-		sample = file.split(".p2.Aligned.")[0]
-
 		for line in fh:
 			linelist = line.strip().split('\t')
-			tid = linelist[key_index]
-			tinvalue = linelist[parse_index]
-			if sample not in tin_dict:
-				tin_dict[sample] = {}
+			yield linelist[key_index], linelist[parse_index]
+
 
-			tin_dict[sample][tid] = tinvalue
+def column(file, index, key_index=0, parse_index=4):
+	"""Parses an RSEQC output file into a column of TIN values in the row order of a
+	transcript index, so only the values are passed between processes, see columns()
+	@param file <str>: Path to RSEQC output file with TIN values to extract
+	@param index <dict>: Row of each known transcript, [tid] = row
+	@param key_index <int>: Index of the field to join multiple files
+	@param parse_index <int>: Index of field of interest (i.e. TIN value)
+	@return colid, sample, values, texts, missing, extra <tuple(<str>, <str>, <array>, <dict>, <list>, <list>)>:
+		Name of the key field, sample name, TIN values of the indexed transcripts (NaN if
+		missing), original text of the indexed TIN values that formatted() writes differently
+		where [row] = text, rows of the indexed transcripts missing from the file, and the
+		transcripts that are not in the index with their TIN text in the order of the file
+	"""
+	lines = parsed(file, key_index, parse_index)
+	colid, _ = next(lines)
+	values = array(typecode, [float('nan')]) * len(index)
+	texts = {}
+	seen = bytearray(len(index))
+	extra = []
+	for tid, tinvalue in lines:
+		i = index.get(tid)
+		if i is None:
+			extra.append((tid, tinvalue))
+			continue
+		if seen[i]:
+			# Duplicate transcript, the last TIN value is kept
+			texts.pop(i, None)
+		# Inlined token(), called once per transcript and file
+		try:
+			value = values[i] = float(tinvalue)
+		except ValueError:
+			value = values[i] = float('nan')
+		if value != value or repr(value) != tinvalue:
+			texts[i] = tinvalue
+		seen[i] = 1
+	missing = [i for i, found in enumerate(seen) if not found] if 0 in seen else []
 
-	return colid, tin_dict
+	return colid, sample_name(file), values, texts, missing, extra
+
+
+def build(columns):
+	"""Joins parsed columns of TIN values on a shared transcript index. Transcripts are
+	assigned an integer row in the order they are first seen, and each sample is stored
+	as a single array of TIN values. Samples with the same name are merged.
+	@param columns <iterable>: Parsed columns, see columns()
+	@return colid, transcripts, samples, matrix, texts <tuple(<str>, <list>, <list>, <list>, <list>)>:
+		Name of the key field, transcript ids, sample names, a TIN array per sample and
+		the original text of the TIN values per sample, see column()
+	"""
+	colid, index, transcripts, samples, matrix, texts = None, {}, [], {}, [], []
+	for colid, sample, values, tokens, missing, extra in columns:
+		if sample not in samples:
+			samples[sample] = len(matrix)
+			matrix.append(array(typecode))
+			texts.append({})
+		tins, text = matrix[samples[sample]], texts[samples[sample]]
+		# Values of the indexed transcripts, a sample seen before keeps its values
+		# of the transcripts that are missing from this file
+		if not tins or not missing:
+			tins[:len(values)] = values
+			for i in [i for i in text if i < len(values)]:
+				del text[i]
+		else:
+			skip = set(missing)
+			for i, tinvalue in enumerate(values):
+				if i not in skip:
+					tins[i] = tinvalue
+					text.pop(i, None)
+		text.update(tokens)
+		# Pad the array to the current number of transcripts
+		tins.extend(array(typecode, [float('nan')]) * (len(transcripts) - len(tins)))
+		for tid, tinvalue in extra:
+			i = index.get(tid)
+			if i is None:
+				i = index[tid] = len(transcripts)
+				transcripts.append(tid)
+				tins.append(float('nan'))
+			tins[i], tinvalue = token(tinvalue)
+			if tinvalue is not None:
+				text[i] = tinvalue
+			else:
+				text.pop(i, None)
+
+	return colid, transcripts, list(samples), matrix, texts
+
+
+def writer(outfile, samples, sidecar=False):
+	"""Returns a writer for the sidecar of the TIN matrix, see sidecar.py
+	@param outfile <str>: Path of the output TSV file
+	@param samples <list>: Sample names, one per column
+	@param sidecar <bool>: Write a binary sidecar alongside the TSV file
+	@return writer <sidecar.Writer|None>: None if a sidecar is not requested
+	"""
+	if not sidecar:
+		return None
+	from sidecar import Writer
+	return Writer(outfile, samples)
+
+
+def write(outfile, colid, transcripts, samples, matrix, texts, sidecar=False):
+	"""Writes the TIN matrix to a TSV file, one transcript at a time. TIN values are
+	written as they appear in the RSEQC output files, missing TIN values are written
+	as empty fields.
+	@param outfile <str>: Path of the output TSV file
+	@param colid <str>: Name of the key field used as the index label
+	@param transcripts <list>: Transcript ids, one per row
+	@param samples <list>: Sample names, one per column
+	@param matrix <list>: Array of TIN values for each sample
+	@param texts <list>: Original text of the TIN values for each sample, see build()
+	@param sidecar <bool>: Write a binary sidecar in the same pass
+	"""
+	binary = writer(outfile, samples, sidecar)
+	with open(outfile, 'w') as ofh:
+		ofh.write('\t'.join([colid] + samples) + '\n')
+		for i, tid in enumerate(transcripts):
+			tinvalues = [tins[i] if i < len(tins) else float('nan') for tins in matrix]
+			ofh.write('\t'.join([tid] + [text[i] if i in text else formatted(v) for v, text in zip(tinvalues, texts)]) + '\n')
+			if binary:
+				binary.write(tid, tinvalues)
+	if binary:
+		binary.close()
+
+
+def merge(files, outfile, key_index=0, parse_index=4, sidecar=False):
+	"""Streams RSEQC output files that share the same transcript order through a k-way merge,
+	writing each row of the TIN matrix as soon as it is read. Only one line per file is held
+	in memory. TIN values are written verbatim, like write().
+	@param files list[<str>]: Paths of RSEQC output files with TIN values
+	@param outfile <str>: Path of the output TSV file
+	@param key_index <int>: Index of the field to join multiple files
+	@param parse_index <int>: Index of field of interest (i.e. TIN value)
+	@param sidecar <bool>: Write a binary sidecar in the same pass
+	@return merged <bool>:
+		False if the files do not share the same transcripts in the same order or
+		the same sample name, in which case the output file is incomplete
+	"""
+	samples = [sample_name(file) for file in files]
+	if len(set(samples)) != len(samples):
+		return False
+
+	readers = [parsed(file, key_index, parse_index) for file in files]
+	binary = writer(outfile, samples, sidecar)
+	try:
+		with open(outfile, 'w') as ofh:
+			for i, lines in enumerate(zip_longest(*readers)):
+				if None in lines:
+					return False
+				tid = lines[-1][0]
+				if i == 0:
+					# Header of the last file is used as the index label
+					ofh.write('\t'.join([tid] + samples) + '\n')
+					continue
+				if any(line[0] != tid for line in lines):
+					return False
+				ofh.write('\t'.join([tid] + [line[1] for line in lines]) + '\n')
+				if binary:
+					binary.write(tid, [number(line[1]) for line in lines])
+	finally:
+		for reader in readers:
+			reader.close()
+		if binary:
+			binary.close()
+
+	return True
+
+
+# Transcript index of the worker processes, see columns()
+_worker = {}
+
+
+def _initialize(index, key_index, parse_index):
+	"""Private function to pass the transcript index to a worker process once."""
+	_worker.update(index=index, key_index=key_index, parse_index=parse_index)
+
+
+def _column(file):
+	"""Private function to parse a file in a worker process, see column()"""
+	return column(file, _worker['index'], _worker['key_index'], _worker['parse_index'])
+
+
+def columns(files, key_index=0, parse_index=4, threads=1):
+	"""Generator that parses RSEQC output files into columns of TIN values. The first file
+	is parsed in this process and its transcripts become the shared index of the other
+	files. With more than one thread, the other files are parsed concurrently by a pool of
+	worker processes that receive the index once and return only an array of values per
+	file. Columns are yielded in the order of the input files, with at most two columns
+	per worker in flight, so memory does not grow with the number of files.
+	@param files list[<str>]: Paths of RSEQC output files with TIN values
+	@param key_index <int>: Index of the field to join multiple files
+	@param parse_index <int>: Index of field of interest (i.e. TIN value)
+	@param threads <int>: Number of worker processes
+	@yield (colid, sample, values, texts, missing, extra), see column()
+	"""
+	if not files:
+		return
+	first = column(files[0], {}, key_index, parse_index)
+	index = {}
+	for tid, tinvalue in first[5]:
+		index.setdefault(tid, len(index))
+	yield first
+
+	if threads <= 1 or len(files) <= 2:
+		for file in files[1:]:
+			yield column(file, index, key_index, parse_index)
+		return
+
+	from collections import deque
+	from concurrent.futures import ProcessPoolExecutor
+	workers = min(threads, len(files) - 1)
+	with ProcessPoolExecutor(max_workers=workers, initializer=_initialize, initargs=(index, key_index, parse_index)) as pool:
+		pending = deque()
+		for file in files[1:]:
+			pending.append(pool.submit(_column, file))
+			if len(pending) >= 2 * workers:
+				yield pending.popleft().result()
+		while pending:
+			yield pending.popleft().result()
+
+
+def create(files, outfile, key_index=0, parse_index=4, threads=1, stream=True, sidecar=False):
+	"""Creates the combined TIN matrix of RSEQC output files. Files sharing the same
+	transcript order are streamed through merge(), otherwise each file is parsed
+	into an array and joined on a shared transcript index.
+	@param files list[<str>]: Paths of RSEQC output files with TIN values
+	@param outfile <str>: Path of the output TSV file
+	@param key_index <int>: Index of the field to join multiple files
+	@param parse_index <int>: Index of field of interest (i.e. TIN value)
+	@param threads <int>: Number of files to parse in parallel
+	@param stream <bool>: Try to stream files sharing the same transcript order first
+	@param sidecar <bool>: Write a binary sidecar alongside the TSV file, see sidecar.py
+	"""
+	if stream and merge(files, outfile, key_index, parse_index, sidecar):
+		return
+
+	colid, transcripts, samples, matrix, texts = build(columns(files, key_index, parse_index, threads))
+	write(outfile, colid, transcripts, samples, matrix, texts, sidecar)
 
 
 
 
 if __name__ == '__main__':
 
-	# Get filenames to parse
-	args = sys.argv
-	files = sys.argv[1:-1]
-	opath = sys.argv[-1]
+	from profiler import option, Profiler
+
+	# Get filenames to parse, without the opt-in --profile option (see profiler.py)
+	args, profile = option(sys.argv)
+	usage = "Usage:\n python {} [-t THREADS] [--sidecar] [--profile[=MODE]] *.tin.xls outdir".format(args[0])
+	if '-h' in args or '--help' in args:
+		print(usage)
+		sys.exit()
+	sidecar = '--sidecar' in args
+	args = [arg for arg in args if arg != '--sidecar']
+	threads = 1
+	for option in ['-t', '--threads']:
+		if option in args:
+			i = args.index(option)
+			try:
+				threads = int(args[i+1])
+			except (IndexError, ValueError):
+				sys.exit(usage)
+			args = args[:i] + args[i+2:]
+	files = args[1:-1]
+	opath = args[-1]
 
 	if not os.path.isdir(opath):
 		try:
@@ -50,13 +345,13 @@ if __name__ == '__main__':
 	# Check if at least two files were provided
 	if not len(args) >= 3:
 		print("FATAL: Failed to provide more than one input file!")
-		sys.exit("Usage:\n python {} *.tin.xls outdir".format(args[0]))
-
-	# Populate tins with TINS values for all transcripts across all samples
-	tins = {}
-	for file in files:
-		keycolname, tins = create(file, tins)
+		sys.exit(usage)
 
-	# Save tins as a tsv file: combined_TIN.tsv
-	df = pandas.DataFrame(tins)
-	df.to_csv(os.path.join(opath, "combined_TIN.tsv"), sep="\t", header=True, index=True, index_label = keycolname)
+	# Save TIN values for all transcripts across all samples as a tsv file: combined_TIN.tsv
+	if profile is None:
+		create(files, os.path.join(opath, "combined_TIN.tsv"), threads=threads, sidecar=sidecar)
+	else:
+		# Profiles are saved next to the TIN matrix, i.e. DME/profiles
+		with Profiler(os.path.join(opath, 'profiles'), profile, 'create_tin_matrix') as profiler:
+			with profiler.stage('create'):
+				create(files, os.path.join(opath, "combined_TIN.tsv"), threads=threads, sidecar=sidecar)
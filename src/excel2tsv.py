@@ -1,50 +1,219 @@
 from __future__ import print_function
-import pandas as pd
 import sys
 
 
 usage = '''\
 USAGE:
-    python xlsx_reader.py input.xlsx output_file_prefix [-h]
+    python xlsx_reader.py input.xlsx output_file_prefix [-s] [-t THREADS] [SHEET ...] [-h]
 Positional Arguments:
-    [1]       Type [File]: Input XLSX filename to convert to TSV. Note: XLSX files with multiple worksheets are separated into multiple TSV files. 
-    [2]       Type [String]: Prefix of output filename. Note: An additional suffix containing the worksheet name will also be appended.   
+    [1]       Type [File]: Input XLSX filename to convert to TSV. Note: XLSX files with multiple worksheets are separated into multiple TSV files.
+    [2]       Type [String]: Prefix of output filename. Note: An additional suffix containing the worksheet name will also be appended.
+    [3...N]   Type [String]: Optional names of worksheets to convert. Note: All worksheets are converted by default.
+Optional Arguments:
+    [-s, --stream]     Stream rows from a read-only workbook and write each TSV file incrementally.
+                       Memory usage is bounded regardless of the size of the workbook.
+    [-t, --threads]    Number of worksheets to convert in parallel when streaming [default: 1].
 Example: Note 'huPlasma_36-plex.xlsx' contains two worksheets: Results and QC
     $ python xlsx_reader.py huPlasma_36-plex.xlsx test
-    
+
     # Returns TSV file for each worksheet
     > test_Results.txt
     > test_QC.txt
+
+    # Streams the Results worksheet only
+    $ python xlsx_reader.py huPlasma_36-plex.xlsx test --stream Results
+    > test_Results.txt
 Requirements:
    pandas
+   openpyxl (--stream only)
 '''
 
 
-def write(inputfile, outprefix):
+# Strings pandas.read_excel() reads as missing values by default
+na_values = {
+        '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND',
+        '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+}
+
+
+def outfilename(outprefix, sheet):
+        '''Returns the name of the output TSV file for a worksheet.'''
+        return "{}_{}.txt".format(outprefix, sheet.replace(' ','-'))
+
+
+def write(inputfile, outprefix, sheets=None):
         '''Takes input XLSX filename and output file prefix to create multiple TSV files for each worksheet in the XSLX file.'''
-        sheet2df = pd.read_excel(inputfile, sheet_name=None, header=None)
+        import pandas as pd
+        sheet2df = pd.read_excel(inputfile, sheet_name=sheets, header=None)
 
         print('Found Worksheets:')
         for sheet, data in sheet2df.items():
                 print(" - {}".format(sheet))
                 outfile =  sheet2df[sheet]
-                outfile.to_csv("{}_{}.txt".format(outprefix, sheet.replace(' ','-')),sep='\t',encoding='utf-8', header=None, index=False)
+                outfile.to_csv(outfilename(outprefix, sheet),sep='\t',encoding='utf-8', header=None, index=False)
+
+
+def _value(cell):
+        '''Private function to format a cell value like pandas.read_excel(). Empty cells and missing
+        values become empty strings and whole number floats are converted to integers.'''
+        if cell is None or (isinstance(cell, str) and cell in na_values):
+                return ''
+        elif isinstance(cell, float) and cell.is_integer():
+                return int(cell)
+        return cell
+
+
+def _kind(value):
+        '''Private function to get the kind of a formatted cell value, see _dtype().'''
+        from datetime import datetime
+
+        if isinstance(value, bool):
+                return 'bool'
+        elif isinstance(value, int):
+                return 'int'
+        elif isinstance(value, float):
+                return 'float'
+        elif isinstance(value, datetime):
+                return 'date' if value == datetime(value.year, value.month, value.day) else 'datetime'
+        return 'object'
+
+
+def _dtype(kinds, blank):
+        '''Private function to get the dtype pandas.read_excel() infers for a column from the kinds of
+        its values (see _kind()) and whether it has any empty cells. Numbers and booleans with an empty
+        cell or a float are float64, numbers and booleans are int64, and dates are datetime64.'''
+        if kinds <= {'int', 'float', 'bool'}:
+                if kinds == {'bool'} and not blank:
+                        return 'bool'
+                elif 'float' in kinds or blank:
+                        return 'float'
+                return 'int'
+        elif kinds <= {'date', 'datetime'}:
+                return 'datetime' if 'datetime' in kinds else 'date'
+        return 'object'
+
+
+def _text(value, dtype):
+        '''Private function to format a cell value like DataFrame.to_csv() for the dtype of its column.'''
+        if value == '' or dtype in ['object', 'bool']:
+                return value
+        elif dtype == 'float':
+                return repr(float(value))
+        elif dtype == 'int':
+                return int(value)
+        elif dtype == 'date':
+                return value.strftime('%Y-%m-%d')
+        return str(value)
+
+
+def _dimensions(worksheet):
+        '''Private function to find the number of rows and columns containing data in a worksheet,
+        and the dtype of each column (see _dtype()). Trailing empty rows and columns are ignored, just
+        like pandas.read_excel(). The worksheet is streamed row by row, so only a single row and the
+        kinds of values of each column are held in memory.'''
+        nrows, ncols = 0, 0
+        kinds, filled = [], []
+        for i, row in enumerate(worksheet.iter_rows(values_only=True)):
+                values = [_value(cell) for cell in row]
+                columns = [j for j, value in enumerate(values) if value != '']
+                if columns:
+                        nrows = i + 1
+                        ncols = max(ncols, columns[-1] + 1)
+                        for j in range(len(kinds), ncols):
+                                kinds.append(set())
+                                filled.append(0)
+                        for j in columns:
+                                kinds[j].add(_kind(values[j]))
+                                filled[j] += 1
+        # Cells of a column are only counted in the rows containing data,
+        # so a column with fewer values than rows has an empty cell
+        dtypes = [_dtype(kinds[j], filled[j] < nrows) for j in range(ncols)]
+        return nrows, ncols, dtypes
+
+
+def stream_sheet(inputfile, outprefix, sheet):
+        '''Streams the rows of a worksheet from a read-only workbook and writes them to a TSV file
+        incrementally. Each column is written with the dtype pandas.read_excel() infers for it, see
+        _dtype(), so the output matches write() unless pandas converts text cells (i.e. numbers or
+        booleans stored as text). Returns the name of the output file.'''
+        import csv
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(inputfile, read_only=True, data_only=True)
+        worksheet = workbook[sheet]
+        nrows, ncols, dtypes = _dimensions(worksheet)
+
+        with open(outfilename(outprefix, sheet), 'w', newline='', encoding='utf-8') as fh:
+                writer = csv.writer(fh, delimiter='\t', lineterminator='\n')
+                for row in worksheet.iter_rows(max_row=nrows, max_col=ncols, values_only=True):
+                        # Pad short rows with empty cells
+                        row = [_value(cell) for cell in row] + [''] * (ncols - len(row))
+                        writer.writerow([_text(value, dtype) for value, dtype in zip(row, dtypes)])
+
+        workbook.close()
+        return outfilename(outprefix, sheet)
+
+
+def stream(inputfile, outprefix, sheets=None, threads=1):
+        '''Takes input XLSX filename and output file prefix to create a TSV file for each selected
+        worksheet in the XLSX file. Rows are streamed from a read-only workbook, and worksheets are
+        converted in parallel by a pool of worker processes.'''
+        from openpyxl import load_workbook
+        from concurrent.futures import ProcessPoolExecutor
+
+        workbook = load_workbook(inputfile, read_only=True)
+        found = workbook.sheetnames
+        workbook.close()
+
+        if sheets is None:
+                sheets = found
+        missing = [sheet for sheet in sheets if sheet not in found]
+        if missing:
+                print("Error: Failed to find worksheet(s) {} in {}".format(missing, inputfile), file=sys.stderr)
+                sys.exit(1)
+
+        print('Found Worksheets:')
+        with ProcessPoolExecutor(max_workers=max(1, min(threads, len(sheets)))) as pool:
+                jobs = [pool.submit(stream_sheet, inputfile, outprefix, sheet) for sheet in sheets]
+                for sheet, job in zip(sheets, jobs):
+                        job.result()
+                        print(" - {}".format(sheet))
 
 
 def main():
 
         # Parse args
-        if '-h' in sys.argv or '--help' in sys.argv:
+        args = sys.argv[1:]
+        if '-h' in args or '--help' in args:
                 print(usage)
                 sys.exit()
-        try:    
-                filename = sys.argv[1]  # Input xlsx file
-                ofn = sys.argv[2]       # Output filename prefix 
+
+        streaming = '-s' in args or '--stream' in args
+        args = [arg for arg in args if arg not in ['-s', '--stream']]
+
+        threads = 1
+        for option in ['-t', '--threads']:
+                if option in args:
+                        i = args.index(option)
+                        try:
+                                threads = int(args[i+1])
+                        except (IndexError, ValueError):
+                                print(usage)
+                                sys.exit(1)
+                        args = args[:i] + args[i+2:]
+
+        try:
+                filename = args[0]  # Input xlsx file
+                ofn = args[1]       # Output filename prefix
         except IndexError:
                 print(usage)
                 sys.exit()
+        sheets = args[2:] or None   # Optional list of worksheets
 
-        write(filename, ofn)
+        if streaming:
+                stream(filename, ofn, sheets, threads)
+        else:
+                write(filename, ofn, sheets)
 
 if __name__ == '__main__':
         main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""fscache: per-run cache of filesystem metadata
+About:
+      This module keeps the filesystem metadata looked up during a run, so the same
+    path is not stat'ed, resolved or checked for permissions more than once. On a
+    parallel filesystem (i.e. GPFS) each of these calls is a request to a metadata
+    server, and a loaded server turns thousands of repeated calls into minutes.
+        1. scandir(): lists a directory with one batch of requests. The type of each
+           entry comes with the listing, so later existence and type checks of its
+           entries (exists, isdir, isfile) do not stat them again.
+        2. exists(), isdir(), isfile(): stat a path once. Only paths that exist are
+           cached, a missing path is checked again on the next call.
+        3. realpath(): resolves a path once, instead of an lstat per component.
+        4. access(): checks the permissions of a path once.
+      The cache is kept for the lifetime of a process. It assumes files are not
+    moved or deleted by other processes during a run. Paths created by the run
+    itself must be invalidated, see invalidate(). Counters of the calls and the
+    syscalls they saved are reported by report(). With PYRKIT_FSCACHE_STATS=1 in
+    the environment, the counters are printed to standard error on exit.
+USAGE:
+	$ python fscache.py [PATH ...]
+Example:
+    $ python fscache.py DME/upload/
+"""
+
+from __future__ import print_function
+import sys, os
+
+
+# Types of the cached paths: [path] = 'dir', 'file' or 'other'
+_types = {}
+
+# Listings of scanned directories: [directory] = [(name, path, type), ...]
+_listings = {}
+
+# Resolved paths: [path] = resolved path
+_realpaths = {}
+
+# Permissions: [(path, mode)] = bool
+_access = {}
+
+# Number of calls and number of syscalls made by the cache, the difference of
+# the two is the number of syscalls saved. Resolving a path costs one lstat per
+# component of the path.
+counters = {'calls': 0, 'syscalls': 0}
+
+
+def _type(mode):
+    """Private function to convert an st_mode into the type of a path."""
+    import stat
+
+    if stat.S_ISDIR(mode):
+        return 'dir'
+    elif stat.S_ISREG(mode):
+        return 'file'
+
+    return 'other'
+
+
+def _stat(path, cost = 1):
+    """Private function to get the type of a path, the path is stat'ed on a cache miss.
+    @return type <str>:
+        Type of the path ('dir', 'file' or 'other') or None if it does not exist
+    """
+    path = os.path.abspath(path)
+    counters['calls'] += cost
+    if path in _types:
+        return _types[path]
+    counters['syscalls'] += 1
+    try:
+        ptype = _type(os.stat(path).st_mode)
+    except (IOError, OSError, ValueError):
+        return None
+    _types[path] = ptype
+
+    return ptype
+
+
+def scandir(directory):
+    """Lists the entries of a directory with one batch of requests (os.scandir). The
+    type of each entry is cached, symlinks are followed to get the type of their target.
+    @param directory <str>:
+        Directory on the local filesystem
+    @return entries list[<tuple(<str>, <str>, <str>)>]:
+        Sorted (name, path, type) of each entry
+    """
+    directory = os.path.abspath(directory)
+    counters['calls'] += 1
+    if directory in _listings:
+        return _listings[directory]
+
+    entries = []
+    counters['syscalls'] += 1
+    for entry in os.scandir(directory):
+        path = os.path.join(directory, entry.name)
+        if entry.is_symlink():
+            # Type of a symlink's target needs a stat
+            counters['syscalls'] += 1
+            try:
+                ptype = _type(os.stat(path).st_mode)
+            except OSError:
+                # Broken symlink
+                continue
+        else:
+            ptype = 'dir' if entry.is_dir() else 'file' if entry.is_file() else 'other'
+        _types[path] = ptype
+        entries.append((entry.name, path, ptype))
+    entries.sort()
+    _listings[directory] = entries
+    _types[directory] = 'dir'
+
+    return entries
+
+
+def listdir(directory):
+    """Lists the names of the entries of a directory, see scandir()."""
+    return [name for name, path, ptype in scandir(directory)]
+
+
+def exists(path):
+    """Checks if a path exists, symlinks are followed like os.path.exists()."""
+    return _stat(path) is not None
+
+
+def isdir(path):
+    """Checks if a path is a directory, symlinks are followed like os.path.isdir()."""
+    return _stat(path) == 'dir'
+
+
+def isfile(path):
+    """Checks if a path is a regular file, symlinks are followed like os.path.isfile()."""
+    return _stat(path) == 'file'
+
+
+def realpath(path):
+    """Resolves the symlinks of a path once, like os.path.realpath().
+    @param path <str>:
+        Path on the local filesystem
+    @return resolved <str>:
+        Canonical path of the path
+    """
+    path = os.path.abspath(path)
+    cost = max(1, path.count(os.sep))
+    counters['calls'] += cost
+    if path not in _realpaths:
+        counters['syscalls'] += cost
+        _realpaths[path] = os.path.realpath(path)
+
+    return _realpaths[path]
+
+
+def access(path, mode = os.R_OK):
+    """Checks the permissions of a path once, like os.access().
+    @param path <str>:
+        Path on the local filesystem
+    @param mode <int>:
+        os.F_OK, os.R_OK, os.W_OK and/or os.X_OK
+    @return allowed <bool>:
+        True if the path can be accessed with the given mode
+    """
+    key = (os.path.abspath(path), mode)
+    counters['calls'] += 1
+    if key not in _access:
+        counters['syscalls'] += 1
+        _access[key] = os.access(path, mode)
+
+    return _access[key]
+
+
+def invalidate(path = None):
+    """Drops the cached metadata of a path and the listing of its parent directory,
+    i.e. after the path is created, replaced or removed by the run. Paths under a
+    directory are dropped along with it. Everything is dropped if no path is given.
+    @param path <str>:
+        Path on the local filesystem
+    """
+    if path is None:
+        for cache in [_types, _listings, _realpaths, _access]:
+            cache.clear()
+        return
+
+    path = os.path.abspath(path)
+    prefix = path.rstrip(os.sep) + os.sep
+    _listings.pop(os.path.dirname(path), None)
+    for cache in [_types, _listings, _realpaths]:
+        for key in [k for k in cache if k == path or k.startswith(prefix)]:
+            del cache[key]
+    for key in [k for k in _access if k[0] == path or k[0].startswith(prefix)]:
+        del _access[key]
+
+
+def report():
+    """Reports the counters of the cache.
+    @return counters <dict>:
+        Number of calls, syscalls made and syscalls saved
+    """
+    return {'calls': counters['calls'], 'syscalls': counters['syscalls'],
+        'saved': counters['calls'] - counters['syscalls']}
+
+
+def _print_report():
+    """Private function to print the counters of the cache to standard error."""
+    if counters['calls']:
+        print('fscache: {calls} call(s), {syscalls} syscall(s), {saved} syscall(s) saved'.format(**report()), file=sys.stderr)
+
+
+if os.environ.get('PYRKIT_FSCACHE_STATS'):
+    import atexit
+    atexit.register(_print_report)
+
+
+def main():
+
+    # Parse args
+    args = sys.argv[1:]
+    if '-h' in args or '--help' in args:
+        print(__doc__)
+        sys.exit()
+
+    # Walks each directory twice, the second walk is served by the cache
+    for i in range(2):
+        for top in args or ['.']:
+            directories = [top]
+            while directories:
+                directory = directories.pop()
+                for name, path, ptype in scandir(directory):
+                    exists(path), realpath(path)
+                    if ptype == 'dir':
+                        directories.append(path)
+    print('{calls} call(s), {syscalls} syscall(s), {saved} syscall(s) saved'.format(**report()))
+
+
+if __name__ == '__main__':
+    main()
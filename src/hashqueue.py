@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""hashqueue: distributed MD5 checksums through a work queue on a shared filesystem
+About:
+      This program spreads the hashing of many large files across any number of
+    worker processes on any number of nodes (i.e. the tasks of a SLURM job array).
+    A coordinator writes a work queue of files to a shared filesystem. Each worker
+    claims an item of the queue by atomically renaming it from todo/ to claimed/,
+    hashes its files and writes the results to done/. Once the queue is drained,
+    the results are merged into a checksum manifest in md5sum format, which is read
+    by 'meta sample --checksums' and 'meta combined --checksums'.
+      The queue is crash-safe. A queue is published with a rename once it is
+    complete, and results are written to a temporary file and renamed into place.
+    Workers touch their claims while they hash, and a claim that is not touched
+    within the timeout (default: 300 seconds) is put back into todo/ by any other
+    worker. Workers keep polling until no live claims are left, so the queue is
+    drained as long as one worker survives. A file that changes while it is hashed,
+    or that cannot be read, is reported in failed/ instead of done/.
+      Each item holds up to 1000 files or 4 GB of data, larger files are an item of
+    their own. Items are ordered largest first to shorten the tail of a run. Use
+    'run' to start local worker processes, or with '--slurm' a job array of workers.
+USAGE:
+	$ python hashqueue.py create [-b ITEM_BYTES] [-n ITEM_FILES] QUEUE FILE [FILE ...]
+	$ python hashqueue.py work [-t TIMEOUT] QUEUE
+	$ python hashqueue.py run [-w WORKERS] [-t TIMEOUT] [--slurm] QUEUE
+	$ python hashqueue.py merge [-m MANIFEST] QUEUE
+	$ python hashqueue.py status QUEUE
+Example:
+    $ find /data/ccbr123/ -name '*.bam' | python hashqueue.py create DME/hashqueue -
+    $ sbatch --array=1-16 --cpus-per-task=2 --wrap 'python hashqueue.py work DME/hashqueue'
+    $ python hashqueue.py run -w 4 DME/hashqueue
+    $ python hashqueue.py merge -m DME/checksums.md5 DME/hashqueue
+"""
+
+from __future__ import print_function
+import sys, os, time
+
+
+# Maximum number of bytes and files of each item of the queue
+item_bytes = 4 * (1 << 30)
+item_files = 1000
+
+# Seconds after which a claim that is not touched is stale
+timeout = 300
+
+# Folders of the queue, each item is moved from todo/ to claimed/ to done/
+folders = ['todo', 'claimed', 'done', 'failed']
+
+
+def md5sum(filename, blocksize = 1 << 20):
+    """Gets md5checksum of a file in memory-safe manner. Large blocks are read
+    to reduce the number of requests to a parallel filesystem.
+    @param filename <str>:
+        Input file on local filesystem to find md5 checksum
+    @param blocksize <int>:
+        Blocksize of reading N chunks of data to reduce memory profile
+    @return hasher.hexdigest() <str>:
+        MD5 checksum of the file's contents
+    """
+    import hashlib
+
+    hasher = hashlib.md5()
+    with open(filename, 'rb') as fh:
+        buf = fh.read(blocksize)
+        while len(buf) > 0:
+            hasher.update(buf)
+            buf = fh.read(blocksize)
+
+    return hasher.hexdigest()
+
+
+def _write(filename, lines):
+    """Private function to write a file atomically. Lines are written to a temporary
+    file in the same directory, flushed to disk and renamed into place."""
+    import socket
+
+    tmp = '{}.{}.{}.tmp'.format(filename, socket.gethostname(), os.getpid())
+    with open(tmp, 'w') as fh:
+        fh.writelines(lines)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.rename(tmp, filename)
+
+
+def _items(queue):
+    """Private function to list the names of all items of a queue."""
+    with open(os.path.join(queue, 'items.txt')) as fh:
+        return [line.rstrip('\n') for line in fh if line.strip()]
+
+
+def create(queue, files, max_bytes = item_bytes, max_files = item_files):
+    """Creates a work queue of files to hash. The queue is written to a temporary
+    directory and renamed into place, so workers never see a partial queue. If the
+    queue already exists for the same files, it is kept and finished items are not
+    hashed again, otherwise it is replaced.
+    @param queue <str>:
+        Queue directory on a filesystem shared by all workers
+    @param files list[<str>]:
+        Files to hash, each file is listed once by its resolved path
+    @param max_bytes, max_files <int>:
+        Maximum number of bytes and files of each item
+    @return items <int>:
+        Number of items in the queue
+    """
+    from shutil import rmtree
+    import hashlib, socket
+
+    files = sorted(set(os.path.realpath(f) for f in files))
+    digest = hashlib.md5('\n'.join(files).encode('utf-8')).hexdigest()
+    try:
+        with open(os.path.join(queue, 'digest')) as fh:
+            if fh.read().strip() == digest:
+                # Resume a queue of the same files
+                return len(_items(queue))
+    except (IOError, OSError):
+        pass
+
+    # Largest files first, files larger than an item are an item of their own
+    sizes = sorted(((os.path.getsize(f), f) for f in files), key = lambda sf: (-sf[0], sf[1]))
+    chunks, chunk, nbytes = [], [], 0
+    for size, f in sizes:
+        if chunk and (nbytes + size > max_bytes or len(chunk) >= max_files):
+            chunks.append(chunk)
+            chunk, nbytes = [], 0
+        chunk.append((size, f))
+        nbytes += size
+    if chunk:
+        chunks.append(chunk)
+
+    tmp = '{}.{}.{}.tmp'.format(queue.rstrip('/'), socket.gethostname(), os.getpid())
+    for folder in folders:
+        os.makedirs(os.path.join(tmp, folder))
+    names = ['{:08d}'.format(i) for i in range(len(chunks))]
+    for name, chunk in zip(names, chunks):
+        with open(os.path.join(tmp, 'todo', name), 'w') as fh:
+            fh.writelines('{}\t{}\n'.format(size, f) for size, f in chunk)
+    with open(os.path.join(tmp, 'items.txt'), 'w') as fh:
+        fh.writelines(name + '\n' for name in names)
+    with open(os.path.join(tmp, 'digest'), 'w') as fh:
+        fh.write(digest + '\n')
+
+    if os.path.exists(queue):
+        rmtree(queue)
+    os.rename(tmp, queue)
+
+    return len(chunks)
+
+
+def claim(queue):
+    """Claims the next item of a queue by renaming it into claimed/. The rename is
+    atomic, when two workers claim the same item only one of them succeeds.
+    @return claimed <str>:
+        Path of the claimed item or None if there is nothing left to claim
+    """
+    import socket
+
+    todo = os.path.join(queue, 'todo')
+    owner = '{}.{}'.format(socket.gethostname().split('.')[0], os.getpid())
+    for name in sorted(os.listdir(todo)):
+        claimed = os.path.join(queue, 'claimed', '{}.{}'.format(name, owner))
+        try:
+            os.rename(os.path.join(todo, name), claimed)
+        except OSError:
+            # Claimed by another worker
+            continue
+        if os.path.exists(os.path.join(queue, 'done', name)):
+            # Finished by a worker whose claim was stale
+            _remove(claimed)
+            continue
+        return claimed
+
+    return None
+
+
+def _remove(filename):
+    """Private function to remove a file that may already be gone."""
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+
+def requeue(queue, stale = timeout):
+    """Puts stale claims back into todo/, i.e. the claims of a worker that crashed.
+    @param stale <float>:
+        Seconds after which a claim that is not touched is stale
+    @return live, requeued <tuple(<int>, <int>)>:
+        Number of live claims and number of claims put back into todo/
+    """
+    live, requeued = 0, 0
+    claimed = os.path.join(queue, 'claimed')
+    for entry in os.listdir(claimed):
+        path = os.path.join(claimed, entry)
+        name = entry.split('.')[0]
+        try:
+            if time.time() - os.stat(path).st_mtime < stale:
+                live += 1
+                continue
+            if os.path.exists(os.path.join(queue, 'done', name)):
+                _remove(path)
+                continue
+            os.rename(path, os.path.join(queue, 'todo', name))
+            requeued += 1
+        except OSError:
+            # Finished or requeued by another worker
+            continue
+
+    return live, requeued
+
+
+def process(queue, claimed, stale = timeout):
+    """Hashes the files of a claimed item and saves the results into done/ as lines
+    of 'md5, size, mtime, path' and any failures into failed/. The claim is touched
+    while the files are hashed, so it does not become stale.
+    @param claimed <str>:
+        Path of the claimed item, see claim()
+    @return nbytes <int>:
+        Number of bytes hashed
+    """
+    import threading
+
+    name = os.path.basename(claimed).split('.')[0]
+    stop = threading.Event()
+    def heartbeat():
+        while not stop.wait(stale / 4.0):
+            try:
+                os.utime(claimed, None)
+            except OSError:
+                return
+    thread = threading.Thread(target = heartbeat, daemon = True)
+    thread.start()
+
+    results, failures, nbytes = [], [], 0
+    try:
+        with open(claimed) as fh:
+            files = [line.rstrip('\n').split('\t', 1)[1] for line in fh if line.strip()]
+    except (IOError, OSError):
+        # Claim was put back into todo/ by another worker
+        files = None
+    try:
+        for f in files or []:
+            try:
+                before = os.stat(f)
+                md5 = md5sum(f)
+                after = os.stat(f)
+                if (before.st_size, before.st_mtime_ns) != (after.st_size, after.st_mtime_ns):
+                    raise OSError('File changed while it was hashed')
+            except (IOError, OSError) as e:
+                failures.append('{}\t{}\n'.format(f, e))
+                continue
+            results.append('{}\t{}\t{}\t{}\n'.format(md5, after.st_size, after.st_mtime_ns, f))
+            nbytes += after.st_size
+    finally:
+        stop.set()
+        thread.join()
+
+    if files is None:
+        return 0
+
+    # Failures are saved first, an item is finished once it is in done/
+    if failures:
+        _write(os.path.join(queue, 'failed', name), failures)
+    _write(os.path.join(queue, 'done', name), results)
+    _remove(claimed)
+
+    return nbytes
+
+
+def work(queue, stale = timeout, poll = 1.0):
+    """Claims and hashes items until the queue is drained. A worker keeps polling while
+    other workers have live claims, and puts their claims back if they become stale.
+    @param queue <str>:
+        Queue directory, see create()
+    @param stale <float>:
+        Seconds after which a claim that is not touched is stale
+    @param poll <float>:
+        Seconds between checks for stale claims
+    @return items, nbytes <tuple(<int>, <int>)>:
+        Number of items and bytes hashed by this worker
+    """
+    items, nbytes = 0, 0
+    while True:
+        claimed = claim(queue)
+        if claimed:
+            nbytes += process(queue, claimed, stale)
+            items += 1
+            continue
+        live, requeued = requeue(queue, stale)
+        if not live and not requeued:
+            break
+        if not requeued:
+            time.sleep(poll)
+
+    return items, nbytes
+
+
+def spawn(queue, workers = 4, slurm = False, stale = timeout):
+    """Starts a pool of workers and waits for them to finish. Workers are started as
+    local processes or as the tasks of a SLURM job array (sbatch --wait). Items left
+    by workers that failed are hashed by this process, so the queue is always drained.
+    @param queue <str>:
+        Queue directory, see create()
+    @param workers <int>:
+        Number of workers
+    @param slurm <bool>:
+        Submit the workers as a SLURM job array instead of local processes
+    @param stale <float>:
+        Seconds after which a claim that is not touched is stale
+    @return exitcodes list[<int>]:
+        Exit code of each local worker, or of sbatch
+    """
+    import subprocess
+
+    command = [sys.executable, os.path.abspath(__file__), 'work', '-t', str(stale), os.path.abspath(queue)]
+    if slurm:
+        exitcodes = [subprocess.call(['sbatch', '--wait', '-J', 'pyrkit_hash', '--array=1-{}'.format(workers),
+            '--cpus-per-task=2', '--mem=4g', '--time=24:00:00', '-o', os.path.join(os.path.abspath(queue), 'worker_%a.log'),
+            '--wrap', ' '.join('"{}"'.format(arg) for arg in command)])]
+    else:
+        processes = [subprocess.Popen(command) for i in range(workers)]
+        exitcodes = [process.wait() for process in processes]
+
+    # All workers have exited, any claim left behind is stale
+    requeue(queue, stale = 0)
+    work(queue, stale)
+
+    return exitcodes
+
+
+def merge(queue, manifest = None, mode = 'a'):
+    """Merges the results of a drained queue and optionally saves them as a checksum
+    manifest in md5sum format (see meta --checksums).
+    @param queue <str>:
+        Queue directory, see create()
+    @param manifest <str>:
+        Output checksum manifest
+    @param mode <str>:
+        Append to ('a') or overwrite ('w') the manifest
+    @return checksums, failures <tuple(<dict>, <dict>)>:
+        [path] = (md5, size, mtime) of each hashed file, and [path] = error
+        of each file that failed
+    @raises OSError if an item of the queue is not finished
+    """
+    done = os.path.join(queue, 'done')
+    missing = [name for name in _items(queue) if not os.path.exists(os.path.join(done, name))]
+    if missing:
+        raise OSError('{} item(s) of {} are not finished: {}'.format(len(missing), queue, ', '.join(missing[:10])))
+
+    checksums, failures = {}, {}
+    for name in _items(queue):
+        with open(os.path.join(done, name)) as fh:
+            for line in fh:
+                md5, size, mtime, path = line.rstrip('\n').split('\t', 3)
+                checksums[path] = (md5, int(size), int(mtime))
+        if os.path.exists(os.path.join(queue, 'failed', name)):
+            with open(os.path.join(queue, 'failed', name)) as fh:
+                for line in fh:
+                    path, error = line.rstrip('\n').split('\t', 1)
+                    failures[path] = error
+    if manifest:
+        with open(manifest, mode) as fh:
+            fh.writelines('{}  {}\n'.format(md5, path) for path, (md5, size, mtime) in sorted(checksums.items()))
+
+    return checksums, failures
+
+
+def status(queue):
+    """Counts the items in each folder of a queue.
+    @return counts <dict>:
+        [folder] = number of items
+    """
+    return {folder: len([f for f in os.listdir(os.path.join(queue, folder)) if not f.endswith('.tmp')]) for folder in folders}
+
+
+def main():
+
+    # Parse args
+    args = sys.argv[1:]
+    if not args or '-h' in args or '--help' in args or args[0] not in ['create', 'work', 'run', 'merge', 'status']:
+        print(__doc__)
+        sys.exit(0 if args else 1)
+    command, args = args[0], args[1:]
+
+    slurm = '--slurm' in args
+    args = [arg for arg in args if arg != '--slurm']
+    options = {'item_bytes': item_bytes, 'item_files': item_files, 'timeout': timeout, 'workers': 4, 'manifest': None}
+    for option, name, cast in [('-b', 'item_bytes', int), ('-n', 'item_files', int), ('-t', 'timeout', float),
+            ('-w', 'workers', int), ('-m', 'manifest', str)]:
+        for flag in [option, '--' + name.replace('_', '-')]:
+            if flag in args:
+                i = args.index(flag)
+                try:
+                    options[name] = cast(args[i+1])
+                except (IndexError, ValueError):
+                    print(__doc__)
+                    sys.exit(1)
+                args = args[:i] + args[i+2:]
+    if not args or (command != 'create' and len(args) != 1):
+        print(__doc__)
+        sys.exit(1)
+    queue = args[0]
+
+    if command == 'create':
+        files = args[1:]
+        if files == ['-']:
+            files = [line.rstrip('\n') for line in sys.stdin if line.strip()]
+        items = create(queue, files, options['item_bytes'], options['item_files'])
+        print('Created {} item(s) of {} file(s) in {}'.format(items, len(set(files)), queue))
+    elif command == 'work':
+        import socket
+        items, nbytes = work(queue, options['timeout'])
+        print('Hashed {} item(s) ({} bytes) on {}'.format(items, nbytes, socket.gethostname()))
+    elif command == 'run':
+        spawn(queue, options['workers'], slurm, options['timeout'])
+    elif command == 'merge':
+        try:
+            checksums, failures = merge(queue, options['manifest'])
+        except (IOError, OSError) as e:
+            print('Error: {}'.format(e), file=sys.stderr)
+            sys.exit(1)
+        for path, error in sorted(failures.items()):
+            print('Error: Failed to hash {}: {}'.format(path, error), file=sys.stderr)
+        print('Merged {} checksum(s) from {}'.format(len(checksums), queue))
+        if failures:
+            sys.exit(1)
+    else:
+        for folder, count in sorted(status(queue).items()):
+            print('{}\t{}'.format(folder, count))
+
+
+if __name__ == '__main__':
+    main()
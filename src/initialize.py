@@ -2,8 +2,9 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import print_function, division
-from datetime import datetime
-import sys, os, json, re
+from functools import partial
+import sys, os, json, re, hashlib
+import fscache
 
 __author__ = 'Skyler Kuhn'
 
@@ -12,16 +13,19 @@ config = {
     ".warning": ["\033[93m", "\033[00m"], ".error": ["\033[91m", "\033[00m"],
     ".required": ["data_dictionary.json", "project.json", "sample.json"],
     ".vaults": ["CCBR_Archive", "CCBR_EXT_Archive", "CCR_DTB_Archive"],
+    ".threads": 8,
     "data_dictionary": {
         "input": "data_dictionary.json",
     },
     "project_template": {
         "input": "project.json",
+        "sample_key": ["method", "Type of Project"],
         "singularity_required": ["project_title", "project_description",
                                   "project_start_date", "contact_name","poc_email"],
     },
     "sample_template": {
         "input": "sample.json",
+        "project_key": ["sequencing_application_type", "Application Type"],
     }
 }
 
@@ -39,6 +43,9 @@ for DME collection initialization. User must provide the output directory of 'li
 a path for newly generated ouput files, and select from one of the following DME vaults
 to initalize or update a project: 'CCBR_EXT_Archive', 'CCBR_Archive'.
 
+    A Project collection is created for each sub-project in the project request. Samples
+are added to the sub-project whose 'Type of Project' matches their 'Application Type'.
+
     'CCBR_EXT_Archive' is for storing/archiving data from public repositories like GEO,
 SRA, dbGap, EBI. 'CCBR_Archive' is for storing/archiving from external vendors like
 Novogene, ACGT, Macrogen, Genentech, GeneDx, CCR Genomics Core, NISC, SCAF, or COMPASS.
@@ -68,6 +75,10 @@ Options:
 
     [-h, --help]                  Displays usage and help information for the script.
 
+    [--profile[=MODE]]            Profile the run with cProfile (default) or sampled
+                                  stacks (--profile=sample) into lint_output_directory/profiles,
+                                  see profiler.py.
+
     [-p, --project-id]            Type [String]: Optional Project ID. This could be a
                                   ccbr project id if it has been assigned a project or
                                   a NAS request id.
@@ -165,10 +176,11 @@ def path_exists(path):
     """
     cstart, cend = config['.warning']
 
-    if not os.path.isdir(path):
+    if not fscache.isdir(path):
         print("{}WARNING:{} Output directory '{}' does not exist... creating it now!".format(cstart, cend, path), file=sys.stderr)
         try:
             os.makedirs(path)
+            fscache.invalidate(path)
         except OSError as e:
             cstart, cend = config['.error']
             print("{}Error:{} Failed to create {}... PATH not accessible!\n{}".format(cstart, cend, path, e), file=sys.stderr)
@@ -177,10 +189,12 @@ def path_exists(path):
 
 
 def file_exists(filename):
-    """Checks to see if file exists or is accessible.
-    Avoids problem with inconsistencies across python2.7 and >= python3.4 and
-    works in both major versions of python"""
+    """Checks to see if file exists or is accessible. Existence and permissions
+    are checked once per run, see fscache.py"""
+    if fscache.isfile(filename) and fscache.access(filename, os.R_OK):
+        return
     try:
+        # Opened only to report why the file is not accessible
         fh = open(filename)
         fh.close()
     # File cannot be opened for reading (may not exist) or permissions problem
@@ -237,30 +251,49 @@ def field2DME(data, data_catelog):
     return converted
 
 
-def mqc2dict(file, ignore=[0,-1]):
-    """Reads in MultiQC TSV file into memory as a dictionary while ignore specific indices.
-    Checks to see if file exists or is accessible before reading in the file.
-    where dict[sample] = [{attr: value}, {}, ...]
+def mqc2matrix(file, ignore=[0,-1]):
+    """Reads in MultiQC TSV file into memory as a compact matrix while ignoring specific
+    indices. Checks to see if file exists or is accessible before reading in the file.
+    Each line is stored as-is and indexed by sample name, metadata entries for a sample
+    are only generated when needed, see mqc_entries(). Returns a tuple of the parsed
+    attributes, the indices of their columns, and a dict where dict[sample] = [line, ...]
     """
     file_exists(file)
-    metadata = {}
 
     with open(file, 'r') as f:
-        header = next(f).split('\t')
-        # Ignore First and Last Fields
-        for i in ignore: header.pop(i)
-        for line in f:
-            linelist = line.split('\t')
-            sample = linelist[0]
+        return lines2matrix(f, ignore)
 
-            # Ignore First and Last Fields
-            for i in ignore: linelist.pop(i)
-            if sample not in metadata:
-                metadata[sample] = []
-            for i in range(len(linelist)):
-                 metadata[sample].append({"attribute": header[i], "value": linelist[i]})
 
-    return metadata
+def lines2matrix(lines, ignore=[0,-1]):
+    """Reads the lines of a MultiQC TSV file into a compact matrix, see mqc2matrix().
+    The lines can be read from a file or from a table in memory (i.e. pyparser.qc()).
+    """
+    rows = {}
+    lines = iter(lines)
+    header = next(lines).split('\t')
+    # Ignore First and Last Fields
+    ignored = set(i % len(header) for i in ignore)
+    columns = [i for i in range(len(header)) if i not in ignored]
+    attributes = [header[i] for i in columns]
+    for line in lines:
+        sample = line[:line.find('\t')]
+        if sample not in rows:
+            rows[sample] = []
+        rows[sample].append(line)
+
+    return attributes, columns, rows
+
+
+def mqc_entries(matrix, sample):
+    """Generates the metadata entries of a sample from a MultiQC matrix, see mqc2matrix().
+    Yields a dictionary for each attribute where dict = {"attribute": attr, "value": value}
+    """
+    attributes, columns, rows = matrix
+
+    for line in rows[sample]:
+        linelist = line.split('\t')
+        for attribute, i in zip(attributes, columns):
+            yield {"attribute": attribute, "value": linelist[i]}
 
 
 def tsv2dict(file, key_index = 0, value_index = 1, header = False):
@@ -342,25 +375,83 @@ def separate(sep, extractions):
     return extracted
 
 
-def generate(parsed_data, template, opath, dme_vault, helper, **kwargs):
+def generate(tree, parsed_data, template, prefix, dme_vault, helper, **kwargs):
     """Generates collection and data-object metadata needed for DME upload.
-    For each collection (directory) and data-object (file), an output file is
-    generated in JSON format. 'opath' dictates where these files will be saved.
-    Returns a dictionary of collection information where [key]= DME PATH of
-    the collection to initialized or updated and [value] = abolute PATH of the
-    collection metadata json file.
+    For each collection (directory), metadata is added to an in-memory tree of
+    collections. 'prefix' dictates the parent collection of each new collection.
+    Please see materialize() to write the tree to the local filesystem.
+    Returns a dictionary of collection information where [key] = name of the
+    collection to initialized or updated and [value] = collection metadata.
     """
     template = json2dict(template)
-    collections = helper(parsed_data, template, opath, dme_vault, **kwargs)
+    collections = helper(parsed_data, template, dme_vault, **kwargs)
+
+    for collection_name, metadata in collections.items():
+        tree[os.path.join(prefix, collection_name)] = metadata
 
     return collections
 
 
-def _pi(parsed_data, template, opath, dme_vault, index=0):
-    """Private helper function to generate(). Extracts PI_Lab metadata from parsed_data,
-    adds it to the template, and writes it to a new file. Returns a dictionary containing
-    collection information where [keys] are collection_name and values are the output
-    filename for parsed metadata. The relationship between each project request to
+def _write(outfile, metadata):
+    """Private helper function to materialize(). Writes collection metadata to a
+    JSON file, unless the file already exists with the same contents. Returns True
+    if the file was written and False if the file was unchanged.
+    """
+    if callable(metadata):
+        # Lazily generated metadata
+        metadata = metadata()
+    content = json.dumps(metadata, sort_keys=True, indent=4).encode('utf-8')
+
+    try:
+        # Only read existing file if its size matches
+        if os.path.getsize(outfile) == len(content):
+            with open(outfile, 'rb') as file:
+                if hashlib.md5(file.read()).digest() == hashlib.md5(content).digest():
+                    return False
+    except OSError:
+        pass # File does not exist
+
+    with open(outfile, 'wb') as file:
+        file.write(content)
+
+    return True
+
+
+def materialize(tree, opath, threads=config[".threads"]):
+    """Writes an in-memory tree of collections to the local filesystem. The tree is a
+    dictionary where [key] = relative PATH of a collection and [value] = collection
+    metadata (or a function returning its metadata). Each collection is created as a directory in 'opath' and its metadata
+    is saved to a '{collection}.metadata.json' file next to the directory. Directories
+    are created in a single batch and metadata files are written by a pool of threads.
+    Files with unchanged contents are not re-written. Returns the number of written files.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    # Only create leaf directories, parent directories are created along the way
+    collections = sorted(tree.keys())
+    leaves = [c for i, c in enumerate(collections)
+              if i + 1 == len(collections) or not collections[i+1].startswith(c + os.sep)]
+    for collection in leaves:
+        try:
+            os.makedirs(os.path.join(opath, collection))
+        except OSError as e:
+            if not os.path.isdir(os.path.join(opath, collection)):
+                cstart, cend = config['.error']
+                print("{}Error:{} Failed to create {}... PATH not accessible!\n{}".format(cstart, cend, collection, e), file=sys.stderr)
+                sys.exit(1)
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        jobs = [pool.submit(_write, os.path.join(opath, '{}.metadata.json'.format(c)), tree[c]) for c in collections]
+        written = sum(job.result() for job in jobs)
+
+    return written
+
+
+def _pi(parsed_data, template, dme_vault, index=0):
+    """Private helper function to generate(). Extracts PI_Lab metadata from parsed_data
+    and adds it to the template. Returns a dictionary containing collection information
+    where [keys] are collection_name and values are the collection metadata. The
+    relationship between each project request to
     PI_Lab collection(s) is '1:1'.
     """
 
@@ -377,22 +468,15 @@ def _pi(parsed_data, template, opath, dme_vault, index=0):
     aff = aff.split()[-1].replace('(','').replace(')','')
     collection_name = 'PI_Lab_{}{}_{}'.format(first.strip().replace(' ', ''), last.strip().replace(' ', ''), aff)
 
-    outfile = os.path.join(opath, '{}.metadata.json'.format(collection_name))
-    path_exists(os.path.join(opath, '{}'.format(collection_name)))
-
-    # Save upload collection metadata data as JSON file
-    with open(outfile, 'w') as file:
-        json.dump(template, file, sort_keys=True, indent=4)
+    return {collection_name: template}
 
-    return {collection_name: outfile}
 
-
-def _project(parsed_data, template, opath, dme_vault, pid):
-    """Private helper function to generate(). Extracts Project metadata from parsed_data,
-    adds it to the template, and writes it to a new file. Returns a dictionary containing
-    collection information where [keys] are collection_name and values are the output
-    filename for parsed metadata. The relationship between each project request to
-    Project collection(s) is '1:M' (multiple sub-projects, i.e. RNA-seq and ATAC-seq).
+def _project(parsed_data, template, dme_vault, pid):
+    """Private helper function to generate(). Extracts Project metadata from parsed_data
+    and adds it to the template. Returns a dictionary containing collection information
+    where [keys] are collection_name and values are the collection metadata. The
+    relationship between each project request to Project collection(s) is '1:M'
+    (multiple sub-projects, i.e. RNA-seq and ATAC-seq).
     """
     subcollections = {}
     subprojects = parsed_data["Project"]["request_type"]
@@ -432,27 +516,90 @@ def _project(parsed_data, template, opath, dme_vault, pid):
                 if dme_vault == 'CCR_DTB_Archive':
                     # Additional required fields for DTB vault
                     temp['metadataEntries'].append({'attribute': 'project_scientist', 'value': project_scientist})
+                    from datetime import datetime
                     temp['metadataEntries'].append({'attribute': 'project_completed_date', 'value': datetime.today().strftime('%Y-%m-%d')})
 
-                outfile = os.path.join(opath, '{}.metadata.json'.format(collection_name))
-                path_exists(os.path.join(opath, '{}'.format(collection_name)))
+                subcollections[collection_name] = temp
 
-                subcollections[collection_name] = outfile
+    return subcollections
 
-                #Save upload collection metadata data as JSON file
-                with open(outfile, 'w') as file:
-                    json.dump(temp, file, sort_keys=True, indent=4)
 
-    return subcollections
+def _attribute(metadata, attributes, default=''):
+    """Private helper function to get the value of the first matching attribute
+    from collection metadata. Returns default if the attributes are not found.
+    """
+    for entry in metadata['metadataEntries']:
+        if entry['attribute'] in attributes:
+            return entry['value']
+
+    return default
+
+
+def _methods(project_collects):
+    """Private helper function to index sub-projects by their type of project (method).
+    Returns a dictionary where [key] = method and [value] = Project collection_name.
+    """
+    project_keys = config["project_template"]["sample_key"]
+    methods = {}
+    for name in project_collects:
+        method = _attribute(project_collects[name], project_keys).strip().lower()
+        methods.setdefault(method, name)
+
+    return methods
+
+
+def subproject(project_collects, method):
+    """Finds the Project collection of the sub-project with a given type of project
+    (method). Returns the first Project collection if no sub-project matches.
+    """
+    try:
+        return _methods(project_collects)[method.strip().lower()]
+    except KeyError:
+        return list(project_collects.keys())[0]
+
+
+def subprojects(project_collects, sample_dict):
+    """Maps each sample to its sub-project or Project collection. A sample's application
+    type is matched against each sub-project's type of project (method). Samples that do
+    not match any sub-project are mapped to the first sub-project. Returns a dictionary
+    where [key1] = Project collection_name, [key2] = SampleID, and value = sample metadata.
+    """
+    sample_keys = config["sample_template"]["project_key"]
+    projects = list(project_collects.keys())
+    mapped = {name: {} for name in projects}
+    methods = _methods(project_collects)
+
+    unmatched = []
+    for sid, metadict in sample_dict.items():
+        method = next((metadict[k] for k in sample_keys if k in metadict), '').strip().lower()
+        try:
+            mapped[methods[method]][sid] = metadict
+        except KeyError:
+            mapped[projects[0]][sid] = metadict
+            unmatched.append(sid)
+
+    if unmatched and len(projects) > 1:
+        cstart, cend = config['.warning']
+        print("{}WARNING:{} Failed to map {} sample(s) to a sub-project by their application type... adding them to {}!".format(cstart, cend, len(unmatched), projects[0]), file=sys.stderr)
+
+    return mapped
+
+
+def _extended(metadata, matrix, sample):
+    """Private helper function to _sample(). Extends a sample's collection metadata with
+    its entries from a MultiQC matrix. Called when the collection metadata is written.
+    """
+    return {"metadataEntries": metadata["metadataEntries"] + list(mqc_entries(matrix, sample))}
 
 
-def _sample(parsed_data, template, opath, dme_vault, additional_metadata = {}):
-    """Private helper function to generate(). Extracts Sample metadata from parsed_data,
-    adds it to the template, and writes it to a new file. Returns a dictionary containing
-    collection information where [keys] are collection_name and values are the output
-    filename for parsed metadata. The relationship between each project request to
+def _sample(parsed_data, template, dme_vault, additional_metadata = None):
+    """Private helper function to generate(). Extracts Sample metadata from parsed_data
+    and adds it to the template. Returns a dictionary containing collection information
+    where [keys] are collection_name and values are the collection metadata. The
+    relationship between each project request to
     rawdata sample collection(s) is '1:M'. Also merges additional metadata if provided,
-    see tsv2dict() for generating the expected data structure.
+    see mqc2matrix() for generating the expected data structure. Additional metadata
+    is merged lazily, when the collection metadata is written.
     """
     subcollections = {}
 
@@ -464,31 +611,21 @@ def _sample(parsed_data, template, opath, dme_vault, additional_metadata = {}):
             else:
                 sname = parsed_data[sid]["sample_name"]
                 # Add optional runtime metadata
-                if additional_metadata:
-                    try:
-                        metarun = additional_metadata[sname]
-                        temp['metadataEntries'].extend(metarun)
-                    except KeyError:
-                        pass # Edge-case: no runtime metadata for that sample
+                # Edge-case: no runtime metadata for that sample
+                if additional_metadata and sname in additional_metadata[-1]:
+                    temp = partial(_extended, temp, additional_metadata, sname)
                 collection_name = 'Sample_{}_{}'.format(sid, sname)
 
-                outfile = os.path.join(opath, '{}.metadata.json'.format(collection_name))
-                path_exists(os.path.join(opath, '{}'.format(collection_name)))
-
-                subcollections[collection_name] = outfile
-
-                #Save upload collection metadata data as JSON file
-                with open(outfile, 'w') as file:
-                    json.dump(temp, file, sort_keys=True, indent=4)
+                subcollections[collection_name] = temp
 
     return subcollections
 
 
-def _analysis(parsed_data, template, opath, dme_vault):
-    """Private helper function to generate(). Extracts Analysis metadata from parsed_data,
-    adds it to the template, and writes it to a new file. Returns a dictionary containing
-    collection information where [keys] are collection_name and values are the output
-    filename for parsed metadata. The relationship between each project request to
+def _analysis(parsed_data, template, dme_vault):
+    """Private helper function to generate(). Extracts Analysis metadata from parsed_data
+    and adds it to the template. Returns a dictionary containing collection information
+    where [keys] are collection_name and values are the collection metadata. The
+    relationship between each project request to
     analysis collection is '1:1'; however, it is possible to have multiple analyses
     for a given project.
     """
@@ -514,36 +651,21 @@ def _analysis(parsed_data, template, opath, dme_vault):
 
     collection_name = 'Primary_Analysis_{}{}_{}_{}_{}'.format(parsed_data['number_of_cases'], parsed_data['method'], parsed_data['assembly_name'], parsed_data['gtf_ver'], parsed_data['md5_all_inputs_serial'])
 
-    outfile = os.path.join(opath, '{}.metadata.json'.format(collection_name))
-    path_exists(os.path.join(opath, '{}'.format(collection_name)))
-
-    subcollections[collection_name] = outfile
-
-    #Save upload collection metadata data as JSON file
-    with open(outfile, 'w') as file:
-        json.dump(temp, file, sort_keys=True, indent=4)
+    subcollections[collection_name] = temp
 
     return subcollections
 
 
-def main():
-
-    # @args(): Parses positional command-line args
-    # @validate(): Checks if user inputs are vaild
-    data_dict, project_dict, sample_dict, pid, metafile, analysisfile, convert, ipath, opath, vault = validate(args(sys.argv))
-
+def run(data_dict, project_dict, sample_dict, opath, vault, pid = '', metarun = None, analysis_dict = {}, convert = False):
+    """Generates the collection hierarchy and its metadata from parsed project request
+    template data (i.e. lint.run()), and saves collection metadata as JSON files in the
+    output directory. Optional sample metadata is a compact matrix, see mqc2matrix(), and
+    optional analysis metadata is a dictionary, see tsv2dict(). Returns the in-memory tree
+    of collections where [key] = relative PATH and [value] = metadata.
+    """
     # Output directory for collection and data-object metadata
     path_exists(opath)
-
-    # Read in JSON files as dictionary
-    data_dict = json2dict(data_dict)
-    pi_dict, project_dict = separate(json2dict(project_dict), ["PI_Lab", "Project"])
-    sample_dict = json2dict(sample_dict)
-
-    # Convert optional metadata file from TSV to dictionary
-    metarun = {}
-    if metafile:
-        metarun = mqc2dict(metafile)
+    pi_dict, project_dict = separate(project_dict, ["PI_Lab", "Project"])
 
     # Covert field from common name to dme_name
     if convert:
@@ -554,26 +676,69 @@ def main():
     # Get PATH to templates
     template_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'data', 'templates')
 
+    # In-memory tree of collections where [key] = relative PATH and [value] = metadata
+    tree = {}
+
     # Generate PI_Lab collection metadata
-    pi_collects = generate(parsed_data=pi_dict, template=os.path.join(template_path, 'pi_lab_collection.json'), opath=opath, dme_vault=vault, helper=_pi)
+    pi_collects = generate(tree=tree, parsed_data=pi_dict, template=os.path.join(template_path, 'pi_lab_collection.json'), prefix='', dme_vault=vault, helper=_pi)
 
-    # Generate Project collection(s) metadata
-    # Add MVD functionality later
-    # Need Project key in spreadsheet to map to samples
-    dme_prefix = os.path.join(opath, list(pi_collects.keys())[0])
-    project_collects = generate(parsed_data=project_dict, template=os.path.join(template_path, 'project_collection.json'), opath=dme_prefix, dme_vault=vault, helper=_project, pid=pid)
+    # Generate Project collection(s) metadata, one for each sub-project
+    pi_prefix = list(pi_collects.keys())[0]
+    project_collects = generate(tree=tree, parsed_data=project_dict, template=os.path.join(template_path, 'project_collection.json'), prefix=pi_prefix, dme_vault=vault, helper=_project, pid=pid)
 
-    # Generate Sample collection(s) metadata
-    dme_prefix = os.path.join(dme_prefix, list(project_collects.keys())[0])
-    sample_collects = generate(parsed_data=sample_dict, template=os.path.join(template_path, 'sample_collection.json'), opath=dme_prefix, dme_vault=vault, helper=_sample, additional_metadata=metarun)
+    # Generate Sample collection(s) metadata for each sub-project
+    for name, samples in subprojects(project_collects, sample_dict).items():
+        if samples:
+            generate(tree=tree, parsed_data=samples, template=os.path.join(template_path, 'sample_collection.json'), prefix=os.path.join(pi_prefix, name), dme_vault=vault, helper=_sample, additional_metadata=metarun)
 
     # Generate Analysis collection metadata
     # If optional runtime metadata provided
+    if analysis_dict:
+        # Add Analysis collection to the sub-project of the pipeline's method
+        name = subproject(project_collects, analysis_dict.get('method', ''))
+        analysis_collects = generate(tree=tree, parsed_data=analysis_dict, template=os.path.join(template_path, 'analysis_collection.json'), prefix=os.path.join(pi_prefix, name), dme_vault=vault, helper=_analysis)
+
+    # Create collection hierarchy and save collection metadata as JSON files
+    written = materialize(tree, opath)
+    print('Initialized {} collection(s), updated {} metadata file(s) in {}'.format(len(tree), written, opath))
+
+    return tree
+
+
+def _initialize(user_inputs):
+    """Private function to run the program with validated user inputs, see main()."""
+    data_dict, project_dict, sample_dict, pid, metafile, analysisfile, convert, ipath, opath, vault = user_inputs
+
+    # Convert optional metadata file from TSV to a compact matrix
+    metarun = None
+    if metafile:
+        metarun = mqc2matrix(metafile)
+
     analysis_dict = {}
     if analysisfile:
         analysis_dict = tsv2dict(analysisfile)
-        analysis_collects = generate(parsed_data=analysis_dict, template=os.path.join(template_path, 'analysis_collection.json'), opath=dme_prefix, dme_vault=vault, helper=_analysis)
 
+    # Read in JSON files as dictionary
+    run(json2dict(data_dict), json2dict(project_dict), json2dict(sample_dict), opath, vault,
+        pid = pid, metarun = metarun, analysis_dict = analysis_dict, convert = convert)
+
+
+def main():
+    from profiler import option, Profiler
+
+    # @option(): Strips the opt-in --profile option, see profiler.py
+    # @args(): Parses positional command-line args
+    # @validate(): Checks if user inputs are vaild
+    argslist, profile = option(sys.argv)
+    user_inputs = validate(args(argslist))
+    if profile is None:
+        _initialize(user_inputs)
+        return
+
+    # Profiles are saved next to the output of lint.py, i.e. DME/profiles
+    with Profiler(os.path.join(user_inputs[-3], 'profiles'), profile, 'initialize') as profiler:
+        with profiler.stage('run'):
+            _initialize(user_inputs)
 
 
 if __name__ == '__main__':
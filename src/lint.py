@@ -2,13 +2,22 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import print_function, division
-import pandas as pd
 import sys, os, re, json
+import fscache
 
 # Configuration for defining valid sheets and other default values
 config = {
     ".warning": ["\033[93m", "\033[00m"], ".error": ["\033[91m", "\033[00m"],
     ".sheets": ["Data Dictionary", "Project Template", "Sample Template"],
+    ".text": {
+        "extensions": [".txt", ".tsv", ".csv"],
+        "test_sheets": ["Example Project", "Example Sample"]
+    },
+    ".cache": {
+        "directory": os.path.join(".cache", "lint"),
+        "outputs": ["data_dictionary.json", "project.json", "sample.json"],
+        "logs": ["data_dictionary.txt", "project_information.txt", "sample_information.txt"]
+    },
     "data_dictionary": {
         "sheet_name": "Data Dictionary",
         "skip_lines": [0],
@@ -62,6 +71,11 @@ Required Positional Arguments:
                                   This spreadsheet is sent out to the PI or post-doc
                                   that is requesting our assistance. Please see
                                   "data/experiment_metadata.xlsx" as an example.
+                                  A directory of per-sheet TSV/CSV files (i.e. output
+                                  of excel2tsv.py) or a single text template where each
+                                  sheet starts with a '[Sheet Name]' line can also be
+                                  provided. Text templates are read without an Excel
+                                  engine.
 
     [2] output_directory          Type [Path]: Absolute or relative PATH for output
                                   files. If the PATH does not exist, it will be
@@ -69,6 +83,14 @@ Required Positional Arguments:
 Options:
     [-h, --help]                  Displays usage and help information for the script.
     [-n, --dry-run]               Dry-run using the included example sheets.
+    [--profile[=MODE]]            Profile the run with cProfile (default) or sampled
+                                  stacks (--profile=sample) into output_directory/profiles,
+                                  see profiler.py.
+
+Caching:
+    Parsed data is cached in '{output_directory}/.cache/lint/'. Re-running against
+    an unchanged spreadsheet restores the parsed data from the cache instead of
+    re-parsing the spreadsheet.
 
 Example:
     # Run against user-provided information: "Project Template", "Sample Template"
@@ -77,6 +99,10 @@ Example:
     # Dry-run against included examples: "Example Project", "Example Sample"
     $ python lint.py data/experiment_metadata.xlsx /scratch/$USER/DME_Upload/ -n
 
+    # Run against per-sheet TSV files created by excel2tsv.py
+    $ python excel2tsv.py data/experiment_metadata.xlsx sheets/sheet
+    $ python lint.py sheets/ /scratch/$USER/DME_Upload/
+
 Requirements:
     python >= 3.5
       + pandas
@@ -116,10 +142,11 @@ def path_exists(path):
     """
     cstart, cend = config['.warning']
 
-    if not os.path.isdir(path):
+    if not fscache.isdir(path):
         print("{}WARNING:{} Output directory '{}' does not exist... creating it now!".format(cstart, cend, path), file=sys.stderr)
         try:
             os.makedirs(path)
+            fscache.invalidate(path)
         except OSError as e:
             cstart, cend = config['.error']
             print("{}Error:{} Failed to create {}... PATH not accessible!\n{}".format(cstart, cend, path, e), file=sys.stderr)
@@ -128,10 +155,12 @@ def path_exists(path):
 
 
 def file_exists(filename):
-    """Checks to see if file exists or is accessible.
-    Avoids problem with inconsistencies across python2.7 and >= python3.4 and
-    works in both major versions of python"""
+    """Checks to see if file exists or is accessible. Existence and permissions
+    are checked once per run, see fscache.py"""
+    if fscache.isfile(filename) and fscache.access(filename, os.R_OK):
+        return
     try:
+        # Opened only to report why the file is not accessible
         fh = open(filename)
         fh.close()
     # File cannot be opened for reading (may not exist) or permissions problem
@@ -147,10 +176,8 @@ def contains_sheets(spreadsheet):
     that are defined in the config specification. Please see config['.sheets']
     for all required sheets.
     """
-
     required = config['.sheets']
-    df = pd.read_excel(spreadsheet, sheet_name=None, header=None)
-    valid_sheets = [sheet for sheet in df.keys() if sheet in required]
+    valid_sheets = [sheet for sheet in sheet_names(spreadsheet) if sheet in required]
 
     if sorted(valid_sheets) != sorted(required):
         # Required sheet not in spreadsheet
@@ -168,30 +195,291 @@ def validate(user_inputs):
     """
 
     meta_sheet, output_path, dryrun = user_inputs
-    file_exists(meta_sheet)
+    if os.path.isdir(meta_sheet):
+        # Directory of per-sheet TSV/CSV files
+        for filename in _sheet_files(meta_sheet).values():
+            file_exists(filename)
+    else:
+        file_exists(meta_sheet)
     path_exists(output_path)
-    sheets = contains_sheets(meta_sheet)
 
-    return meta_sheet, output_path, sheets, dryrun
+    return meta_sheet, output_path, dryrun
+
+
+def md5sum(filename, blocksize = 65536):
+    """Gets md5checksum of a file in memory-safe manner. The file is read in blocks
+    defined by the blocksize parameter to avoid reading the entire file into memory.
+    """
+    import hashlib
+
+    hasher = hashlib.md5()
+    with open(filename, 'rb') as fh:
+        buf = fh.read(blocksize)
+        while len(buf) > 0:
+            hasher.update(buf)
+            buf = fh.read(blocksize)
+
+    return hasher.hexdigest()
+
+
+def digest(path):
+    """Gets the md5 checksum of a project request template. The checksum of a directory
+    of per-sheet TSV/CSV files is the md5 of each sheet's name and md5 checksum.
+    """
+    import hashlib
+
+    if not os.path.isdir(path):
+        return md5sum(path)
+
+    sheets = _sheet_files(path)
+    checksums = ['{}\t{}'.format(sheet, md5sum(sheets[sheet])) for sheet in sorted(sheets)]
+
+    return hashlib.md5('\n'.join(checksums).encode('utf-8')).hexdigest()
+
+
+def cache_key(spreadsheet, template):
+    """Creates a key for the parsed-template cache. The key is the md5 checksum of
+    the spreadsheet's checksum, the selected template sheets (user-provided or
+    test sheets), and a digest of the config specification and this program.
+    """
+    import hashlib
+
+    specification = json.dumps(config, sort_keys=True) + md5sum(os.path.abspath(__file__))
+    config_digest = hashlib.md5(specification.encode('utf-8')).hexdigest()
+    key = '{}\t{}\t{}'.format(digest(spreadsheet), template, config_digest)
+
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+
+def cached(cache_route):
+    """Reads parsed data from a previous run out of the parsed-template cache.
+    Returns a list of dictionaries (data dictionary, project, sample) or an
+    empty list if the cache does not contain a complete, readable entry.
+    """
+    parsed = []
+    try:
+        for file in config['.cache']['outputs']:
+            with open(os.path.join(cache_route, file), 'r') as fh:
+                parsed.append(json.load(fh))
+    # Cache miss, or a corrupted or incomplete cache entry
+    except (IOError, ValueError):
+        return []
+
+    return parsed
+
+
+def cache(opath, log_route, cache_route):
+    """Saves parsed JSON files and log files into the parsed-template cache. Files
+    are copied into a temporary directory first and renamed into place, so an
+    interrupted run never leaves a partial cache entry behind.
+    """
+    from shutil import copy, rmtree
+
+    tmp = '{}.{}.tmp'.format(cache_route, os.getpid())
+    os.makedirs(tmp)
+    for file in config['.cache']['outputs']:
+        copy(os.path.join(opath, file), tmp)
+    for file in config['.cache']['logs']:
+        copy(os.path.join(log_route, file), tmp)
+
+    try:
+        os.rename(tmp, cache_route)
+    except OSError:
+        if cached(cache_route):
+            # Another run already created this cache entry
+            rmtree(tmp)
+            return
+        # Replaces a corrupted or incomplete cache entry, it is
+        # renamed aside first so the entry is swapped in one step
+        stale = '{}.{}.old'.format(cache_route, os.getpid())
+        try:
+            os.rename(cache_route, stale)
+            os.rename(tmp, cache_route)
+        except OSError:
+            rmtree(tmp, ignore_errors = True)
+        rmtree(stale, ignore_errors = True)
+
+    return
+
+
+def restore(cache_route, log_route):
+    """Restores log files from the parsed-template cache into the logs directory."""
+    from shutil import copy
+
+    for file in config['.cache']['logs']:
+        copy(os.path.join(cache_route, file), log_route)
+
+    return
+
+
+def required_fields(data_dict):
+    """Gets a list of required fields from a parsed data dictionary, where the value
+    of data_dict[collection_type][field] is a list [dme_name, is_required].
+    """
+    required = []
+    for col, fields in data_dict.items():
+        for field, (dme, req) in fields.items():
+            if req.lower() == 'required':
+                required.append(field)
+
+    return required
+
+
+def subproject_count(project_dict):
+    """Gets the number of sub-projects from parsed project metadata. This is the same
+    value 'project()' returns, the 3rd largest number of values for a given attribute.
+    """
+    mvds = [len(values) for fields in project_dict.values() for values in fields.values()]
+
+    return sorted(mvds)[-3]
+
+
+def _cleaned(excel_df):
+    """Private function to clean a parsed Excel sheet. Each cell is cast to a string
+    (empty cells become 'nan') and any leading or trailing whitespace is removed.
+    The sheet is cleaned as a single matrix with vectorized numpy and pandas functions
+    instead of a pass per column, and each distinct value is only cleaned once, since
+    the values of a sheet are often repeated across lines (i.e. organism, strandedness)
+    or across columns. Returns a DataFrame of cleaned cells.
+    """
+    import numpy as np
+    import pandas as pd
+
+    cleaned = lambda values: np.frompyfunc(str.strip, 1, 1)(np.frompyfunc(str, 1, 1)(values))
+    kind = np.frompyfunc(type, 1, 1)
+
+    values = excel_df.values.ravel()
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    cells = cleaned(uniques)[codes]
+    # Values of different types that are equal (i.e. 1, 1.0 and True or 0.0 and -0.0)
+    # share a code but are written differently, these cells are cleaned one by one
+    zeros = [code for code, value in enumerate(uniques.tolist()) if value == 0]
+    exact = (kind(values) != kind(uniques)[codes]) | np.isin(codes, zeros)
+    if exact.any():
+        cells[exact] = cleaned(values[exact])
+
+    return pd.DataFrame(cells.reshape(excel_df.shape), dtype=object)
+
+
+def _delimited(filename, delimiter):
+    """Private function to read a delimited text file (TSV or CSV) with the csv module.
+    Cells are cleaned like an Excel sheet: whitespace is removed and empty cells become
+    'nan'. Shorter rows are padded, so each row has the same number of columns.
+    """
+    import csv
+
+    with open(filename, 'r', newline='') as fh:
+        rows = [[cell.strip() if cell else 'nan' for cell in row] for row in csv.reader(fh, delimiter=delimiter)]
+
+    width = max([len(row) for row in rows] + [0])
+
+    return [row + ['nan'] * (width - len(row)) for row in rows]
+
+
+def _delimiter(filename):
+    """Private function to get the delimiter of a text template from its extension."""
+    if filename.lower().endswith('.csv'):
+        return ','
+
+    return '\t'
+
+
+def is_text_template(spreadsheet):
+    """Checks if the project request template is a directory of per-sheet TSV/CSV
+    files or a single multi-section text template instead of an Excel spreadsheet.
+    """
+    return os.path.isdir(spreadsheet) or spreadsheet.lower().endswith(tuple(config['.text']['extensions']))
+
+
+def _sheet_files(directory):
+    """Private function to find per-sheet TSV/CSV files in a directory. Files are named
+    after the sheet they contain, with spaces replaced by dashes and an optional prefix
+    (i.e. 'sheet_Project-Template.txt' from excel2tsv.py). Returns a dictionary where
+    [key] = sheet name and [value] = filename.
+    """
+    sheets = {}
+    for file in sorted(os.listdir(directory)):
+        name, ext = os.path.splitext(file)
+        if ext.lower() not in config['.text']['extensions']:
+            continue
+        for sheet in config['.sheets'] + config['.text']['test_sheets']:
+            suffix = sheet.replace(' ', '-')
+            if name == suffix or name.endswith('_' + suffix):
+                sheets[sheet] = os.path.join(directory, file)
+
+    return sheets
+
+
+def _sections(filename):
+    """Private function to split a single multi-section text template into sheets.
+    Each section starts with a line containing the sheet name in square brackets,
+    i.e. '[Project Template]'. Returns a dictionary where [key] = sheet name and
+    [value] = list of cleaned rows in that section.
+    """
+    sections = {}
+    for row in _delimited(filename, _delimiter(filename)):
+        if row[0].startswith('[') and row[0].endswith(']'):
+            sheet = row[0][1:-1].strip()
+            sections[sheet] = []
+            continue
+        try:
+            sections[sheet].append(row)
+        except NameError:
+            pass # Skip over any lines before the first section
+
+    return sections
+
+
+def sheet_names(spreadsheet):
+    """Gets the names of the sheets in the project request template."""
+    if os.path.isdir(spreadsheet):
+        return list(_sheet_files(spreadsheet).keys())
+    elif is_text_template(spreadsheet):
+        return list(_sections(spreadsheet).keys())
+
+    import pandas as pd
+
+    return pd.ExcelFile(spreadsheet).sheet_names
+
+
+def read_sheet(spreadsheet, sheet, skip_lines):
+    """Reads a sheet from the project request template. The template can be an Excel
+    spreadsheet, a directory of per-sheet TSV/CSV files, or a single multi-section
+    text template. Text templates are read with the csv module, without an Excel
+    engine. Returns a DataFrame of cleaned cells after skipping over skip_lines, so
+    each template is parsed by the same column-wise parsers.
+    """
+    import pandas as pd
+
+    if os.path.isdir(spreadsheet):
+        filename = _sheet_files(spreadsheet)[sheet]
+        rows = _delimited(filename, _delimiter(filename))
+    elif is_text_template(spreadsheet):
+        rows = _sections(spreadsheet)[sheet]
+    else:
+        # Skip over reading the first line or header
+        return _cleaned(pd.read_excel(spreadsheet, sheet_name=sheet, header=None, skiprows=skip_lines))
+
+    # Rows of text templates are already cleaned, see _delimited()
+    return pd.DataFrame([row for i, row in enumerate(rows) if i not in skip_lines], dtype=object)
 
 
-def _parsed_meta(excel_df, indexes):
+def _parsed_meta(df, indexes):
     """Private function for 'meta()' to parse the Data Dictionary sheet.
     This function generates the following parsed values: collection_type, is_required,
     field_name, dme_name.
     """
-    for i, row in excel_df.iterrows():
-        # Remove any leading or trailing whitespace and parse the columns of interest
-        collection_name, is_required, field_name, dme_name = [str(row[index]).lstrip().rstrip() for index in indexes]
-        # skip over over empty lines or nan values
-        if not is_required or is_required == 'nan':
-            continue
-        # Get collection type: PI, Project, Sample
-        elif "collection" in collection_name.lower():
-            collection_type = collection_name.split()[0]
-            continue
+    collection_name, is_required, field_name, dme_name = [df[index] for index in indexes]
 
-        yield collection_type, is_required, field_name, dme_name
+    # Skip over over empty lines or nan values
+    provided = (is_required != '') & (is_required != 'nan')
+    # Get collection type: PI, Project, Sample
+    headers = provided & collection_name.str.lower().str.contains('collection', regex=False)
+    collection_type = collection_name.where(headers).str.split().str[0].ffill()
+    rows = provided & ~headers
+
+    return zip(collection_type[rows].tolist(), is_required[rows].tolist(),
+                field_name[rows].tolist(), dme_name[rows].tolist())
 
 
 def meta(sheet, spreadsheet, order, index, log_route):
@@ -204,7 +492,7 @@ def meta(sheet, spreadsheet, order, index, log_route):
     metadata = {}
 
     # Skip over reading the first line or header
-    df = pd.read_excel(spreadsheet, sheet_name=sheet, header=None, skiprows=skipover)
+    df = read_sheet(spreadsheet, sheet, skipover)
     # Creating logging output file
     outfh = open(os.path.join(log_route, "data_dictionary.txt"), "w")
 
@@ -244,27 +532,38 @@ def _remove_trailing_nan(linelist):
     return clean
 
 
-def _parsed_project(excel_df):
+def _attributes(df):
+    """Private function to split a cleaned Project or Sample Template sheet into its
+    attribute (key) column and its value columns. Returns the attribute column, the
+    value columns, and a mask of lines to keep (lines with an attribute or key that
+    are not optional field headers).
+    """
+    attr = df[df.columns[0]]
+    values = df.iloc[:, 1:]
+    keep = (attr != '') & (attr != 'nan') & ~attr.str.lower().str.startswith('optional field')
+
+    return attr, values, keep
+
+
+def _parsed_project(df):
     """Private function for 'project()' to parse the Project Template sheet.
     This function generates the following parsed values: collection_type, field,
     project_value_list.
     """
-    for i, row in excel_df.iterrows():
-        # Project information follows a key, value_list pattern
-        attr, *project_value_list = [str(field).lstrip().rstrip() for field in row]
-        # Pass over lines with no attribute or key
-        if not attr or attr == 'nan' or attr.lower().startswith('optional field'):
-            continue
-        # Get collection type: PI, Project, Sample
-        elif "collection" in attr.lower():
-            collection_type = project_value_list[0]
-            continue
-
-        # Remove trailing empty cells or nan's
-        project_value_list = _remove_trailing_nan(project_value_list)
+    # Project information follows a key, value_list pattern
+    attr, values, keep = _attributes(df)
+    # Get collection type: PI, Project, Sample
+    headers = keep & attr.str.lower().str.contains('collection', regex=False)
+    collection_type = values[values.columns[0]].where(headers).ffill()
 
-        yield collection_type, attr, project_value_list
+    # Find the number of values in each line after removing trailing empty cells or nan's
+    filled = ((values != '') & (values != 'nan')).values[:, ::-1]
+    lengths = (filled.shape[1] - filled.argmax(axis=1)) * filled.any(axis=1)
 
+    rows = (keep & ~headers).values
+    for col, field, project_value_list, n in zip(collection_type[rows].tolist(), attr[rows].tolist(),
+                                                 values[rows].values.tolist(), lengths[rows].tolist()):
+        yield col, field, project_value_list[:n]
 
 
 def project(sheet, spreadsheet, log_route):
@@ -278,12 +577,12 @@ def project(sheet, spreadsheet, log_route):
     metadata = {}
 
     # Skip over reading the first line or header
-    df = pd.read_excel(spreadsheet, sheet_name=sheet, header=None, skiprows=skipover)
+    df = read_sheet(spreadsheet, sheet, skipover)
     # Creating logging output file
     outfh = open(os.path.join(log_route, "project_information.txt"), "w")
 
     mvds = [] # Find the number of sub-projects or the number of MVDs an attribute can have
-    for col, field, pro_attr_list in _parsed_project(excel_df = df):
+    for col, field, pro_attr_list in _parsed_project(df):
         outfh.write("{}\t{}\t{}\n".format(col, field, "\t".join(pro_attr_list)))
         if col not in metadata:
             metadata[col] = {}
@@ -296,27 +595,36 @@ def project(sheet, spreadsheet, log_route):
     return metadata, sorted(mvds)[-3]
 
 
-def _parsed_sample(excel_df):
+def _parsed_sample(df):
     """Private function for 'sample()' to parse the Sample Template sheet.
-    This function generates the following parsed values: SampleID, field,
-    sample_metadata_value.
+    This function generates the following parsed values for each 'Sample ID' header
+    line: a list of fields, and a list of lines with the metadata values of each sample
+    listed under the header. The Sample ID field is added last.
     """
-    for i, row in excel_df.iterrows():
-        attr, *project_value_list = [str(field).lstrip().rstrip() for field in row]
-        # Pass over lines with no attribute or key
-        if not attr or attr == 'nan' or attr.lower().startswith('optional field'):
-            continue
-        # Check if header and clean
-        if attr.lower() == 'sample id':
-            header = _remove_trailing_nan(project_value_list)
-            sid_field = attr
-            continue
-
-        for j in range(0,len(header),1):
-            yield attr, header[j], project_value_list[j]
-        else:
-            # Yield add Sample ID last
-            yield attr, sid_field, attr
+    attr, values, keep = _attributes(df)
+    # Check if header and clean
+    headers = (keep & (attr.str.lower() == 'sample id')).values
+    # Samples belong to the closest header line above them
+    blocks = headers.cumsum()
+    samples = keep.values & ~headers & (blocks > 0)
+
+    cells = df.values
+    for block, line in enumerate(headers.nonzero()[0], 1):
+        header = _remove_trailing_nan(cells[line, 1:].tolist())
+        rows = samples & (blocks == block)
+        # Sample ID is moved after the values of the header's fields
+        lines = cells[rows][:, list(range(1, len(header) + 1)) + [0]]
+
+        yield header + [cells[line, 0]], lines.tolist()
+
+
+def _transposed(fields, lines):
+    """Private function to convert the lines of parsed samples into a nested dictionary
+    in a single transpose-to-dict step, where [key1] = SampleID and [key2] = field. The
+    SampleID is the last value of each line, and later lines of a sample replace the
+    values of earlier lines.
+    """
+    return {line[-1]: dict(zip(fields, line)) for line in lines}
 
 
 def sample(sheet, spreadsheet, log_route):
@@ -329,66 +637,100 @@ def sample(sheet, spreadsheet, log_route):
     metadata = {}
 
     # Skip over reading the first line or header
-    df = pd.read_excel(spreadsheet, sheet_name=sheet, header=None, skiprows=skipover)
+    df = read_sheet(spreadsheet, sheet, skipover)
     # Creating logging output file
     outfh = open(os.path.join(log_route, "sample_information.txt"), "w")
 
-    for sid, field, value in _parsed_sample(excel_df = df):
-        outfh.write("{}\t{}\t{}\n".format(sid, field, value))
-        if sid not in metadata:
-            metadata[sid] = {}
-
-        metadata[sid][field] = value
+    for fields, lines in _parsed_sample(df):
+        outfh.writelines("{}\t{}\t{}\n".format(line[-1], field, value) for line in lines for field, value in zip(fields, line))
+        for sid, sample_metadata in _transposed(fields, lines).items():
+            if sid not in metadata:
+                metadata[sid] = sample_metadata
+            else:
+                metadata[sid].update(sample_metadata)
 
     outfh.close()
 
     return metadata
 
 
+def _empty(value):
+    """Private function to check if a parsed value is an empty cell or nan value."""
+    return not value.strip() or value.lower() == 'nan'
+
+
+def required_index(data_dict):
+    """Builds an index of fields defined in the data dictionary. Returns a nested
+    dictionary where [key1] = collection_type (PI, Project, Sample), [key2] = field,
+    and the value is a boolean indicating whether the field is required.
+    """
+    index = {}
+    for col, fields in data_dict.items():
+        index[col] = {field: req.lower() == 'required' for field, (dme, req) in fields.items()}
+
+    return index
+
+
 def missing_fields(parsed_dict, data_dict, collection_type, requirements, Nsubprojects = None, ext = []):
     """Checks the parsed fields in the user-provided spreadsheet against the
-    data dictionary to see if all the required fields were provided.
+    data dictionary to see if all the required fields were provided. Each field is
+    checked as a column across all sub-projects or samples in a single pass, so all
+    violations are reported together. Returns a set of required fields that were not
+    provided and a list of errors for required fields with missing values.
     """
     cstart, cend = config['.warning']
-    estart, eend = config['.error']
-    mvd_attr = config['project_template']['mvds']
-    provided = [] + ext
-
+    mvd_attr = set(config['project_template']['mvds'])
+    index = required_index(data_dict)
+    provided = set(ext)
+    errors = []
+
+    # Find empty cells for each field (or column) where [key] = (collection_type, field)
+    # and [value] = list of sub-project values or a list of empty Sample IDs
+    columns = {}
     for k, fdict in parsed_dict.items():
         if collection_type == 'Sample':
-            k = 'Sample'
-        for field, uvalue in fdict.items():
-            try: # Get whether a field is required or optional
-                is_req = data_dict[k][field][-1]
-            except KeyError:
-                print("{}WARNING:{} Provided fields ({}, {}) are not defined in data dictionary... skipping over now!".format(cstart, cend, k, field), file=sys.stderr)
-                continue
-
-            if is_req.lower() == 'required':
-                mvd_fields = [v for v in uvalue if v.strip() and v.lower() != 'nan']
-
-                # Check for any missing required sub-project fields
-                if field in mvd_attr and len(mvd_fields) != Nsubprojects:
-                    print("{}Error:{} Failed to provide required field ({}) for all sub-projects...exiting".format(estart, eend, field), file=sys.stderr)
-                    sys.exit(1)
-
-                # Check for singular required fields (no MVD relationship)
-                elif field not in mvd_attr and not mvd_fields:
-                    print("{}Error:{} Failed to provide required field ({})...exiting".format(estart, eend, field), file=sys.stderr)
-                    sys.exit(1)
-                provided.append(field)
-
-    missing = set(requirements) - set(provided)
-
-    return missing
-
-
-def main():
+            for field, uvalue in fdict.items():
+                empty = columns.setdefault(('Sample', field), [])
+                if _empty(uvalue):
+                    empty.append(k)
+        else:
+            for field, uvalue in fdict.items():
+                columns[(k, field)] = [v for v in uvalue if not _empty(v)]
+
+    for (k, field), values in columns.items():
+        try: # Get whether a field is required or optional
+            is_req = index[k][field]
+        except KeyError:
+            print("{}WARNING:{} Provided fields ({}, {}) are not defined in data dictionary... skipping over now!".format(cstart, cend, k, field), file=sys.stderr)
+            continue
 
-    # @args(): Parses positional command-line args
-    # @validate(): Checks if user inputs are vaild
-    metadata, opath, sheets, dryrun = validate(args(sys.argv))
+        if not is_req:
+            continue
 
+        if collection_type == 'Sample':
+            # Check for required sample fields with empty cells
+            if values:
+                errors.append("Failed to provide required field ({}) for {} sample(s): {}".format(field, len(values), ", ".join(values)))
+        # Check for any missing required sub-project fields
+        elif field in mvd_attr and len(values) != Nsubprojects:
+            errors.append("Failed to provide required field ({}) for all sub-projects".format(field))
+        # Check for singular required fields (no MVD relationship)
+        elif field not in mvd_attr and not values:
+            errors.append("Failed to provide required field ({})".format(field))
+        provided.add(field)
+
+    missing = set(requirements) - provided
+
+    return missing, errors
+
+
+def run(metadata, opath, dryrun = False, cache_directory = None):
+    """Lints and parses a project request template, and saves the parsed data as JSON files
+    in the output directory. Exits with an exit-code of 1 if the template contains errors.
+    Returns a tuple of the parsed data dictionary, project and sample metadata. The parsed
+    template cache is kept in the output directory, unless a cache directory is shared
+    across output directories (i.e. by each project of a batch).
+    """
     # Log file directory and parsed pickled data
     logs = os.path.join(opath, "logs")
     path_exists(logs)
@@ -398,31 +740,54 @@ def main():
     if dryrun:
         this_template = 'test_sheet'
 
-    # Get specification for parsing 'Data Dictionary'
-    data_catelog = config["data_dictionary"]["sheet_name"]
-    sort = config["data_dictionary"]["order"]
-    indices = config["data_dictionary"]["index"]
+    # Check for parsed data from a previous run with the same inputs
+    cache_directory = cache_directory or os.path.join(opath, config['.cache']['directory'])
+    cache_route = os.path.join(cache_directory, cache_key(metadata, this_template))
+    parsed = cached(cache_route)
+
+    if parsed:
+        print('Restoring parsed request template from cache: {}'.format(cache_route))
+        meta_dictionary, project_dictionary, sample_dictionary = parsed
+        req_fields = required_fields(meta_dictionary)
+        subprojects = subproject_count(project_dictionary)
+        restore(cache_route, logs)
+
+    else:
+        # Check if spreadsheet contains all required sheets
+        contains_sheets(metadata)
 
-    # Generate Data Dictionary: dict[collection_type][field_name] = list(dme_name, is_required)
-    meta_dictionary, req_fields = meta(sheet = data_catelog, spreadsheet = metadata, order=sort, index=indices, log_route=logs)
+        # Get specification for parsing 'Data Dictionary'
+        data_catelog = config["data_dictionary"]["sheet_name"]
+        sort = config["data_dictionary"]["order"]
+        indices = config["data_dictionary"]["index"]
 
-    # Get specification for parsing 'Project Template'
-    project_info = config["project_template"][this_template]
-    # Get all project metadata from Project Template
-    project_dictionary, subprojects = project(sheet = project_info, spreadsheet = metadata, log_route = logs)
+        # Generate Data Dictionary: dict[collection_type][field_name] = list(dme_name, is_required)
+        meta_dictionary, req_fields = meta(sheet = data_catelog, spreadsheet = metadata, order=sort, index=indices, log_route=logs)
 
-    # Get specification for parsing 'Sample Template'
-    sample_info = config["sample_template"][this_template]
-    # Get all sample metadata from Sample Template
-    sample_dictionary = sample(sheet = sample_info, spreadsheet = metadata, log_route = logs)
+        # Get specification for parsing 'Project Template'
+        project_info = config["project_template"][this_template]
+        # Get all project metadata from Project Template
+        project_dictionary, subprojects = project(sheet = project_info, spreadsheet = metadata, log_route = logs)
+
+        # Get specification for parsing 'Sample Template'
+        sample_info = config["sample_template"][this_template]
+        # Get all sample metadata from Sample Template
+        sample_dictionary = sample(sheet = sample_info, spreadsheet = metadata, log_route = logs)
 
     # Check if user has provided all required check_fields
-    missing = missing_fields(parsed_dict=project_dictionary, data_dict=meta_dictionary, collection_type="Project", requirements=req_fields, Nsubprojects=subprojects)
-    missing = missing_fields(parsed_dict=sample_dictionary, data_dict=meta_dictionary, collection_type="Sample", requirements=missing, ext=['Sample ID'])
+    missing, errors = missing_fields(parsed_dict=project_dictionary, data_dict=meta_dictionary, collection_type="Project", requirements=req_fields, Nsubprojects=subprojects)
+    missing, sample_errors = missing_fields(parsed_dict=sample_dictionary, data_dict=meta_dictionary, collection_type="Sample", requirements=missing, ext=['Sample ID'])
+    errors += sample_errors
 
     if missing:
+        errors.append("Failed to provide required field(s) {}".format(missing))
+
+    if errors:
+        # Report all violations together
         estart, eend = config['.error']
-        print("{}Error:{} Failed to provide required field(s) {}...exiting".format(estart, eend, missing), file=sys.stderr)
+        for error in errors:
+            print("{}Error:{} {}".format(estart, eend, error), file=sys.stderr)
+        print("{}Error:{} Found {} error(s) in the project request template...exiting".format(estart, eend, len(errors)), file=sys.stderr)
         sys.exit(1)
 
     # Save parsed data as JSON file
@@ -435,6 +800,30 @@ def main():
     with open(os.path.join(opath, "sample.json"), 'w') as file:
         json.dump(sample_dictionary, file, sort_keys=True, indent=4)
 
+    # Save validated parsed data for future runs
+    if not parsed:
+        cache(opath, logs, cache_route)
+
+    return meta_dictionary, project_dictionary, sample_dictionary
+
+
+def main():
+    from profiler import option, Profiler
+
+    # @option(): Strips the opt-in --profile option, see profiler.py
+    # @args(): Parses positional command-line args
+    # @validate(): Checks if user inputs are vaild
+    argslist, profile = option(sys.argv)
+    user_inputs = validate(args(argslist))
+    if profile is None:
+        run(*user_inputs)
+        return
+
+    with Profiler(os.path.join(user_inputs[1], 'profiles'), profile, 'lint') as profiler:
+        with profiler.stage('run'):
+            run(*user_inputs)
+
+
 if __name__ == '__main__':
 
     main()
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""profiler: opt-in profiling of each stage of a pyrkit run
+About:
+      This program records where the time of a run is spent when a script is run with
+    the '--profile' option. Each stage of a run is profiled with one of two modes:
+        1. cprofile: a deterministic cProfile dump of the stage (*.prof), which can be
+           opened with pstats or snakeviz. Only the thread running the stage is profiled.
+        2. sample: stack snapshots of all threads taken every 10 milliseconds, saved
+           as collapsed stacks (*.stacks) for flamegraph.pl or speedscope. Use it for
+           long runs, its overhead does not depend on the number of function calls.
+    Profiles are written to DME/profiles/ along with a summary of the top hotspots of
+    the run. Profiling is off by default and nothing is imported or hooked unless the
+    option is given. pyrkit exports PYRKIT_PROFILE (mode) and PYRKIT_PROFILE_DIR to
+    profile each script it runs, and summarizes all of their profiles once at the end.
+    Given a directory of profiles, this program prints a summary of their hotspots.
+USAGE:
+	$ python lint.py ... --profile[=cprofile|sample]
+	$ python profiler.py [-n TOP] PROFILES_DIRECTORY
+Example:
+    $ python lint.py data/experiment_metadata.xlsx DME/ --profile
+    $ python profiler.py -n 30 DME/profiles/ > DME/profiles/hotspots.txt
+"""
+
+from __future__ import print_function
+import sys, os
+
+
+# Supported profiling modes, the first mode is the default
+modes = ['cprofile', 'sample']
+
+# Extension of the profile written by each mode
+extensions = {'cprofile': '.prof', 'sample': '.stacks'}
+
+
+def option(argslist):
+    """Strips the opt-in '--profile[=MODE]' option from command-line args. Profiling is
+    also enabled by the PYRKIT_PROFILE environment variable, i.e. PYRKIT_PROFILE=sample
+    @param argslist list[<str>]:
+        Command-line args, i.e. sys.argv
+    @return argslist, mode <tuple(list[<str>], <str>)>:
+        Command-line args without the option and the profiling mode, or None when
+        profiling is off
+    """
+    mode = os.environ.get('PYRKIT_PROFILE') or None
+    args = []
+    for arg in argslist:
+        if arg == '--profile':
+            mode = modes[0]
+        elif arg.startswith('--profile='):
+            mode = arg.split('=', 1)[1]
+        else:
+            args.append(arg)
+    if mode is not None and mode not in modes:
+        print('Error: Invalid --profile mode {}, choose from: {}'.format(mode, ', '.join(modes)), file=sys.stderr)
+        sys.exit(1)
+
+    return args, mode
+
+
+def _filename(name):
+    """Private function to convert the name of a stage into a filename."""
+    return ''.join(c if c.isalnum() or c in '-_.' else '_' for c in name)
+
+
+class _Sampler(object):
+    """Private class that takes stack snapshots of all threads at a regular interval
+    and counts each collapsed stack, i.e. 'lint.py:run;lint.py:sample 42'
+    @param interval <float>:
+        Time between snapshots in seconds
+    """
+    def __init__(self, interval):
+        import threading
+
+        self.interval = interval
+        self.counts = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target = self._run, name = 'profiler', daemon = True)
+
+    def _run(self):
+        me = self._thread.ident
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                stack = ';'.join(reversed(stack))
+                self.counts[stack] = self.counts.get(stack, 0) + 1
+
+    def enable(self):
+        self._stop.clear()
+        if not self._thread.is_alive():
+            self._thread.start()
+
+    def disable(self):
+        import threading
+
+        self._stop.set()
+        self._thread.join()
+        # Threads cannot be restarted, re-entering the stage creates a new one
+        self._thread = threading.Thread(target = self._run, name = 'profiler', daemon = True)
+
+    def dump(self, filename):
+        with open(filename, 'w') as fh:
+            for stack, count in sorted(self.counts.items()):
+                fh.write('{} {}\n'.format(stack, count))
+
+
+class _Stage(object):
+    """Private context manager that profiles a stage, see Profiler.stage()"""
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.active = False
+
+    def __enter__(self):
+        # Nested stages are included in the profile of the outer stage
+        if self.profiler._active is None:
+            self.profiler._active = self
+            self.active = True
+            self.profiler._profile(self.name).enable()
+        return self
+
+    def __exit__(self, *args):
+        if self.active:
+            self.profiler._profile(self.name).disable()
+            self.profiler._active = None
+            self.active = False
+
+
+class Profiler(object):
+    """Profiles each stage of a run and saves the profiles and a summary of the top
+    hotspots when it is closed. A stage that is entered more than once is saved
+    as one profile. Stages nested in a profiled stage are part of its profile.
+    @param directory <str>:
+        Output directory of the profiles, i.e. DME/profiles, the PYRKIT_PROFILE_DIR
+        environment variable takes precedence
+    @param mode <str>:
+        Profiling mode, see modes
+    @param program <str>:
+        Name of the program, used to name each profile
+    @param interval <float>:
+        Time between stack snapshots in seconds, only used by the sample mode
+    Example:
+        with Profiler('DME/profiles', 'cprofile', 'lint') as profiler:
+            with profiler.stage('run'):
+                run(*user_inputs)
+    """
+    def __init__(self, directory, mode = 'cprofile', program = 'pyrkit', interval = 0.01):
+        self.directory = os.environ.get('PYRKIT_PROFILE_DIR') or directory
+        self.mode = mode
+        self.program = program
+        self.interval = interval
+        self.profiles = {}
+        self._active = None
+
+    def _profile(self, name):
+        """Private method to get or create the profile of a stage."""
+        if name not in self.profiles:
+            if self.mode == 'sample':
+                self.profiles[name] = _Sampler(self.interval)
+            else:
+                import cProfile
+                self.profiles[name] = cProfile.Profile()
+        return self.profiles[name]
+
+    def stage(self, name):
+        """Profiles a stage, use it as a context manager."""
+        return _Stage(self, name)
+
+    def attach(self, tracer, depth = 2):
+        """Profiles the spans of a tracer (see dev/src/benchmark.py) at a given depth as
+        stages, i.e. the stages of an extract span with a depth of 2. Stages are named
+        after the names of their parent spans, i.e. extract.lint
+        @param tracer <benchmark.Tracer>:
+            Tracer of a run, its span() method is wrapped for this run only
+        @param depth <int>:
+            Depth of the spans to profile, where 1 is a top-level span
+        """
+        span, profiler = tracer.span, self
+
+        class _Span(object):
+            def __init__(self, name, **attributes):
+                self.span = span(name, **attributes)
+            def __enter__(self):
+                result = self.span.__enter__()
+                stack = tracer._stack()
+                self.stage = profiler.stage('.'.join(s.name for s in stack)) if len(stack) == depth else None
+                if self.stage:
+                    self.stage.__enter__()
+                return result
+            def __exit__(self, *args):
+                if self.stage:
+                    self.stage.__exit__(*args)
+                return self.span.__exit__(*args)
+
+        tracer.span = _Span
+
+    def close(self):
+        """Saves the profile of each stage and a summary of the top hotspots of the run.
+        The summary is skipped when pyrkit profiles each script it runs, see summary().
+        @return files list[<str>]:
+            Paths of the saved profiles
+        """
+        if self._active is not None:
+            self._active.__exit__()
+        if not self.profiles:
+            return []
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        files = []
+        prefix = '{}.{}'.format(_filename(self.program), os.getpid())
+        for name, profile in self.profiles.items():
+            file = os.path.join(self.directory, '{}.{}{}'.format(prefix, _filename(name), extensions[self.mode]))
+            if self.mode == 'cprofile':
+                profile.dump_stats(file)
+            else:
+                profile.dump(file)
+            files.append(file)
+        if not os.environ.get('PYRKIT_PROFILE'):
+            report = os.path.join(self.directory, '{}.hotspots.txt'.format(prefix))
+            with open(report, 'w') as fh:
+                fh.write(summary(files))
+            print('Saved {} profile(s) to {}, see {}'.format(len(files), self.directory, report), file=sys.stderr)
+        self.profiles = {}
+
+        return files
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _stacks(files, top):
+    """Private function to summarize the hotspots of collapsed stack files.
+    @return lines list[<str>]:
+        Functions with the most samples on top of the stack (self) and in the stack (total)
+    """
+    own, total, samples = {}, {}, 0
+    for file in files:
+        with open(file) as fh:
+            for line in fh:
+                stack, count = line.rstrip('\n').rsplit(' ', 1)
+                frames, count = stack.split(';'), int(count)
+                samples += count
+                own[frames[-1]] = own.get(frames[-1], 0) + count
+                for frame in set(frames):
+                    total[frame] = total.get(frame, 0) + count
+
+    lines = ['Sampled stacks: {} snapshot(s) in {} file(s)'.format(samples, len(files))]
+    for title, counts in [('self', own), ('total', total)]:
+        lines += ['', 'Top {} functions by {} samples:'.format(top, title), '{:>8}  {:>6}  function'.format('samples', 'pct')]
+        for frame, count in sorted(counts.items(), key = lambda fc: (-fc[1], fc[0]))[:top]:
+            lines.append('{:>8}  {:>5.1f}%  {}'.format(count, 100.0 * count / max(samples, 1), frame))
+
+    return lines
+
+
+def _cprofiles(files, top):
+    """Private function to summarize the hotspots of cProfile dumps.
+    @return lines list[<str>]:
+        pstats tables sorted by internal (tottime) and cumulative time
+    """
+    import io, pstats
+
+    stream = io.StringIO()
+    stats = pstats.Stats(files[0], stream = stream)
+    for file in files[1:]:
+        stats.add(file)
+    # Paths of the dumps are listed once below instead of in each table
+    stats.files = []
+    stream.write('cProfile: {} file(s)\n'.format(len(files)))
+    for order in ['tottime', 'cumulative']:
+        stream.write('\nTop {} functions by {}:\n'.format(top, order))
+        stats.sort_stats(order).print_stats(top)
+
+    return stream.getvalue().splitlines()
+
+
+def summary(files, top = 20):
+    """Summarizes the top hotspots of a set of profiles (*.prof and *.stacks files).
+    @param files list[<str>]:
+        Paths of the profiles to summarize
+    @param top <int>:
+        Number of functions to list
+    @return report <str>:
+        Summary of the top hotspots
+    """
+    lines = []
+    cprofiles = sorted(f for f in files if f.endswith(extensions['cprofile']))
+    stacks = sorted(f for f in files if f.endswith(extensions['sample']))
+    if cprofiles:
+        lines += _cprofiles(cprofiles, top)
+    if stacks:
+        lines += ([''] if lines else []) + _stacks(stacks, top)
+
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+
+    # Parse args
+    args = sys.argv[1:]
+    if not args or '-h' in args or '--help' in args:
+        print(__doc__)
+        sys.exit()
+
+    top = 20
+    if '-n' in args:
+        i = args.index('-n')
+        try:
+            top = int(args[i+1])
+        except (IndexError, ValueError):
+            print(__doc__)
+            sys.exit(1)
+        args = args[:i] + args[i+2:]
+    if len(args) != 1 or not os.path.isdir(args[0]):
+        print(__doc__)
+        sys.exit(1)
+
+    files = [os.path.join(args[0], f) for f in sorted(os.listdir(args[0])) if f.endswith(tuple(extensions.values()))]
+    if not files:
+        print('Error: Failed to find any profiles in {}'.format(args[0]), file=sys.stderr)
+        sys.exit(1)
+    sys.stdout.write(summary(files, top))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 from __future__ import print_function, division
 import sys, os, re
-import pandas as pd
+import fscache
 
 # Configuration for defining valid files, cleaning sample names, parse fields, rename fields
 # Add new files to parse and define their specifications below
@@ -223,6 +223,9 @@ USAGE:
 
     Optional Arguments:
         [-h, --help]  Displays usage and help information for the script.
+        [--profile[=MODE]]
+                      Profile the run with cProfile (default) or sampled stacks
+                      (--profile=sample) into DME/profiles, see profiler.py.
 
     Example:
         # Creates QC table: multiqc_matrix.txt in users current working directory
@@ -272,11 +275,13 @@ def isvalid(file):
 
 
 def exists(file):
-    """Checks to see if file exists or is accessible.
-    Avoids problem with inconsistencies across python2.7 and >= python3.4 and
-    works in both major versions of python"""
+    """Checks to see if file exists or is accessible. Existence and permissions
+    are checked once per run, see fscache.py"""
 
+    if fscache.isfile(file) and fscache.access(file, os.R_OK):
+        return True
     try:
+        # Opened only to find out if the file is accessible
         fh = open(file)
         fh.close()
     # File cannot be opened for reading (may not exist) or permissions problem
@@ -440,15 +445,11 @@ def parsed(file, delimeter='\t'):
 
             yield header, parsed_line
 
-def main():
-
-    # Minor Todo(s):
-    #       1. Get rid of pandas dependency (add transpose function and loop through dict to print table)
-    #       2. Add more advanced argument parsing, make path to config an arg
-
-    # Check for usage and optional arguements, get list of files to parse
-    ifiles = args(sys.argv)
-
+def qc(ifiles):
+    """Parses and aggregates QC metadata across all samples from a list of MultiQC files.
+    Unsupported or inaccessible files are skipped. Returns a pandas DataFrame with a
+    row for each sample.
+    """
     # Check if files are supported, see config specification, and if file is readable
     ifiles = [file for file in ifiles if isvalid(file) and exists(file)]
 
@@ -458,6 +459,7 @@ def main():
         for header, line in parsed(file):
             QC = populate_table(header, line, file, QC)
 
+    import pandas as pd
     df = pd.DataFrame(QC).transpose()
 
     # Get default output peference
@@ -468,8 +470,31 @@ def main():
         # Output peference is not defined in config
         pass
 
-    # Write to file
-    df.to_csv('multiqc_matrix.tsv', index = False, sep='\t')
+    return df
+
+
+def main():
+
+    # Minor Todo(s):
+    #       1. Get rid of pandas dependency (add transpose function and loop through dict to print table)
+    #       2. Add more advanced argument parsing, make path to config an arg
+
+    from profiler import option, Profiler
+
+    # Check for usage and optional arguements, get list of files to parse
+    argslist, profile = option(sys.argv)
+    files = args(argslist)
+    if profile is None:
+        qc(files).to_csv('multiqc_matrix.tsv', index = False, sep='\t')
+        return
+
+    # Profiles are saved next to multiqc_matrix.tsv, in the output (working) directory
+    with Profiler(os.path.join(os.getcwd(), 'profiles'), profile, 'pyparser') as profiler:
+        with profiler.stage('qc'):
+            df = qc(files)
+        # Write to file
+        with profiler.stage('write'):
+            df.to_csv('multiqc_matrix.tsv', index = False, sep='\t')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""reformat: reformats RSEM counts matrices for downstream analysis
+About:
+      This program reformats the RSEM counts matrices of a pipeline (i.e.
+    DEG_ALL/RSEM.genes.expected_count.all_samples.txt) for downstream analysis.
+    The first two columns are joined into a single 'symbol' column, i.e.
+    gene_id|GeneName, and the suffix '_expected_count' is removed from each
+    sample name in the header. Each matrix is read once and streamed directly
+    into its destination, and multiple matrices are reformatted in parallel.
+USAGE:
+	$ python reformat.py [-t THREADS] [--sidecar] SOURCE DESTINATION [SOURCE DESTINATION ...]
+Example:
+    $ python reformat.py -t 2 \
+        DEG_ALL/RSEM.genes.expected_count.all_samples.txt RSEM_genes_expected_counts.tsv \
+        DEG_ALL/RSEM.genes.TPM.all_samples.txt RSEM_genes_TPM_normalized.tsv
+"""
+
+from __future__ import print_function
+import sys, os
+
+
+def _header(line):
+    """Private function to reformat the header of a RSEM counts matrix.
+    @param line <str>:
+        Header line of the counts matrix without its newline
+    @return fields list[<str>]:
+        Reformatted header with a symbol column and sample names without suffix
+    """
+    fields = line.split('\t')
+    fields = ['{}|{}'.format(fields[0], fields[1] if len(fields) > 1 else '')] + fields[2:]
+    fields[0] = fields[0].replace('gene_id|GeneName', 'symbol', 1)
+    suffix = '_expected_count'
+
+    return [field[:-len(suffix)] if field.endswith(suffix) else field for field in fields]
+
+
+def _row(line):
+    """Private function to reformat a row of a RSEM counts matrix.
+    @param line <str>:
+        Line of the counts matrix without its newline
+    @return fields list[<str>]:
+        Reformatted row where the first two columns are joined by a pipe
+    """
+    fields = line.split('\t')
+
+    return ['{}|{}'.format(fields[0], fields[1] if len(fields) > 1 else '')] + fields[2:]
+
+
+def reformat(source, destination, sidecar=False):
+    """Streams a RSEM counts matrix into its reformatted destination in a single pass.
+    The destination is written to a temporary file and renamed once it is complete.
+    @param source <str>:
+        RSEM counts matrix to reformat
+    @param destination <str>:
+        Output file of the reformatted counts matrix
+    @param sidecar <bool>:
+        Write a binary sidecar of the matrix in the same pass, see sidecar.py
+    @return destination <str>:
+        Output file of the reformatted counts matrix
+    """
+    tmp = destination + '.tmp'
+    binary = None
+    with open(source) as ifh, open(tmp, 'w') as ofh:
+        for i, line in enumerate(ifh):
+            if i == 0:
+                fields = _header(line.rstrip('\n'))
+                if sidecar:
+                    from sidecar import Writer
+                    binary = Writer(destination, fields[1:])
+            else:
+                fields = _row(line.rstrip('\n'))
+                if binary:
+                    binary.write(fields[0], fields[1:])
+            ofh.write('\t'.join(fields) + '\n')
+    if binary:
+        binary.close()
+    os.rename(tmp, destination)
+
+    return destination
+
+
+def main():
+
+    # Parse args
+    args = sys.argv[1:]
+    if not args or '-h' in args or '--help' in args:
+        print(__doc__)
+        sys.exit()
+
+    sidecar = '--sidecar' in args
+    args = [arg for arg in args if arg != '--sidecar']
+
+    threads = 1
+    for option in ['-t', '--threads']:
+        if option in args:
+            i = args.index(option)
+            try:
+                threads = int(args[i+1])
+            except (IndexError, ValueError):
+                print(__doc__)
+                sys.exit(1)
+            args = args[:i] + args[i+2:]
+
+    if len(args) % 2:
+        print("Error: Failed to provide a destination for each source matrix!", file=sys.stderr)
+        sys.exit(1)
+    sources, destinations = args[0::2], args[1::2]
+
+    if threads <= 1:
+        for source, destination in zip(sources, destinations):
+            print('Creating {}'.format(reformat(source, destination, sidecar)))
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=min(threads, len(sources))) as pool:
+        jobs = [pool.submit(reformat, source, destination, sidecar) for source, destination in zip(sources, destinations)]
+        for job in jobs:
+            print('Creating {}'.format(job.result()))
+
+
+if __name__ == '__main__':
+    main()
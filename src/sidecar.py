@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""sidecar: writes a compact binary copy of a combined matrix
+About:
+      This program writes a memory-mappable binary copy or sidecar of a combined
+    matrix (i.e. combined_TIN.tsv or a RSEM counts matrix). The numeric values of
+    the matrix are stored in a NumPy .npy file (float64, row-major, missing values
+    as NaN), and the row and column names are stored in plain text index files:
+        matrix.tsv  ->  matrix.npy, matrix.rows.txt, matrix.columns.txt
+    The sidecar is written one row at a time, so it can be created in the same pass
+    as the TSV file. Downstream tools can memory-map the values instead of parsing
+    text, i.e. numpy.load('matrix.npy', mmap_mode='r').
+USAGE:
+	$ python sidecar.py [-l LABELS] matrix.tsv [matrix2.tsv ...]
+Example:
+    $ python sidecar.py -l 1 RSEM_genes_expected_counts.tsv RSEM_genes_TPM_normalized.tsv
+"""
+
+from __future__ import print_function
+from array import array
+import sys, os
+
+
+# Reserved size of the .npy header, the header is
+# re-written with the final shape once all rows are known
+header_size = 128
+
+
+def sidecars(filename):
+    """Returns the names of the sidecar files of a combined matrix.
+    @param filename <str>:
+        Name of the combined matrix TSV file
+    @return npy, rows, columns <tuple(<str>, <str>, <str>)>:
+        Names of the binary matrix, row index and column index files
+    """
+    prefix = os.path.splitext(filename)[0]
+
+    return prefix + '.npy', prefix + '.rows.txt', prefix + '.columns.txt'
+
+
+def npy_header(nrows, ncols):
+    """Creates the header of a version 1.0 .npy file padded to header_size bytes.
+    @param nrows <int>:
+        Number of rows in the matrix
+    @param ncols <int>:
+        Number of columns in the matrix
+    @return header <bytes>:
+        Magic string, version, header length and array description
+    """
+    import struct
+
+    descr = '<f8' if sys.byteorder == 'little' else '>f8'
+    info = "{{'descr': '{}', 'fortran_order': False, 'shape': ({}, {}), }}".format(descr, nrows, ncols)
+    info = info.ljust(header_size - 10 - 1) + '\n'
+
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(info)) + info.encode('latin1')
+
+
+def npy_shape(filename):
+    """Reads the shape of the matrix in a sidecar .npy file.
+    @param filename <str>:
+        Name of the .npy file written by Writer
+    @return shape <tuple(<int>, <int>)>:
+        Number of rows and columns in the matrix
+    """
+    import ast
+
+    with open(filename, 'rb') as fh:
+        header = fh.read(header_size)
+
+    return ast.literal_eval(header[10:].decode('latin1'))['shape']
+
+
+class Writer(object):
+    """Writes the sidecar of a combined matrix one row at a time.
+    @param filename <str>:
+        Name of the combined matrix TSV file
+    @param columns list[<str>]:
+        Names of the numeric columns (i.e. sample names)
+    Example:
+        with Writer('combined_TIN.tsv', samples) as sidecar:
+            sidecar.write(transcript_id, tin_values)
+    """
+    def __init__(self, filename, columns):
+        self.npy, self.rows, self.columns = sidecars(filename)
+        self.ncols = len(columns)
+        self.nrows = 0
+        with open(self.columns, 'w') as fh:
+            fh.writelines('{}\n'.format(column) for column in columns)
+        self._data = open(self.npy, 'wb')
+        self._data.write(npy_header(0, self.ncols))
+        self._index = open(self.rows, 'w')
+
+    def write(self, row, values):
+        """Appends a row to the matrix.
+        @param row <str>:
+            Name of the row (i.e. transcript or gene id)
+        @param values list[<str>|<float>]:
+            Values of the row, non-numeric or empty values are stored as NaN
+        """
+        data = array('d')
+        for value in values:
+            try:
+                data.append(float(value))
+            except ValueError:
+                data.append(float('nan'))
+        # Pad or trim the row to the number of columns
+        data.extend(array('d', [float('nan')]) * (self.ncols - len(data)))
+        del data[self.ncols:]
+        self._data.write(data.tobytes())
+        self._index.write('{}\n'.format(row))
+        self.nrows += 1
+
+    def close(self):
+        """Writes the final shape of the matrix into the .npy header and closes the files."""
+        self._data.seek(0)
+        self._data.write(npy_header(self.nrows, self.ncols))
+        self._data.close()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def convert(filename, labels=1):
+    """Writes the sidecar of an existing combined matrix TSV file.
+    @param filename <str>:
+        Name of the combined matrix TSV file
+    @param labels <int>:
+        Number of leading columns containing row names
+    @return npy <str>:
+        Name of the sidecar .npy file
+    """
+    with open(filename) as fh:
+        header = next(fh).rstrip('\n').split('\t')
+        with Writer(filename, header[labels:]) as sidecar:
+            for line in fh:
+                linelist = line.rstrip('\n').split('\t')
+                sidecar.write('\t'.join(linelist[:labels]), linelist[labels:])
+
+    return sidecar.npy
+
+
+def main():
+
+    # Parse args
+    args = sys.argv[1:]
+    if not args or '-h' in args or '--help' in args:
+        print(__doc__)
+        sys.exit()
+
+    labels = 1
+    for option in ['-l', '--labels']:
+        if option in args:
+            i = args.index(option)
+            try:
+                labels = int(args[i+1])
+            except (IndexError, ValueError):
+                print(__doc__)
+                sys.exit(1)
+            args = args[:i] + args[i+2:]
+
+    for filename in args:
+        print('Creating {}'.format(convert(filename, labels)))
+
+
+if __name__ == '__main__':
+    main()
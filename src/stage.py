@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""stage: places local files into the mock upload hierarchy
+About:
+      This program stages pipeline output files into the local mock DME hierarchy
+    (upload/) using the cheapest available materialization for each file:
+        1. reflink: a copy-on-write clone (i.e. btrfs, XFS, GPFS)
+        2. hardlink: on the same device as the source file
+        3. fallback: a symbolic link (default) or a full copy
+    The resolved source path of each staged file is recorded once in a manifest,
+    so later stages (i.e. 'meta sample --staged') do not need to resolve symlinks
+    again. Each line of the manifest contains the destination, the resolved source
+    and the method used to stage the file separated by tabs. Many files can be
+    staged with one call by listing their source and destination, separated by a
+    tab, one pair per line in a pairs file (-p), or on standard input (-p -).
+USAGE:
+	$ python stage.py [-m MANIFEST] [-f symlink|copy] SOURCE DESTINATION [SOURCE DESTINATION ...]
+	$ python stage.py [-m MANIFEST] [-f symlink|copy] -p PAIRS
+Example:
+    $ python stage.py -m DME/staged.tsv WT1.R1.fastq.gz DME/upload/PI_Lab/Project/Sample_WT1/
+    $ printf 'WT1.R1.fastq.gz\\tDME/upload/PI_Lab/Project/Sample_WT1/\\n' | python stage.py -m DME/staged.tsv -p -
+"""
+
+from __future__ import print_function
+import sys, os
+import fscache
+
+
+# Linux ioctl request to clone a file (FICLONE)
+ficlone = 0x40049409
+
+
+def reflink(source, destination):
+    """Creates a copy-on-write clone of a file. Only supported on Linux filesystems
+    that share data extents between files (i.e. btrfs, XFS with reflink=1).
+    @param source <str>:
+        File to clone
+    @param destination <str>:
+        Path of the clone
+    @raises OSError:
+        If the filesystem does not support cloning files
+    """
+    import fcntl
+
+    with open(source, 'rb') as ifh:
+        ofh = open(destination, 'xb')
+        try:
+            fcntl.ioctl(ofh.fileno(), ficlone, ifh.fileno())
+        except (IOError, OSError):
+            ofh.close()
+            os.remove(destination)
+            raise
+        ofh.close()
+
+
+def materialize(source, destination, fallback='symlink'):
+    """Stages a file using the cheapest available method.
+    @param source <str>:
+        Resolved path of the file to stage
+    @param destination <str>:
+        Path of the staged file, must not exist
+    @param fallback <str>:
+        Method used if the file cannot be cloned or hardlinked: symlink or copy
+    @return method <str>:
+        Method used to stage the file: reflink, hardlink, symlink or copy
+    """
+    try:
+        reflink(source, destination)
+        return 'reflink'
+    except (ImportError, IOError, OSError):
+        pass
+
+    if os.stat(source).st_dev == os.stat(os.path.dirname(os.path.abspath(destination))).st_dev:
+        try:
+            os.link(source, destination)
+            return 'hardlink'
+        except OSError:
+            pass  # i.e. filesystem does not support hardlinks
+
+    if fallback == 'copy':
+        from shutil import copyfile
+        copyfile(source, destination)
+    else:
+        os.symlink(source, destination)
+
+    return fallback
+
+
+def stage(source, destination, manifest=None, fallback='symlink'):
+    """Stages a file into a directory or destination path, and records its resolved
+    source path in a manifest.
+    @param source <str>:
+        File to stage, symlinks are resolved once
+    @param destination <str>:
+        Destination directory or path of the staged file
+    @param manifest <str>:
+        Manifest to record the destination, resolved source and method
+    @param fallback <str>:
+        Method used if the file cannot be cloned or hardlinked: symlink or copy
+    @return destination <str>:
+        Absolute path of the staged file
+    """
+    resolved = fscache.realpath(source)
+    if fscache.isdir(destination):
+        destination = os.path.join(destination, os.path.basename(source))
+    destination = os.path.abspath(destination)
+    if os.path.lexists(destination):
+        raise OSError("File '{}' already exists".format(destination))
+
+    method = materialize(resolved, destination, fallback)
+    fscache.invalidate(destination)
+    if manifest:
+        with open(manifest, 'a') as fh:
+            fh.write('{}\t{}\t{}\n'.format(destination, resolved, method))
+
+    return destination
+
+
+def pairs(handle):
+    """Reads source and destination pairs from a tab-delimited file handle.
+    @param handle <file>:
+        Open file handle with one SOURCE<tab>DESTINATION pair per line
+    @return pairs <list>:
+        List of (source, destination) tuples, blank lines are skipped
+    """
+    staged = []
+    for line in handle:
+        line = line.rstrip('\r\n')
+        if not line:
+            continue
+        if '\t' not in line:
+            raise ValueError("Malformed pair '{}', expected SOURCE<tab>DESTINATION".format(line))
+        source, destination = line.split('\t', 1)
+        staged.append((source, destination))
+
+    return staged
+
+
+def main():
+
+    # Parse args
+    args = sys.argv[1:]
+    if not args or '-h' in args or '--help' in args:
+        print(__doc__)
+        sys.exit()
+
+    options = {'manifest': None, 'fallback': 'symlink', 'pairs': None}
+    for option, name in [('-m', 'manifest'), ('-f', 'fallback'), ('-p', 'pairs')]:
+        for flag in [option, '--' + name]:
+            if flag in args:
+                i = args.index(flag)
+                try:
+                    options[name] = args[i+1]
+                except IndexError:
+                    print(__doc__)
+                    sys.exit(1)
+                args = args[:i] + args[i+2:]
+
+    if len(args) % 2 or options['fallback'] not in ['symlink', 'copy']:
+        print(__doc__)
+        sys.exit(1)
+
+    staged = list(zip(args[0::2], args[1::2]))
+    try:
+        if options['pairs'] == '-':
+            staged.extend(pairs(sys.stdin))
+        elif options['pairs']:
+            with open(options['pairs']) as fh:
+                staged.extend(pairs(fh))
+    except (IOError, OSError, ValueError) as e:
+        print("Error: Failed to read pairs '{}': {}".format(options['pairs'], e), file=sys.stderr)
+        sys.exit(1)
+
+    failed = False
+    for source, destination in staged:
+        try:
+            stage(source, destination, options['manifest'], options['fallback'])
+        except (IOError, OSError) as e:
+            print("Error: Failed to stage '{}': {}".format(source, e), file=sys.stderr)
+            failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
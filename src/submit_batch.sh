@@ -0,0 +1,45 @@
+#!/bin/env bash
+set -eu
+
+# USAGE: sbatch -J "pyrkit_batch" --mem=96g --cpus-per-task=16 --time=72:00:00 submit_batch.sh "/path/to/batch/schedule.tsv" "/path/to/dme/repo/HPC_DME_APIs/" 4
+
+# Launches one job to push the local data of a batch of projects into HPC DME
+# Each lane of the schedule uploads its projects one after another, and all lanes
+# upload in parallel, see schedule() in dev/src/pipeline.py
+# @INPUT $1 = Upload schedule, each line contains a lane, number of bytes, DME base directory and DME Vault
+# @INPUT $2 = Path to local git installation of DME CLU toolkit
+# @INPUT $3 = Number of threads of each upload
+
+SCHEDULE="$(readlink -f "${1}")"
+
+# HPC DME API entry point
+export HPC_DM_UTILS="${2%/}/utils"
+source "$HPC_DM_UTILS/functions"
+
+function lane() {
+  # Uploads the projects of a lane one after another, returns non-zero
+  # if any of its uploads failed
+  local id bytes output vault status failed=0
+  while IFS=$'\t' read -r id bytes output vault; do
+    [ "${id}" = "${1}" ] || continue
+    status=0
+    (cd "${output}" && dm_register_directory -s -t "${2}" -e <(echo '**.metadata.json') upload "/${vault#/}") || status=$?
+    echo "Exit status of upload ${output}: ${status}"
+    [ "${status}" -eq 0 ] || failed=1
+  done < "${SCHEDULE}"
+  return "${failed}"
+}
+
+# Upload all lanes in parallel
+pids=()
+for id in $(cut -f1 "${SCHEDULE}" | sort -nu); do
+  lane "${id}" "${3}" &
+  pids+=("$!")
+done
+
+# Wait on each lane, exits non-zero if any upload failed
+failed=0
+for pid in "${pids[@]}"; do
+  wait "${pid}" || failed=1
+done
+exit "${failed}"